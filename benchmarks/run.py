@@ -0,0 +1,250 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from benchmarks.synthetic import SyntheticDump, generate_dump
+
+RESULTS_FILE = Path(__file__).parent / 'results.jsonl'
+
+logger = logging.getLogger()
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    Nearest-rank percentile
+    """
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(len(values) * p / 100 + 0.5) - 1))]
+
+
+def git_commit() -> Optional[str]:
+    root = Path(__file__).parent.parent
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, text=True).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + '+dirty' if dirty.strip() else commit
+
+
+def benchmark_load(dump: SyntheticDump, directory: Path, batch_size: int, workers: int, bulk: bool) -> dict:
+    from load import load
+
+    start = time.perf_counter()
+    result = load(dump.dump_file, dump.mid_textid_file, batch_size=batch_size, workers=workers,
+                  checkpoint_file=str(directory / 'progress.json'),
+                  bulk=str(directory / 'staging') if bulk else None)
+    seconds = time.perf_counter() - start
+    return {
+        'lines': result['lines'],
+        'seconds': seconds,
+        'triples_per_second': result['lines'] / seconds,
+        'phases': result['seconds'],
+        'stages': result['stages']
+    }
+
+
+def prepare_web_database(dump: SyntheticDump, summaries: bool):
+    """
+    Imports the Wikidata mappings and stores the other MIDs as not mapped so that no page waits for
+    the online fallback
+    """
+    from sqlalchemy import create_engine, select
+
+    from freebase.model import Topic, WikidataMapping, get_db_url
+    from freebase.summaries import build_topic_summaries
+    from freebase.wikidata import import_mappings
+    from freebase.writer import insert_ignore_query
+
+    engine = create_engine(get_db_url())
+    import_mappings(engine, dump.mappings_file)
+    with engine.begin() as connection:
+        connection.execute(insert_ignore_query(WikidataMapping, connection.dialect.name).from_select(
+            ['mid'], select([Topic.mid]).where(Topic.mid.isnot(None))))
+    if summaries:
+        build_topic_summaries(engine)
+    engine.dispose()
+
+
+def sample_requests(dump: SyntheticDump, count: int, seed: int) -> List[Tuple[str, str, dict]]:
+    """
+    Requests as (kind, path, headers), popular topics being requested more often
+    """
+    rng = random.Random(seed)
+    languages = ['en', 'fr-FR,fr;q=0.9,en;q=0.5', 'de,en;q=0.5', 'ja']
+    requests = []
+    for _ in range(count):
+        mid = dump.mids[int(len(dump.mids) * rng.random() ** 2)]
+        headers = {'Accept-Language': rng.choice(languages)}
+        kind = rng.random()
+        if kind < 0.6:
+            requests.append(('html', mid, dict(headers, Accept='text/html')))
+        elif kind < 0.8:
+            requests.append(('jsonld', mid, dict(headers, Accept='application/ld+json')))
+        elif kind < 0.9:
+            requests.append(('edges', mid + '/edges', dict(headers, Accept='text/html')))
+        else:
+            # Resolved then redirected to the MID
+            textid = rng.choice(dump.textids)
+            requests.append(('textid', textid, dict(headers, Accept='text/html')))
+    return requests
+
+
+def replay(client, web, requests: List[Tuple[str, str, dict]], cold: bool) -> dict:
+    latencies = defaultdict(list)
+    queries = defaultdict(list)
+    for kind, path, headers in requests:
+        if cold:
+            web.response_cache.clear()
+            web.resolve_path.cache_clear()
+        with web.QueryCounter(web.engine) as counter:
+            start = time.perf_counter()
+            response = client.get(path, headers=headers)
+            response.get_data()
+            latencies[kind].append(time.perf_counter() - start)
+        if response.status_code not in (200, 303):
+            raise ValueError('{} returned {}'.format(path, response.status_code))
+        queries[kind].append(counter.count)
+    return {kind: {
+        'requests': len(latencies[kind]),
+        'p50_ms': percentile(latencies[kind], 50) * 1000,
+        'p99_ms': percentile(latencies[kind], 99) * 1000,
+        'mean_queries': sum(queries[kind]) / len(queries[kind]),
+        'max_queries': max(queries[kind])
+    } for kind in sorted(latencies)}
+
+
+def benchmark_web(dump: SyntheticDump, count: int, seed: int) -> dict:
+    """
+    Replays the requests through the Flask test client, first emptying the caches before each request,
+    then once the caches are filled by a previous pass
+    """
+    os.environ.pop('FREEBASE_SNAPSHOT', None)
+    os.environ.pop('FREEBASE_CACHE_DIR', None)
+    from freebase import web
+
+    client = web.app.test_client()
+    requests = sample_requests(dump, count, seed)
+    replay(client, web, requests[:20], cold=True)  # template compilation and other one time costs
+    cold = replay(client, web, requests, cold=True)
+    replay(client, web, requests, cold=False)  # fills the caches
+    return {'cold': cold, 'warm': replay(client, web, requests, cold=False)}
+
+
+def run(topics: int, seed: int, requests: int, batch_size: int, workers: int, bulk: bool, summaries: bool,
+        directory: Optional[str] = None) -> dict:
+    work_directory = Path(directory or tempfile.mkdtemp(prefix='freebase-benchmark-'))
+    work_directory.mkdir(parents=True, exist_ok=True)
+    database = work_directory / 'benchmark.db'
+    if database.exists():
+        database.unlink()
+    os.environ['FREEBASE_DATABASE_URL'] = 'sqlite:///{}'.format(database)
+    try:
+        start = time.perf_counter()
+        dump = generate_dump(str(work_directory), topics, seed)
+        logger.info('Generated {} lines in {:.1f}s'.format(dump.lines, time.perf_counter() - start))
+        result = {
+            'commit': git_commit(),
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'parameters': {'topics': topics, 'seed': seed, 'requests': requests, 'batch_size': batch_size,
+                           'workers': workers, 'bulk': bulk, 'summaries': summaries},
+            'load': benchmark_load(dump, work_directory, batch_size, workers, bulk)
+        }
+        prepare_web_database(dump, summaries)
+        if requests > 0:
+            result['web'] = benchmark_web(dump, requests, seed)
+        return result
+    finally:
+        if directory is None:
+            shutil.rmtree(str(work_directory))
+
+
+def summary(result: dict) -> dict:
+    """
+    Main figures of a result, flattened
+    """
+    values = {'load triples/s': result['load']['triples_per_second']}
+    for phase, seconds in result['load']['phases'].items():
+        values['load {} s'.format(phase)] = seconds
+    for stage, seconds in result['load'].get('stages', {}).items():
+        values['load {} stage s'.format(stage)] = seconds
+    for mode, kinds in sorted(result.get('web', {}).items()):
+        for kind, stats in kinds.items():
+            values['{} {} p50 ms'.format(mode, kind)] = stats['p50_ms']
+            values['{} {} p99 ms'.format(mode, kind)] = stats['p99_ms']
+            values['{} {} queries'.format(mode, kind)] = stats['mean_queries']
+    return values
+
+
+def compare(results: List[dict]):
+    """
+    Prints the results side by side, with the change of each value relative to the first result
+    """
+    summaries = [summary(result) for result in results]
+    names = list(dict.fromkeys(name for values in summaries for name in values))
+    width = max(len(name) for name in names)
+    print(' ' * width + ''.join('{:>22}'.format(result['commit'] or '?') for result in results))
+    for name in names:
+        base = summaries[0].get(name)
+        cells = []
+        for values in summaries:
+            value = values.get(name)
+            if value is None:
+                cells.append('{:>22}'.format('-'))
+            elif base and values is not summaries[0]:
+                cells.append('{:>13.2f} ({:+5.0%})'.format(value, value / base - 1))
+            else:
+                cells.append('{:>22.2f}'.format(value))
+        print(name.ljust(width) + ''.join(cells))
+
+
+def read_results(path: Path) -> List[dict]:
+    if not path.is_file():
+        return []
+    with path.open('rt') as fp:
+        return [json.loads(line) for line in fp if line.strip()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Loads a synthetic Freebase-shaped dump into a SQLite database and replays topic page requests '
+                    'against it, then appends the timings to the results file')
+    parser.add_argument('--topics', type=int, default=10000, help='number of topics of the synthetic dump')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the dump and of the requests')
+    parser.add_argument('--requests', type=int, default=1000, help='number of replayed requests, 0 to only load')
+    parser.add_argument('--batch-size', type=int, default=10000, help='number of rows written per committed batch')
+    parser.add_argument('--workers', type=int, default=0, help='number of parsing worker processes of the loader')
+    parser.add_argument('--bulk', action='store_true', help='load through staging files')
+    parser.add_argument('--summaries', action='store_true', help='build the topic_summaries table before replaying')
+    parser.add_argument('--directory', help='directory kept with the dump and the database, a temporary one by default')
+    parser.add_argument('--results', default=str(RESULTS_FILE), help='JSON lines file where the results are appended')
+    parser.add_argument('--compare', type=int, metavar='N',
+                        help='only print the last N results of the results file side by side')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    results_file = Path(args.results)
+    if args.compare is not None:
+        compare(read_results(results_file)[-args.compare:])
+    else:
+        result = run(args.topics, args.seed, args.requests, args.batch_size, args.workers, args.bulk, args.summaries,
+                     args.directory)
+        with results_file.open('at') as fp:
+            fp.write(json.dumps(result) + '\n')
+        # Only results obtained with the same parameters are comparable
+        compare([previous for previous in read_results(results_file)
+                 if previous['parameters'] == result['parameters']][-2:])
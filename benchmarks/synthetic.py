@@ -0,0 +1,183 @@
+import gzip
+import random
+from typing import List, NamedTuple
+
+from freebase.ids import MID_ALPHABET
+
+NS = 'http://rdf.freebase.com/ns/'
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+# Languages of the names with the probability for a topic to have a name in it
+LANGUAGES = [('en', 0.9), ('fr', 0.35), ('de', 0.3), ('es', 0.25), ('it', 0.15), ('ja', 0.12), ('zh-Hant', 0.08),
+             ('ru', 0.1)]
+_SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'be', 'do', 'fu', 'ga', 'hi', 'jo', 'ze', 'xu',
+              'an', 'el', 'or', 'é', 'ü', 'ø', 'ñ']
+_PUNCTUATION = ['', '', '', '', ' (film)', ', Jr.', ' & Co', ' "The Great"', "'s", ' - 1984']
+
+
+class SyntheticDump(NamedTuple):
+    dump_file: str
+    mid_textid_file: str
+    mappings_file: str
+    lines: int
+    topics: int
+    mids: List[str]
+    textids: List[str]
+
+
+def synthetic_mid(i: int) -> str:
+    """
+    A MID looking random but unique for each i < 32**6
+    """
+    value = (i * 2654435761) % 32 ** 6
+    return '/m/0' + ''.join(MID_ALPHABET[(value >> (5 * k)) & 0x1F] for k in range(5, -1, -1))
+
+
+def to_url(topic_id: str) -> str:
+    return NS + topic_id[1:].replace('/', '.')
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\t', '\\t')
+
+
+def _encode_key(value: str) -> str:
+    return ''.join(c if c.isascii() and (c.isalnum() or c in '_-') else '${:04X}'.format(ord(c)) for c in value)
+
+
+class _Writer:
+    def __init__(self, fp):
+        self.fp = fp
+        self.lines = 0
+
+    def iri(self, s: str, p: str, o: str):
+        self.fp.write('<{}>\t<{}>\t<{}>\t.\n'.format(s, p, o))
+        self.lines += 1
+
+    def literal(self, s: str, p: str, value: str, language: str = None, datatype: str = None):
+        suffix = '@' + language if language else '^^<{}>'.format(datatype) if datatype else ''
+        self.fp.write('<{}>\t<{}>\t"{}"{}\t.\n'.format(s, p, _escape(value), suffix))
+        self.lines += 1
+
+
+def generate_dump(directory: str, topics: int = 10000, seed: int = 0) -> SyntheticDump:
+    """
+    Writes in directory a gzipped N-Triples dump shaped like the Freebase one, with about 20 lines per topic,
+    the matching type.object.id file and a Wikidata mappings file.
+
+    The output only depends on topics and seed. Topics get names in several languages, descriptions,
+    aliases, types and keys (with $XXXX escapes, some of them filtered by the loader), the schema of the
+    properties is described with type.property.* triples and the number of edges per topic follows a power law,
+    as does the number of incoming edges.
+    """
+    if topics * 3 >= 32 ** 6:
+        raise ValueError('At most {} topics are supported'.format(32 ** 6 // 3))
+    rng = random.Random(seed)
+
+    def name(min_words=1, max_words=3):
+        words = [''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+                 for _ in range(rng.randint(min_words, max_words))]
+        return ' '.join(words) + rng.choice(_PUNCTUATION)
+
+    mid_count = 0
+
+    def next_mid():
+        nonlocal mid_count
+        mid_count += 1
+        return synthetic_mid(mid_count - 1)
+
+    # Schema: domains containing types containing properties, all of them with a MID and a textid
+    domains = ['/' + name(1, 1).split(' ')[0].lower() + str(i) for i in range(max(3, topics // 5000))]
+    types = []
+    properties = []
+    schema_mids = {}
+    for domain in domains:
+        for t in range(6):
+            type_id = '{}/type{}'.format(domain, t)
+            types.append(type_id)
+            schema_mids[type_id] = next_mid()
+            for p in range(8):
+                property_id = '{}/property{}'.format(type_id, p)
+                properties.append((property_id, type_id))
+                schema_mids[property_id] = next_mid()
+    type_properties = {}
+    for property_id, type_id in properties:
+        type_properties.setdefault(type_id, []).append(property_id)
+
+    mids = [next_mid() for _ in range(topics)]
+    textids = []
+    dump_file = '{}/synthetic-{}-{}.nt.gz'.format(directory, topics, seed)
+    mid_textid_file = '{}/synthetic-{}-{}-ids.nt.gz'.format(directory, topics, seed)
+    mappings_file = '{}/synthetic-{}-{}-wikidata.tsv'.format(directory, topics, seed)
+
+    def popular_topic():
+        # Few topics get most of the incoming edges
+        return mids[int(topics * rng.random() ** 3)]
+
+    with gzip.open(dump_file, 'wt', encoding='utf-8') as fp, \
+            gzip.open(mid_textid_file, 'wt', encoding='utf-8') as ids_fp, \
+            open(mappings_file, 'wt', encoding='utf-8') as mappings_fp:
+        dump = _Writer(fp)
+        ids = _Writer(ids_fp)
+        mappings_fp.write('?item\t?mid\t?label\n')
+
+        for schema_id, mid in schema_mids.items():
+            ids.iri(to_url(mid), NS + 'type.object.id', to_url(schema_id))
+            textids.append(schema_id)
+        for type_id in types:
+            s = to_url(schema_mids[type_id])
+            dump.iri(s, NS + 'type.object.type', NS + 'type.type')
+            dump.literal(s, NS + 'type.object.name', name(), 'en')
+        for property_id, type_id in properties:
+            s = to_url(schema_mids[property_id])
+            dump.iri(s, NS + 'type.object.type', NS + 'type.property')
+            dump.literal(s, NS + 'type.object.name', name(), 'en')
+            dump.iri(s, NS + 'type.property.schema', to_url(schema_mids[type_id]))
+            dump.iri(s, NS + 'type.property.expected_type', to_url(schema_mids[rng.choice(types)]))
+            dump.literal(s, NS + 'type.property.unique', rng.choice(['true', 'false']))
+            if rng.random() < 0.2:
+                reverse_id = rng.choice(properties)[0]
+                dump.iri(s, NS + 'type.property.reverse_property', to_url(schema_mids[reverse_id]))
+                dump.iri(to_url(schema_mids[reverse_id]), NS + 'type.property.master_property', s)
+
+        for i, mid in enumerate(mids):
+            s = to_url(mid)
+            english_name = name()
+            for language, probability in LANGUAGES:
+                if rng.random() < probability:
+                    dump.literal(s, NS + 'type.object.name', english_name if language == 'en' else name(), language)
+            if rng.random() < 0.4:
+                dump.literal(s, NS + 'common.topic.description',
+                             '{} is a {}.\n{}'.format(english_name, name(), name(5, 30)), 'en')
+            for _ in range(int(rng.random() ** 4 * 4)):
+                dump.literal(s, NS + 'common.topic.alias', name(), rng.choice(LANGUAGES)[0])
+            topic_types = rng.sample(types, rng.randint(1, 3))
+            for type_id in topic_types:
+                dump.iri(s, NS + 'type.object.type', to_url(type_id))
+            dump.iri(s, NS + 'common.topic.notable_types', to_url(schema_mids[topic_types[0]]))
+
+            if rng.random() < 0.6:
+                dump.literal(s, NS + 'type.object.key', '/wikipedia/en/' + _encode_key(english_name.replace(' ', '_')))
+                dump.literal(s, NS + 'type.object.key', '/wikipedia/en_id/{}'.format(rng.randrange(10 ** 8)))
+            if rng.random() < 0.3:
+                dump.literal(s, NS + 'type.object.key', '/en/' + _encode_key(english_name.lower().replace(' ', '_')))
+            if rng.random() < 0.15:
+                dump.literal(s, NS + 'type.object.key', '/authority/imdb/name/nm{:07d}'.format(rng.randrange(10 ** 7)))
+            if rng.random() < 0.05:
+                textid = '/en/topic_{}'.format(i)
+                ids.iri(s, NS + 'type.object.id', to_url(textid))
+                textids.append(textid)
+            if rng.random() < 0.6:
+                mappings_fp.write('Q{}\t{}\t"{}"@en\n'.format(i + 1, mid, english_name.replace('"', '')))
+
+            candidate_properties = [p for type_id in topic_types for p in type_properties[type_id]]
+            for _ in range(min(int(rng.paretovariate(1.2)) - 1, topics // 2)):
+                dump.iri(s, to_url(rng.choice(candidate_properties)), to_url(popular_topic()))
+            if rng.random() < 0.5:
+                dump.literal(s, to_url(rng.choice(candidate_properties)), '{:.2f}'.format(rng.random() * 100),
+                             datatype=XSD + 'float')
+            # Lines the loader skips
+            dump.iri(s, NS + 'common.topic.article', to_url(next_mid()))
+            if rng.random() < 0.3:
+                dump.literal(s, 'http://www.w3.org/2000/01/rdf-schema#label', english_name, 'en')
+
+    return SyntheticDump(dump_file, mid_textid_file, mappings_file, dump.lines, topics, mids, textids)
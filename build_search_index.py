@@ -0,0 +1,13 @@
+import argparse
+
+from sqlalchemy import create_engine
+
+from freebase.model import get_db_url
+from freebase.search import build_search_index
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Builds the search_terms and search_prefixes tables used by /api/search once the dump is loaded')
+    parser.add_argument('--batch-size', type=int, default=100000, help='number of topic ids or terms per batch')
+    args = parser.parse_args()
+    build_search_index(create_engine(get_db_url(), pool_recycle=3600), args.batch_size)
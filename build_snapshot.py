@@ -0,0 +1,14 @@
+import argparse
+
+from sqlalchemy import create_engine
+
+from freebase.model import get_db_url
+from freebase.snapshot import write_snapshot
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Exports the database to a read-only snapshot that the web app serves when the '
+                    'FREEBASE_SNAPSHOT environment variable is set to its directory')
+    parser.add_argument('directory', help='where to write the snapshot files')
+    args = parser.parse_args()
+    write_snapshot(create_engine(get_db_url(), pool_recycle=3600), args.directory)
@@ -0,0 +1,16 @@
+import argparse
+
+from sqlalchemy import create_engine
+
+from freebase.compact import compact_ids
+from freebase.model import COMPACT_IDS, get_db_url
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Converts the MIDs of an existing database to integers and its keys to bytes. '
+                    'The web app and the scripts must then be run with FREEBASE_COMPACT_IDS=1')
+    parser.add_argument('--batch-size', type=int, default=100000, help='number of rows copied per query')
+    args = parser.parse_args()
+    if not COMPACT_IDS:
+        parser.error('FREEBASE_COMPACT_IDS=1 must be set')
+    compact_ids(create_engine(get_db_url(), pool_recycle=3600), args.batch_size)
@@ -0,0 +1,44 @@
+import argparse
+from multiprocessing import Pool
+
+from sqlalchemy import create_engine, or_, select
+
+from freebase.export import FORMATS, export, export_part, id_ranges, part_path
+from freebase.ids import is_mid
+from freebase.model import COMPACT_IDS, Topic, get_db_url
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Exports the loaded topics as N-Triples, readable again by load.py, or as one JSON-LD document '
+                    'per line, gzipped if the output file name ends with .gz')
+    parser.add_argument('output', help='file to write')
+    parser.add_argument('--format', choices=FORMATS, default='nt', help='output format')
+    parser.add_argument('--notable-type', help='textid or MID of the notable type of the exported topics')
+    parser.add_argument('--start-id', type=int, help='first exported topic id')
+    parser.add_argument('--end-id', type=int, help='topic id after the last exported one')
+    parser.add_argument('--parts', type=int, default=1,
+                        help='number of id ranges exported in parallel to output-000, output-001... '
+                             '(gzipped parts can be concatenated)')
+    parser.add_argument('--batch-size', type=int, default=10000, help='number of topics read per page')
+    args = parser.parse_args()
+
+    database_url = get_db_url()
+    engine = create_engine(database_url, pool_recycle=3600)
+    notable_type_id = None
+    if args.notable_type is not None:
+        notable_type = Topic.textid == args.notable_type
+        if not COMPACT_IDS or is_mid(args.notable_type):
+            notable_type = or_(Topic.mid == args.notable_type, notable_type)
+        notable_type_id = engine.execute(select([Topic.id]).where(notable_type)).scalar()
+        if notable_type_id is None:
+            parser.error('Unknown type: {}'.format(args.notable_type))
+    if args.parts <= 1:
+        export(engine, args.output, args.format, args.start_id, args.end_id, notable_type_id, args.batch_size)
+    else:
+        ranges = [(max(start, args.start_id or start), min(end, args.end_id or end))
+                  for start, end in id_ranges(engine, args.parts)]
+        engine.dispose()
+        with Pool(args.parts) as pool:
+            pool.map(export_part, [
+                (database_url, part_path(args.output, part), args.format, start, end, notable_type_id,
+                 args.batch_size) for part, (start, end) in enumerate(ranges)])
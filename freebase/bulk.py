@@ -0,0 +1,320 @@
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Iterator, List
+
+from sqlalchemy import BigInteger, Column, Integer, MetaData, String, Table, func, inspect, or_, select, text
+from sqlalchemy.types import Boolean, TypeDecorator
+
+from freebase.model import *
+from freebase.writer import FLUSH_ORDER, insert_ignore_query
+
+logger = logging.getLogger()
+
+_escape_regex = re.compile(r'[\\\t\n\r]')
+_escapes = {'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'}
+_unescape_regex = re.compile(r'\\(.)')
+_unescapes = {'\\': '\\', 't': '\t', 'n': '\n', 'r': '\r'}
+
+
+def _to_field(value) -> str:
+    if value is None:
+        return '\\N'
+    if value is True:
+        return '1'
+    if value is False:
+        return '0'
+    return _escape_regex.sub(lambda m: _escapes[m.group(0)], str(value))
+
+
+def _from_field(field: str):
+    if field == '\\N':
+        return None
+    return _unescape_regex.sub(lambda m: _unescapes.get(m.group(1), m.group(1)), field)
+
+
+def staging_columns(table) -> List[str]:
+    return [column.name for column in table.__table__.columns]
+
+
+def read_staging_file(path: Path) -> Iterator[list]:
+    with path.open('rt', encoding='utf-8', newline='\n') as fp:
+        for line in fp:
+            yield [_from_field(field) for field in line.rstrip('\n').split('\t')]
+
+
+class StagingWriter:
+    """
+    Same interface as BatchWriter, but appends the rows to one tab-separated file per table.
+
+    The files use the text format understood by both MySQL LOAD DATA and PostgreSQL COPY (backslash escapes,
+    \\N for NULL). Their sizes are saved at each flush so that a resumed load truncates the rows written
+    after the last checkpoint.
+    """
+
+    def __init__(self, directory: str, batch_size: int = 10000):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self.batches = 0
+        self.flush_seconds = 0.0
+        self.rows = Counter()
+        self.ignored = None  # unknown, duplicates are only removed by import_staging
+        self._size = 0
+        self._sizes_file = self.directory / 'sizes.json'
+        sizes = {}
+        if self._sizes_file.is_file():
+            with self._sizes_file.open('rt') as fp:
+                sizes = json.load(fp)
+        self._files = {}
+        self._columns = {}
+        for table in FLUSH_ORDER:
+            path = self.directory / '{}.tsv'.format(table.__tablename__)
+            fp = path.open('ab')
+            fp.truncate(sizes.get(table.__tablename__, 0))
+            self._files[table] = fp
+            self._columns[table] = staging_columns(table)
+
+    def add(self, table, **row):
+        self._files[table].write(
+            ('\t'.join(_to_field(row.get(column)) for column in self._columns[table]) + '\n').encode())
+        self.rows[table] += 1
+        self._size += 1
+
+    def add_type(self, topic_id: int, type_id: int, notable: bool):
+        self.add(Type, topic_id=topic_id, type_id=type_id, notable=notable)
+
+    def add_property_field(self, topic_id: int, field_name: str, value):
+        self.add(Property, topic_id=topic_id, **{field_name: value})
+
+    @property
+    def should_flush(self) -> bool:
+        return self._size >= self.batch_size
+
+    def maybe_flush(self) -> bool:
+        if self.should_flush:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        start = time.perf_counter()
+        sizes = {}
+        for table, fp in self._files.items():
+            fp.flush()
+            os.fsync(fp.fileno())
+            sizes[table.__tablename__] = fp.tell()
+        tmp_file = self._sizes_file.with_name('sizes.json.tmp')
+        with tmp_file.open('wt') as fp:
+            json.dump(sizes, fp)
+        os.replace(str(tmp_file), str(self._sizes_file))
+        self.batches += 1
+        self._size = 0
+        self.flush_seconds += time.perf_counter() - start
+
+    def close(self):
+        self.flush()
+        for fp in self._files.values():
+            fp.close()
+
+
+def staged_topic_rows(directory: str) -> Iterator[tuple]:
+    """
+    Topics already written to the staging files by a previous run, as (id, mid, textid)
+    """
+    path = Path(directory) / '{}.tsv'.format(Topic.__tablename__)
+    if path.is_file():
+        for topic_id, mid, textid in read_staging_file(path):
+            yield int(topic_id), mid, textid
+
+
+def _staging_type(column):
+    # Booleans are staged as integers so that they can be aggregated with MAX everywhere
+    if isinstance(column.type, Boolean):
+        return Integer
+    # Compact MIDs and keys are staged as text, they are encoded when merged
+    if isinstance(column.type, TypeDecorator):
+        return String(MAX_VARCHAR_SIZE)
+    return column.type
+
+
+def _has_compact_columns(table) -> bool:
+    return any(isinstance(column.type, TypeDecorator) for column in table.__table__.columns)
+
+
+def _staging_table(table, metadata: MetaData) -> Table:
+    columns = [Column(c.name, _staging_type(c)) for c in table.__table__.columns]
+    return Table('staging_' + table.__tablename__, metadata,
+                 Column('seq', BigInteger().with_variant(Integer, 'sqlite'), primary_key=True, autoincrement=True),
+                 *columns)
+
+
+def _copy_into_staging(connection, staging: Table, columns: List[str], path: Path, batch_size: int):
+    dialect = connection.dialect.name
+    column_list = ', '.join(columns)
+    if dialect == 'mysql':
+        connection.execute(text(
+            'LOAD DATA LOCAL INFILE :path INTO TABLE `{}` CHARACTER SET utf8mb4 ({})'.format(
+                staging.name, ', '.join('`{}`'.format(c) for c in columns))),
+            path=str(path.absolute()))
+    elif dialect == 'postgresql':
+        with path.open('rb') as fp:
+            connection.connection.cursor().copy_expert(
+                'COPY {} ({}) FROM STDIN'.format(staging.name, column_list), fp)
+    else:
+        batch = []
+        for fields in read_staging_file(path):
+            batch.append(dict(zip(columns, fields)))
+            if len(batch) >= batch_size:
+                connection.execute(staging.insert(), batch)
+                batch = []
+        if batch:
+            connection.execute(staging.insert(), batch)
+
+
+def _merged_properties(path: Path) -> List[dict]:
+    """
+    Properties are few, so they are merged in memory with the same "last value wins" rule as BatchWriter
+    """
+    columns = staging_columns(Property)
+    properties = {}
+    for fields in read_staging_file(path):
+        topic_id = int(fields[0])
+        merged = properties.setdefault(topic_id, dict.fromkeys(columns))
+        merged['topic_id'] = topic_id
+        for column, value in zip(columns[1:], fields[1:]):
+            if value is not None:
+                merged[column] = value == '1' if column == 'unique' else int(value)
+    return list(properties.values())
+
+
+def _merge_query(table, staging: Table):
+    columns = staging_columns(table)
+    if table is Type:
+        return select([staging.c.topic_id, staging.c.type_id, func.max(staging.c.notable) == 1]) \
+            .group_by(staging.c.topic_id, staging.c.type_id)
+    # The first row wins for each primary key or unique value, as with the INSERT IGNOREs of BatchWriter
+    query = select([staging.c[column] for column in columns])
+    for column in table.__table__.columns:
+        if column.unique:
+            query = query.where(or_(staging.c[column.name].is_(None), staging.c.seq.in_(
+                select([func.min(staging.c.seq)]).group_by(staging.c[column.name]))))
+    return query.order_by(staging.c.seq)
+
+
+def _merge_in_batches(connection, table, staging: Table, batch_size: int):
+    """
+    Merges with keyset pagination on the staging sequence, the rows being encoded in Python by the column types
+    """
+    columns = staging_columns(table)
+    insert = insert_ignore_query(table, connection.dialect.name)
+    query = _merge_query(table, staging).add_columns(staging.c.seq.label('staging_seq')).limit(batch_size)
+    after = 0
+    while True:
+        page = connection.execute(query.where(staging.c.seq > after)).fetchall()
+        if page:
+            connection.execute(insert, [{column: row[column] for column in columns} for row in page])
+        if len(page) < batch_size:
+            return
+        after = page[-1].staging_seq
+
+
+def _unique_constraints(inspector, table) -> List[tuple]:
+    columns = {column.name for column in table.__table__.columns if column.unique}
+    found = {}
+    for constraint in inspector.get_unique_constraints(table.__tablename__):
+        if len(constraint['column_names']) == 1 and constraint['column_names'][0] in columns:
+            found[constraint['name']] = constraint['column_names'][0]
+    for index in inspector.get_indexes(table.__tablename__):
+        if index.get('unique') and len(index['column_names']) == 1 and index['column_names'][0] in columns:
+            found[index['name']] = index['column_names'][0]
+    return list(found.items())
+
+
+def drop_secondary_indexes(connection):
+    """
+    Drops the unique constraints on topics.mid, topics.textid and keys.key and the other secondary indexes.
+    SQLite can not drop constraints, the rows are merged with INSERT OR IGNORE anyway.
+    """
+    dialect = connection.dialect.name
+    if dialect not in ('mysql', 'postgresql'):
+        return
+    inspector = inspect(connection)
+    for table in FLUSH_ORDER:
+        existing = {index['name'] for index in inspector.get_indexes(table.__tablename__)}
+        for index in table.__table__.indexes:
+            if index.name in existing:
+                index.drop(connection)
+        for name, column in _unique_constraints(inspector, table):
+            if dialect == 'mysql':
+                connection.execute(text('ALTER TABLE `{}` DROP INDEX `{}`'.format(table.__tablename__, name)))
+            else:
+                connection.execute(text('ALTER TABLE "{}" DROP CONSTRAINT "{}"'.format(table.__tablename__, name)))
+
+
+def create_secondary_indexes(connection):
+    dialect = connection.dialect.name
+    if dialect not in ('mysql', 'postgresql'):
+        return
+    inspector = inspect(connection)
+    for table in FLUSH_ORDER:
+        existing = {index['name'] for index in inspector.get_indexes(table.__tablename__)}
+        for index in table.__table__.indexes:
+            if index.name not in existing:
+                index.create(connection)
+        present = {column for _, column in _unique_constraints(inspector, table)}
+        for column in table.__table__.columns:
+            if column.unique and column.name not in present:
+                connection.execute(text('ALTER TABLE {} ADD UNIQUE ({})'.format(
+                    connection.dialect.identifier_preparer.quote(table.__tablename__),
+                    connection.dialect.identifier_preparer.quote(column.name))))
+
+
+def import_staging(engine, directory: str, batch_size: int = 10000):
+    """
+    Imports the staging files written by StagingWriter with the native bulk path of the database
+    (LOAD DATA LOCAL INFILE on MySQL, COPY on PostgreSQL, a single executemany transaction otherwise),
+    then merges them into the model tables, deduplicating rows, and rebuilds the secondary indexes.
+
+    On MySQL the connection must allow local infile, e.g. with ?local_infile=1 in the database url.
+    Merging only inserts new rows: it is meant to fill an empty database.
+    """
+    directory = Path(directory)
+    metadata = MetaData()
+    staging_tables = {table: _staging_table(table, metadata) for table in FLUSH_ORDER if table is not Property}
+    with engine.connect() as connection:
+        if connection.dialect.name == 'mysql':
+            connection.execute(text('SET foreign_key_checks = 0'))
+        metadata.drop_all(connection)
+        metadata.create_all(connection)
+        drop_secondary_indexes(connection)
+        for table in FLUSH_ORDER:
+            path = directory / '{}.tsv'.format(table.__tablename__)
+            if not path.is_file():
+                continue
+            if table is Property:
+                with connection.begin():
+                    properties = _merged_properties(path)
+                    if properties:
+                        connection.execute(insert_ignore_query(Property, connection.dialect.name), properties)
+                continue
+            staging = staging_tables[table]
+            with connection.begin():
+                logger.info('Importing {}'.format(path))
+                _copy_into_staging(connection, staging, staging_columns(table), path, batch_size)
+            with connection.begin():
+                logger.info('Merging {}'.format(staging.name))
+                if _has_compact_columns(table):
+                    _merge_in_batches(connection, table, staging, batch_size)
+                else:
+                    connection.execute(insert_ignore_query(table, connection.dialect.name)
+                                       .from_select(staging_columns(table), _merge_query(table, staging)))
+        logger.info('Rebuilding indexes')
+        create_secondary_indexes(connection)
+        metadata.drop_all(connection)
+        if connection.dialect.name == 'mysql':
+            connection.execute(text('SET foreign_key_checks = 1'))
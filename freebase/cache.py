@@ -0,0 +1,87 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import NamedTuple, Optional, Tuple
+
+
+class CachedResponse(NamedTuple):
+    status: int
+    mimetype: str
+    body: bytes
+    etag: str
+    location: Optional[str] = None
+
+
+def make_etag(body: bytes) -> str:
+    return hashlib.sha1(body).hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU cache of rendered responses, bounded by the total size of their bodies,
+    backed by an optional directory where every response is also written.
+
+    The Freebase data is frozen so entries never expire: the disk directory should be emptied when the
+    database or the templates change.
+    """
+
+    def __init__(self, max_size: int = 64 * 1024 * 1024, directory: Optional[str] = None):
+        self.max_size = max_size
+        self.size = 0
+        self.directory = Path(directory) if directory is not None else None
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, ...]) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        if self.directory is None:
+            return None
+        try:
+            with self._path(key).open('rb') as fp:
+                entry = pickle.load(fp)
+        except FileNotFoundError:
+            return None
+        self._put_in_memory(key, entry)
+        return entry
+
+    def put(self, key: Tuple[str, ...], entry: CachedResponse):
+        self._put_in_memory(key, entry)
+        if self.directory is not None:
+            path = self._path(key)
+            tmp_path = path.with_name('{}.{}.tmp'.format(path.name, threading.get_ident()))
+            with tmp_path.open('wb') as fp:
+                pickle.dump(entry, fp)
+            os.replace(str(tmp_path), str(path))
+
+    def clear(self):
+        """
+        Empties the memory tier, the disk directory is kept
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _put_in_memory(self, key: Tuple[str, ...], entry: CachedResponse):
+        if len(entry.body) > self.max_size:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous.body)
+            self._entries[key] = entry
+            self.size += len(entry.body)
+            while self.size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.body)
+
+    def _path(self, key: Tuple[str, ...]) -> Path:
+        return self.directory / hashlib.sha1('\0'.join(key).encode()).hexdigest()
@@ -0,0 +1,203 @@
+import gzip
+import io
+import json
+import os
+import zlib
+from bisect import bisect_right
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+_READ_SIZE = 1024 * 1024
+
+
+class Checkpoint(NamedTuple):
+    """
+    Position in the dump up to which all rows have been committed.
+
+    compressed_offset is an estimate, only used to report the progress.
+    access_point_compressed_offset and access_point_uncompressed_offset give the start of the gzip member
+    containing the position, where decompression can be restarted.
+    """
+    line: int
+    uncompressed_offset: int
+    compressed_offset: int
+    access_point_compressed_offset: int
+    access_point_uncompressed_offset: int
+    batch: int
+
+
+class _GzipMembersRaw(io.RawIOBase):
+    """
+    Decompresses a possibly multi-member gzip file, recording where each member starts
+    """
+
+    def __init__(self, path: str, compressed_offset: int = 0, uncompressed_offset: int = 0):
+        self._file = open(path, 'rb')
+        self._file.seek(compressed_offset)
+        self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        self._pending = memoryview(b'')
+        self._pending_start = 0  # position of the next byte to return in _pending
+        self.compressed_offset = compressed_offset
+        self.uncompressed_offset = uncompressed_offset
+        self.compressed_size = os.fstat(self._file.fileno()).st_size
+        self.access_points_compressed = [compressed_offset]
+        self.access_points_uncompressed = [uncompressed_offset]
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self.uncompressed_offset
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if (offset, whence) == (0, io.SEEK_CUR):
+            return self.uncompressed_offset
+        raise io.UnsupportedOperation('seek')
+
+    def readinto(self, buffer):
+        while self._pending_start == len(self._pending):
+            if self._decompressor.eof:
+                data = self._decompressor.unused_data
+                member_start = self.compressed_offset - len(data)
+                if not data:
+                    data = self._read_compressed()
+                    if not data:
+                        return 0
+                self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                self.access_points_compressed.append(member_start)
+                self.access_points_uncompressed.append(self.uncompressed_offset)
+            else:
+                data = self._read_compressed()
+                if not data:
+                    raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+            self._pending = memoryview(self._decompressor.decompress(data))
+            self._pending_start = 0
+        size = min(len(buffer), len(self._pending) - self._pending_start)
+        buffer[:size] = self._pending[self._pending_start:self._pending_start + size]
+        self._pending_start += size
+        self.uncompressed_offset += size
+        return size
+
+    def access_point(self, uncompressed_offset: int):
+        i = bisect_right(self.access_points_uncompressed, uncompressed_offset) - 1
+        return self.access_points_compressed[i], self.access_points_uncompressed[i]
+
+    def estimate_compressed_offset(self, uncompressed_offset: int) -> int:
+        """
+        Compressed offset of an uncompressed offset already decompressed, interpolated between the start of its
+        gzip member and the start of the next one, or the data decompressed so far
+        """
+        i = bisect_right(self.access_points_uncompressed, uncompressed_offset) - 1
+        start_compressed, start_uncompressed = self.access_points_compressed[i], self.access_points_uncompressed[i]
+        if i + 1 < len(self.access_points_uncompressed):
+            end_compressed, end_uncompressed = self.access_points_compressed[i + 1], \
+                                               self.access_points_uncompressed[i + 1]
+        else:
+            end_compressed = self.compressed_offset - len(self._decompressor.unused_data)
+            end_uncompressed = self.uncompressed_offset + len(self._pending) - self._pending_start
+        if end_uncompressed <= start_uncompressed:
+            return start_compressed
+        return start_compressed + (end_compressed - start_compressed) * \
+            (uncompressed_offset - start_uncompressed) // (end_uncompressed - start_uncompressed)
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+    def _read_compressed(self) -> bytes:
+        data = self._file.read(_READ_SIZE)
+        self.compressed_offset += len(data)
+        return data
+
+
+class DumpReader:
+    """
+    Reads a gzipped dump and is able to restart from a Checkpoint.
+
+    Resuming seeks to the gzip member containing the checkpoint and only decompresses the data from the start
+    of that member. Dumps rewritten with reblock.py have small members so resuming is almost immediate;
+    for single-member files the whole prefix is still decompressed, but not split into lines.
+    """
+
+    def __init__(self, path: str, checkpoint: Optional[Checkpoint] = None):
+        if checkpoint is None:
+            self._raw = _GzipMembersRaw(path)
+        else:
+            self._raw = _GzipMembersRaw(path, checkpoint.access_point_compressed_offset,
+                                        checkpoint.access_point_uncompressed_offset)
+        self.file = io.BufferedReader(self._raw, _READ_SIZE)
+        if checkpoint is not None:
+            to_skip = checkpoint.uncompressed_offset - checkpoint.access_point_uncompressed_offset
+            while to_skip > 0:
+                skipped = len(self.file.read(min(to_skip, _READ_SIZE)))
+                if not skipped:
+                    raise ValueError('The checkpoint is after the end of the dump')
+                to_skip -= skipped
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+    @property
+    def compressed_offset(self) -> int:
+        """
+        Estimated compressed offset of the current position, not of the data buffered or decompressed ahead
+        """
+        return self.compressed_offset_at(self.tell())
+
+    def compressed_offset_at(self, uncompressed_offset: int) -> int:
+        return self._raw.estimate_compressed_offset(uncompressed_offset)
+
+    @property
+    def compressed_size(self) -> int:
+        return self._raw.compressed_size
+
+    def checkpoint(self, line: int, batch: int, uncompressed_offset: Optional[int] = None) -> Checkpoint:
+        """
+        Builds the checkpoint for the current position, or for uncompressed_offset if it has already been read
+        """
+        if uncompressed_offset is None:
+            uncompressed_offset = self.tell()
+        compressed, uncompressed = self._raw.access_point(uncompressed_offset)
+        return Checkpoint(line, uncompressed_offset, self.compressed_offset_at(uncompressed_offset), compressed,
+                          uncompressed, batch)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def save_checkpoint(path: Path, checkpoint: Checkpoint):
+    """
+    Writes the checkpoint atomically so that a crash never leaves a partial file
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    with tmp_path.open('wt') as fp:
+        json.dump(checkpoint._asdict(), fp)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(str(tmp_path), str(path))
+
+
+def read_checkpoint(path: Path) -> Optional[Checkpoint]:
+    if not path.is_file():
+        return None
+    with path.open('rt') as fp:
+        return Checkpoint(**json.load(fp))
+
+
+def reblock(input_file: str, output_file: str, block_size: int = 16 * 1024 * 1024):
+    """
+    Rewrites a gzipped dump as a sequence of independent gzip members of about block_size uncompressed bytes,
+    cut on line boundaries, so that loading can be resumed from any member.
+    """
+    with DumpReader(input_file) as reader, open(output_file, 'wb') as output:
+        while True:
+            lines = reader.file.readlines(block_size)
+            if not lines:
+                break
+            output.write(gzip.compress(b''.join(lines)))
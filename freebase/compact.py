@@ -0,0 +1,106 @@
+import logging
+from typing import List
+
+from sqlalchemy import Column, Integer, MetaData, Table, and_, inspect, or_, select, text
+from sqlalchemy.types import String
+
+from freebase.ids import is_mid
+from freebase.model import *
+
+logger = logging.getLogger()
+
+# Tables with compact columns and their primary key, used for the keyset pagination of the copy
+COMPACT_TABLES = [(Topic, ['id']), (WikidataMapping, ['mid']), (Key, ['topic_id', 'key'])]
+
+
+def is_compact(connection, table) -> bool:
+    columns = {column['name']: column['type'] for column in inspect(connection).get_columns(table.__tablename__)}
+    return not isinstance(columns['key' if table is Key else 'mid'], String)
+
+
+def _copy(connection, source: Table, target: Table, order_columns: List[str], batch_size: int) -> int:
+    """
+    Copies the rows of source into target with keyset pagination on order_columns, the target column types
+    encoding the values. Returns the number of Wikidata mappings skipped because their MID can not be encoded.
+    """
+    order = [source.c[column] for column in order_columns]
+    skipped = 0
+    after = None
+    while True:
+        query = select([source]).order_by(*order).limit(batch_size)
+        if after is not None and len(order) == 1:
+            query = query.where(order[0] > after[0])
+        elif after is not None:
+            query = query.where(or_(order[0] > after[0], and_(order[0] == after[0], order[1] > after[1])))
+        page = connection.execute(query).fetchall()
+        rows = []
+        for row in page:
+            mid = row['mid'] if 'mid' in source.c else None
+            if mid is not None and not is_mid(mid):
+                if source.name != WikidataMapping.__tablename__:
+                    raise ValueError('The MID {} of the topic {} can not be stored as an integer'.format(
+                        mid, row['id']))
+                skipped += 1
+                continue
+            rows.append(dict(row))
+        if rows:
+            connection.execute(target.insert(), rows)
+        if len(page) < batch_size:
+            return skipped
+        after = [page[-1][column] for column in order_columns]
+
+
+def _foreign_keys_to(inspector, name: str) -> List[tuple]:
+    return [(table_name, foreign_key['constrained_columns'], foreign_key['referred_columns'])
+            for table_name in inspector.get_table_names() if table_name != name
+            for foreign_key in inspector.get_foreign_keys(table_name) if foreign_key['referred_table'] == name]
+
+
+def _replace(connection, old_name: str, new_name: str):
+    """
+    Replaces the table old_name by new_name. PostgreSQL drops the foreign keys to the old table, they are created
+    again, MySQL keeps them when the foreign key checks are disabled and SQLite does not check them.
+    """
+    dialect = connection.dialect.name
+    quote = connection.dialect.identifier_preparer.quote
+    foreign_keys = _foreign_keys_to(inspect(connection), old_name) if dialect == 'postgresql' else []
+    connection.execute(text('DROP TABLE {}{}'.format(quote(old_name), ' CASCADE' if dialect == 'postgresql' else '')))
+    connection.execute(text('ALTER TABLE {} RENAME TO {}'.format(quote(new_name), quote(old_name))))
+    for table_name, columns, referred_columns in foreign_keys:
+        connection.execute(text('ALTER TABLE {} ADD FOREIGN KEY ({}) REFERENCES {} ({})'.format(
+            quote(table_name), ', '.join(quote(c) for c in columns), quote(old_name),
+            ', '.join(quote(c) for c in referred_columns))))
+
+
+def compact_ids(engine, batch_size: int = 100000):
+    """
+    Converts the MIDs of topics and wikidata_mappings to integers and the keys to bytes, as stored when
+    FREEBASE_COMPACT_IDS is set. Each table is copied into a new table with the compact columns that then
+    replaces it, so the database needs room for a second copy of the largest of them. Tables already converted
+    are skipped. The Wikidata mappings of MIDs that can not be encoded are dropped, such topic MIDs abort.
+    """
+    if not COMPACT_IDS:
+        raise ValueError('FREEBASE_COMPACT_IDS must be set to convert the database')
+    with engine.connect() as connection:
+        if connection.dialect.name == 'mysql':
+            connection.execute(text('SET foreign_key_checks = 0'))
+        for table, order_columns in COMPACT_TABLES:
+            name = table.__tablename__
+            if not inspect(connection).has_table(name):
+                continue
+            if is_compact(connection, table):
+                logger.info('{} is already compact'.format(name))
+                continue
+            source = Table(name, MetaData(), autoload_with=connection)
+            # The foreign keys to topics of the copy only need the column they refer to
+            metadata = MetaData()
+            Table(Topic.__tablename__, metadata, Column('id', Integer, primary_key=True))
+            target = table.__table__.to_metadata(metadata, name=name + '_compact')
+            with connection.begin():
+                target.drop(connection, checkfirst=True)
+                target.create(connection)
+                skipped = _copy(connection, source, target, order_columns, batch_size)
+                _replace(connection, name, target.name)
+            logger.info('Converted {}{}'.format(name, ', {} mappings dropped'.format(skipped) if skipped else ''))
+        if connection.dialect.name == 'mysql':
+            connection.execute(text('SET foreign_key_checks = 1'))
@@ -0,0 +1,275 @@
+import gzip
+import json
+import logging
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import aliased
+
+from freebase.model import *
+
+logger = logging.getLogger()
+
+FORMATS = ['nt', 'jsonld']
+NS = 'http://rdf.freebase.com/ns/'
+_property_predicates = [
+    ('schema_id', NS + 'type.property.schema'),
+    ('expected_type_id', NS + 'type.property.expected_type'),
+    ('master_id', NS + 'type.property.master_property'),
+    ('reverse_id', NS + 'type.property.reverse_property'),
+    ('unit_id', NS + 'type.property.unit'),
+    ('delegated_id', NS + 'type.property.delegated')
+]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r') \
+        .replace('\t', '\\t')
+
+
+def encode_key(key: str) -> str:
+    """
+    Inverse of load.decode_key: the characters of the key segments that Freebase escapes become $XXXX
+    """
+    return '/'.join(''.join(c if c.isascii() and (c.isalnum() or c in '_-') else '${:04X}'.format(ord(c))
+                            for c in segment) for segment in key.split('/'))
+
+
+def iri(s: str, p: str, o: str) -> str:
+    return '<{}>\t<{}>\t<{}>\t.\n'.format(s, p, o)
+
+
+def literal(s: str, p: str, value: str, language: Optional[str] = None) -> str:
+    return '<{}>\t<{}>\t"{}"{}\t.\n'.format(s, p, _escape(value), '@' + language if language else '')
+
+
+class _Stream:
+    """
+    Rows of a query sorted by topic id (their first column) read with a server-side cursor on a dedicated
+    connection, so that all the streams of a page are merged while being read
+    """
+
+    def __init__(self, connection, query):
+        self._result = connection.execution_options(stream_results=True).execute(query)
+        self._rows = iter(self._result)
+        self._next = next(self._rows, None)
+
+    def take(self, topic_id: int) -> List[tuple]:
+        """
+        Rows of topic_id, skipping the ones of the previous topic ids
+        """
+        while self._next is not None and self._next[0] < topic_id:
+            self._next = next(self._rows, None)
+        rows = []
+        while self._next is not None and self._next[0] == topic_id:
+            rows.append(self._next)
+            self._next = next(self._rows, None)
+        return rows
+
+    def close(self):
+        self._result.close()
+
+
+class TopicRows(NamedTuple):
+    id: int
+    mid: Optional[str]
+    textid: Optional[str]
+    uri: str
+    labels: List[tuple]
+    descriptions: List[tuple]
+    aliases: List[tuple]
+    types: List[tuple]  # (topic id, type uri, notable)
+    keys: List[tuple]
+    properties: List[tuple]  # (topic id, unique, then the uri of each _property_predicates topic or None)
+    edges: List[tuple]  # (subject id, predicate uri, object uri)
+
+
+class Exporter:
+    """
+    Reads the topics of an id range with keyset pagination on their id, batch_size at a time, and the rows of
+    the other tables of each page with one sorted query per table, merged on the topic id.
+    Memory does not depend on the size of the database.
+
+    If notable_type_id is set only the topics with this notable type are exported.
+    """
+
+    def __init__(self, engine, start_id: Optional[int] = None, end_id: Optional[int] = None,
+                 notable_type_id: Optional[int] = None, batch_size: int = 10000, edges: bool = True):
+        self.engine = engine
+        self.start_id = start_id
+        self.end_id = end_id
+        self.notable_type_id = notable_type_id
+        self.batch_size = batch_size
+        self.edges = edges
+
+    def _filter(self, query, column):
+        if self.notable_type_id is not None:
+            query = query.where(column.in_(select([Type.topic_id])
+                                           .where(Type.type_id == self.notable_type_id).where(Type.notable)))
+        return query
+
+    def _pages(self, connection) -> Iterator[List[tuple]]:
+        after = self.start_id - 1 if self.start_id is not None else None
+        while True:
+            query = select([Topic.id, Topic.mid, Topic.textid]).order_by(Topic.id).limit(self.batch_size)
+            if after is not None:
+                query = query.where(Topic.id > after)
+            if self.end_id is not None:
+                query = query.where(Topic.id < self.end_id)
+            page = connection.execute(self._filter(query, Topic.id)).fetchall()
+            if page:
+                yield page
+            if len(page) < self.batch_size:
+                return
+            after = page[-1][0]
+
+    def _queries(self, first_id: int, last_id: int) -> list:
+        def page_of(query, column):
+            return self._filter(query.where(column >= first_id).where(column <= last_id), column)
+
+        queries = [page_of(select([table.topic_id, table.language, table.value])
+                           .order_by(table.topic_id, table.language, table.value), table.topic_id)
+                   for table in (Label, Description, Alias)]
+        type_topic = aliased(Topic)
+        queries.append(page_of(select([Type.topic_id, type_topic.mid, type_topic.textid, Type.notable])
+                               .select_from(Type).join(type_topic, type_topic.id == Type.type_id)
+                               .order_by(Type.topic_id, Type.type_id), Type.topic_id))
+        queries.append(page_of(select([Key.topic_id, Key.key]).order_by(Key.topic_id, Key.key), Key.topic_id))
+        columns = [Property.topic_id, Property.unique]
+        join = Property.__table__
+        for column, _ in _property_predicates:
+            target = aliased(Topic)
+            join = join.outerjoin(target, target.id == getattr(Property, column))
+            columns.extend((target.mid, target.textid))
+        queries.append(page_of(select(columns).select_from(join).order_by(Property.topic_id), Property.topic_id))
+        if self.edges:
+            predicate, object = aliased(Topic), aliased(Topic)
+            queries.append(page_of(select([Edge.subject_id, predicate.mid, predicate.textid,
+                                           object.mid, object.textid])
+                                   .select_from(Edge)
+                                   .join(predicate, predicate.id == Edge.predicate_id)
+                                   .join(object, object.id == Edge.object_id)
+                                   .order_by(Edge.subject_id, Edge.predicate_id, Edge.object_id), Edge.subject_id))
+        return queries
+
+    def __iter__(self) -> Iterator[TopicRows]:
+        connections = [self.engine.connect() for _ in range(8 if self.edges else 7)]
+        try:
+            for page in self._pages(connections[0]):
+                streams = [_Stream(connection, query)
+                           for connection, query in zip(connections[1:], self._queries(page[0][0], page[-1][0]))]
+                for topic_id, mid, textid in page:
+                    rows = [stream.take(topic_id) for stream in streams]
+                    labels, descriptions, aliases, types, keys, properties = rows[:6]
+                    yield TopicRows(
+                        topic_id, mid, textid, topic_uri(mid, textid), labels, descriptions, aliases,
+                        [(row[0], topic_uri(row[1], row[2]), row[3]) for row in types],
+                        keys,
+                        [(row[0], row[1]) + tuple(topic_uri(row[i], row[i + 1]) if row[i] or row[i + 1] else None
+                                                  for i in range(2, len(row), 2)) for row in properties],
+                        [(row[0], topic_uri(row[1], row[2]), topic_uri(row[3], row[4])) for row in rows[6]]
+                        if self.edges else [])
+                for stream in streams:
+                    stream.close()
+        finally:
+            for connection in connections:
+                connection.close()
+
+
+def to_ntriples(topic: TopicRows) -> str:
+    """
+    The triples of the topic as load.py reads them. The type.object.id triple of topics with both a MID and a
+    textid is included so that the output is also its own type.object.id file.
+    """
+    s = topic.uri
+    lines = []
+    if topic.mid is not None and topic.textid is not None:
+        lines.append(iri(topic_uri(topic.mid, None), NS + 'type.object.id', s))
+    lines.extend(literal(s, NS + 'type.object.name', value, language) for _, language, value in topic.labels)
+    lines.extend(literal(s, NS + 'common.topic.description', value, language)
+                 for _, language, value in topic.descriptions)
+    lines.extend(literal(s, NS + 'common.topic.alias', value, language) for _, language, value in topic.aliases)
+    for _, type_uri, notable in topic.types:
+        lines.append(iri(s, NS + 'type.object.type', type_uri))
+        if notable:
+            lines.append(iri(s, NS + 'common.topic.notable_types', type_uri))
+    lines.extend(literal(s, NS + 'type.object.key', encode_key(key)) for _, key in topic.keys)
+    for row in topic.properties:
+        if row[1] is not None:
+            lines.append(literal(s, NS + 'type.property.unique', 'true' if row[1] else 'false'))
+        lines.extend(iri(s, p, o) for (_, p), o in zip(_property_predicates, row[2:]) if o is not None)
+    lines.extend(iri(s, p, o) for _, p, o in topic.edges)
+    return ''.join(lines)
+
+
+def to_jsonld(topic: TopicRows) -> str:
+    """
+    The document of Topic.jsonld, on a single line
+    """
+    return json.dumps({
+        '@context': 'http://schema.org/',
+        '@id': topic.uri,
+        '@type': [type_uri for _, type_uri, _ in topic.types],
+        'name': [{'@value': value, '@language': language} for _, language, value in topic.labels],
+        'description': [{'@value': value, '@language': language} for _, language, value in topic.descriptions],
+        'alternateName': [{'@value': value, '@language': language} for _, language, value in topic.aliases]
+    }) + '\n'
+
+
+def open_output(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt', encoding='utf-8')
+    return open(path, 'wt', encoding='utf-8')
+
+
+def export(engine, output: str, format: str = 'nt', start_id: Optional[int] = None, end_id: Optional[int] = None,
+           notable_type_id: Optional[int] = None, batch_size: int = 10000) -> int:
+    """
+    Writes the topics with ids in [start_id, end_id) to output, gzipped if it ends with .gz, as N-Triples
+    (format nt) or as one JSON-LD document per line (format jsonld). Returns the number of exported topics.
+    """
+    if format not in FORMATS:
+        raise ValueError('Unknown format: {}'.format(format))
+    serialize = to_ntriples if format == 'nt' else to_jsonld
+    count = 0
+    with open_output(output) as fp:
+        for topic in Exporter(engine, start_id, end_id, notable_type_id, batch_size, edges=format == 'nt'):
+            fp.write(serialize(topic))
+            count += 1
+            if count % 1000000 == 0:
+                logger.info('Exported {} topics to {}'.format(count, output))
+    logger.info('Exported {} topics to {}'.format(count, output))
+    return count
+
+
+def id_ranges(engine, parts: int) -> List[Tuple[int, int]]:
+    """
+    Splits the topic ids in parts [start, end) ranges of the same width
+    """
+    min_id, max_id = engine.execute(select([func.min(Topic.id), func.max(Topic.id)])).first()
+    if min_id is None:
+        return [(0, 1)]
+    width = max(1, -(-(max_id - min_id + 1) // parts))
+    return [(start, min(start + width, max_id + 1)) for start in range(min_id, max_id + 1, width)]
+
+
+def part_path(output: str, part: int) -> str:
+    """
+    output with the part number inserted before its extensions, like export-003.nt.gz
+    """
+    path = Path(output)
+    name, dot, extensions = path.name.partition('.')
+    return str(path.with_name('{}-{:03d}{}{}'.format(name, part, dot, extensions)))
+
+
+def export_part(arguments: tuple) -> int:
+    """
+    export() in a worker process, with its own engine
+    """
+    database_url, output, format, start_id, end_id, notable_type_id, batch_size = arguments
+    engine = create_engine(database_url)
+    try:
+        return export(engine, output, format, start_id, end_id, notable_type_id, batch_size)
+    finally:
+        engine.dispose()
@@ -0,0 +1,175 @@
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from typing import Iterable, Optional, Tuple
+
+MID_ALPHABET = '0123456789bcdfghjklmnpqrstvwxyz_'
+MAX_MID_LENGTH = 10
+# Translates MID characters to the digits of int(..., 32), anything else to an invalid digit
+_to_base32 = str.maketrans({chr(c): '!' for c in range(128)})
+_to_base32.update(str.maketrans(MID_ALPHABET, '0123456789abcdefghijklmnopqrstuv'))
+
+
+def mid_to_int(mid: str) -> int:
+    """
+    Packs a MID like /m/0282x or /g/11b6... into an integer smaller than 2**55.
+
+    Layout: bit 54 is set for /g/ MIDs, bits 50-53 store the number of characters (to keep leading zeros)
+    and bits 0-49 the base-32 value of the characters.
+    """
+    if mid.startswith('/m/'):
+        flag = 0
+    elif mid.startswith('/g/'):
+        flag = 1
+    else:
+        raise ValueError('Not a MID: {}'.format(mid))
+    suffix = mid[3:]
+    if not suffix or len(suffix) > MAX_MID_LENGTH or not suffix.isascii():
+        raise ValueError('Not a MID: {}'.format(mid))
+    return (flag << 54) | (len(suffix) << 50) | int(suffix.translate(_to_base32), 32)
+
+
+def int_to_mid(value: int) -> str:
+    length = (value >> 50) & 0xF
+    chars = []
+    for i in range(length):
+        chars.append(MID_ALPHABET[(value >> (5 * (length - i - 1))) & 0x1F])
+    return ('/g/' if value >> 54 else '/m/') + ''.join(chars)
+
+
+def is_mid(value: str) -> bool:
+    """
+    True if value can be packed by mid_to_int
+    """
+    try:
+        mid_to_int(value)
+        return True
+    except ValueError:
+        return False
+
+
+# Namespaces of the keys, stored as their index by key_to_bytes. New namespaces must be appended.
+KEY_NAMESPACES = (
+    '',
+    '/wikipedia/en/', '/wikipedia/fr/', '/wikipedia/de/', '/wikipedia/es/', '/wikipedia/it/', '/wikipedia/ja/',
+    '/wikipedia/pt/', '/wikipedia/ru/', '/wikipedia/zh/', '/wikipedia/nl/', '/wikipedia/pl/', '/wikipedia/sv/',
+    '/wikipedia/',
+    '/authority/imdb/name/', '/authority/imdb/title/', '/authority/musicbrainz/', '/authority/netflix/movie/',
+    '/authority/tvrage/series/', '/authority/iso/', '/authority/',
+    '/source/', '/user/', '/base/', '/film/', '/music/', '/book/', '/people/', '/location/', '/organization/'
+)
+_namespaces_by_length = sorted(enumerate(KEY_NAMESPACES), key=lambda item: -len(item[1]))
+
+
+def key_to_bytes(key: str) -> bytes:
+    """
+    Packs a key as the index of its longest namespace in KEY_NAMESPACES followed by the rest of the key in UTF-8
+    """
+    for index, namespace in _namespaces_by_length:
+        if key.startswith(namespace):
+            return bytes((index,)) + key[len(namespace):].encode('utf-8')
+
+
+def bytes_to_key(data: bytes) -> str:
+    return KEY_NAMESPACES[data[0]] + bytes(data[1:]).decode('utf-8')
+
+
+class _Bucket:
+    __slots__ = ('keys', 'ids', 'pending')
+
+    def __init__(self):
+        self.keys = array('q')
+        self.ids = array('I')
+        self.pending = {}
+
+    def get(self, key: int) -> Optional[int]:
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.ids[i]
+        return self.pending.get(key)
+
+    def merge(self):
+        # The arrays are sorted so Timsort mostly has to merge two runs
+        pairs = sorted(chain(zip(self.keys, self.ids), self.pending.items()))
+        self.keys = array('q', (k for k, _ in pairs))
+        self.ids = array('I', (v for _, v in pairs))
+        self.pending = {}
+
+
+class TopicIdMap:
+    """
+    In-memory mapping from MIDs and textids to topic ids used by the loader.
+
+    MIDs are packed with mid_to_int and stored in 2**bucket_bits hash buckets, each one being a sorted
+    array('q') of packed MIDs with a parallel array('I') of topic ids, so about 12 bytes per MID.
+    Newly assigned MIDs go to a small per-bucket dict that is merged into the arrays once it reaches
+    1/16 of the bucket size, adding less than 8 bytes per MID amortized.
+    Textids are far less numerous and are kept in a plain dict.
+
+    Topic ids are allocated locally, so only one loader should write to a database at a time.
+    """
+
+    def __init__(self, next_id: int = 1, bucket_bits: int = 12):
+        self.next_id = next_id
+        self._mask = (1 << bucket_bits) - 1
+        self._buckets = [_Bucket() for _ in range(1 << bucket_bits)]
+        self._textids = {}
+        self._other_mids = {}  # MIDs that do not fit in mid_to_int
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[int, Optional[str], Optional[str]]], **kwargs) -> 'TopicIdMap':
+        ids = cls(**kwargs)
+        max_id = 0
+        for topic_id, mid, textid in rows:
+            if mid is not None:
+                try:
+                    key = mid_to_int(mid)
+                    bucket = ids._buckets[key & ids._mask]
+                    bucket.keys.append(key)  # sorted once everything is read
+                    bucket.ids.append(topic_id)
+                except ValueError:
+                    ids._other_mids[mid] = topic_id
+            if textid is not None:
+                ids._textids[textid] = topic_id
+            max_id = max(max_id, topic_id)
+        for bucket in ids._buckets:
+            bucket.merge()
+        ids.next_id = max(ids.next_id, max_id + 1)
+        return ids
+
+    def get_mid(self, mid: str) -> Optional[int]:
+        try:
+            key = mid_to_int(mid)
+        except ValueError:
+            return self._other_mids.get(mid)
+        return self._buckets[key & self._mask].get(key)
+
+    def get_textid(self, textid: str) -> Optional[int]:
+        return self._textids.get(textid)
+
+    def add(self, mid: Optional[str] = None, textid: Optional[str] = None) -> int:
+        """
+        Assigns a new topic id to the given MID and/or textid
+        """
+        topic_id = self.next_id
+        self.next_id += 1
+        if mid is not None:
+            self._maybe_merge(self._set_mid(mid, topic_id))
+        if textid is not None:
+            self._textids[textid] = topic_id
+        return topic_id
+
+    def _set_mid(self, mid: str, topic_id: int) -> Optional[_Bucket]:
+        try:
+            key = mid_to_int(mid)
+        except ValueError:
+            self._other_mids[mid] = topic_id
+            return None
+        bucket = self._buckets[key & self._mask]
+        bucket.pending[key] = topic_id
+        return bucket
+
+    @staticmethod
+    def _maybe_merge(bucket: Optional[_Bucket]):
+        if bucket is not None and len(bucket.pending) >= max(64, len(bucket.keys) >> 4):
+            bucket.merge()
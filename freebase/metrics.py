@@ -0,0 +1,140 @@
+import json
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+# Stages of the processing of the dump lines
+STAGES = ['parse', 'filter', 'resolve', 'write']
+
+
+class LoadMetrics:
+    """
+    Counters of a load, reported every interval seconds as a JSON line appended to json_file and/or as a
+    Prometheus textfile (for the node exporter textfile collector) replaced at each report.
+
+    The loader adds the time spent per stage to stages: parsing the lines, filtering the triples into rows,
+    resolving the topic ids and buffering the rows, and writing the batches and checkpoints.
+    The row counts and the database time are read from the writer. The duplicate rows ignored per table are
+    only counted when the driver reports the affected rows of executemany: 'ignored' is null otherwise, as with
+    the staging files whose duplicates are only removed by import_staging.
+    """
+
+    def __init__(self, json_file: Optional[str] = None, prometheus_file: Optional[str] = None,
+                 interval: float = 60.0):
+        self.json_file = Path(json_file) if json_file is not None else None
+        self.prometheus_file = Path(prometheus_file) if prometheus_file is not None else None
+        self.interval = interval
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.phase = None
+        self._start = time.monotonic()
+        self._first_line = 0
+        self._start_offset = None
+        self._last = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.json_file is not None or self.prometheus_file is not None
+
+    def start_phase(self, phase: str, first_line: int = 0, compressed_offset: int = 0):
+        self.phase = phase
+        self._start = time.monotonic()
+        self._first_line = first_line
+        self._start_offset = compressed_offset
+        self._last = None
+
+    def due(self) -> bool:
+        return self.enabled and time.monotonic() - (self._last or {}).get('monotonic', self._start) >= self.interval
+
+    def report(self, lines: int, writer, cache_info=None, compressed_offset: Optional[int] = None,
+               compressed_size: Optional[int] = None) -> dict:
+        values = self.collect(lines, writer, cache_info, compressed_offset, compressed_size)
+        if self.json_file is not None:
+            with self.json_file.open('at') as fp:
+                fp.write(json.dumps(values) + '\n')
+        if self.prometheus_file is not None:
+            tmp_file = self.prometheus_file.with_name(self.prometheus_file.name + '.tmp')
+            with tmp_file.open('wt') as fp:
+                fp.write(to_prometheus(values))
+            os.replace(str(tmp_file), str(self.prometheus_file))
+        return values
+
+    def collect(self, lines: int, writer, cache_info=None, compressed_offset: Optional[int] = None,
+                compressed_size: Optional[int] = None) -> dict:
+        now = time.monotonic()
+        elapsed = now - self._start
+        last = self._last or {'monotonic': self._start, 'lines': self._first_line, 'batches': 0,
+                              'flush_seconds': 0.0}
+        interval = now - last['monotonic']
+        values = {
+            'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'phase': self.phase,
+            'elapsed_seconds': elapsed,
+            'lines': lines,
+            'lines_per_second': (lines - self._first_line) / elapsed if elapsed else 0.0,
+            'interval_lines_per_second': (lines - last['lines']) / interval if interval else 0.0,
+            'stage_seconds': dict(self.stages),
+            'tables': {table.__tablename__: {
+                'rows': count,
+                'ignored': writer.ignored.get(table, 0) if writer.ignored is not None else None,
+                'rows_per_second': count / elapsed if elapsed else 0.0
+            } for table, count in writer.rows.items()},
+            'db': {
+                'flushes': writer.batches,
+                'flush_seconds': writer.flush_seconds,
+                # Mean latency of the flushes since the previous report, it grows with the indexes
+                'interval_mean_flush_seconds': (writer.flush_seconds - last['flush_seconds']) /
+                                               (writer.batches - last['batches'])
+                if writer.batches > last['batches'] else None
+            }
+        }
+        if cache_info is not None:
+            lookups = cache_info.hits + cache_info.misses
+            values['topic_id_cache'] = {
+                'hits': cache_info.hits,
+                'misses': cache_info.misses,
+                'hit_rate': cache_info.hits / lookups if lookups else None
+            }
+        if compressed_offset is not None and compressed_size:
+            read = compressed_offset - (self._start_offset or 0)
+            values['compressed_offset'] = compressed_offset
+            values['compressed_size'] = compressed_size
+            values['progress'] = compressed_offset / compressed_size
+            values['eta_seconds'] = (compressed_size - compressed_offset) * elapsed / read if read > 0 else None
+        self._last = {'monotonic': now, 'lines': lines, 'batches': writer.batches,
+                      'flush_seconds': writer.flush_seconds}
+        return values
+
+
+def to_prometheus(values: dict) -> str:
+    """
+    Formats the values built by LoadMetrics.collect with the Prometheus text exposition format
+    """
+    lines = []
+
+    def add(name: str, kind: str, samples):
+        lines.append('# TYPE freebase_load_{} {}'.format(name, kind))
+        for labels, value in samples:
+            if value is None:
+                continue
+            label_text = ','.join('{}="{}"'.format(k, v) for k, v in labels.items())
+            lines.append('freebase_load_{}{} {}'.format(name, '{' + label_text + '}' if label_text else '', value))
+
+    phase = {'phase': values['phase']}
+    add('lines_total', 'counter', [(phase, values['lines'])])
+    add('elapsed_seconds', 'gauge', [(phase, values['elapsed_seconds'])])
+    add('stage_seconds_total', 'counter',
+        [(dict(phase, stage=stage), seconds) for stage, seconds in values['stage_seconds'].items()])
+    add('rows_total', 'counter', [({'table': table}, v['rows']) for table, v in values['tables'].items()])
+    add('ignored_rows_total', 'counter', [({'table': table}, v['ignored']) for table, v in values['tables'].items()])
+    add('flushes_total', 'counter', [({}, values['db']['flushes'])])
+    add('flush_seconds_total', 'counter', [({}, values['db']['flush_seconds'])])
+    if 'topic_id_cache' in values:
+        add('topic_id_cache_hits_total', 'counter', [({}, values['topic_id_cache']['hits'])])
+        add('topic_id_cache_misses_total', 'counter', [({}, values['topic_id_cache']['misses'])])
+    if 'compressed_offset' in values:
+        add('compressed_bytes_read', 'gauge', [({}, values['compressed_offset'])])
+        add('compressed_bytes_total', 'gauge', [({}, values['compressed_size'])])
+        add('eta_seconds', 'gauge', [({}, values['eta_seconds'])])
+    return '\n'.join(lines) + '\n'
@@ -1,19 +1,77 @@
+import os
 from pathlib import Path
+from typing import Optional
 
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, Index, String, Text, ForeignKey, Boolean, BigInteger, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, backref
+from sqlalchemy.types import TypeDecorator, VARBINARY
+
+from freebase.ids import bytes_to_key, int_to_mid, key_to_bytes, mid_to_int
 
 MAX_VARCHAR_SIZE = 191
+# Opt-in: stores the MIDs as integers and the keys as bytes. It changes the schema, see compact_ids.py.
+COMPACT_IDS = os.environ.get('FREEBASE_COMPACT_IDS', '') not in ('', '0')
 
 
 def get_db_url():
+    if 'FREEBASE_DATABASE_URL' in os.environ:
+        return os.environ['FREEBASE_DATABASE_URL']
     path = Path(__file__).parent.parent / 'database_url.txt'
     if path.is_file():
         with path.open('rt') as fp:
             return fp.read().strip()
     else:
-        raise ValueError('You should create a database_url.txt file with the database url like sqlite:///test.db')
+        raise ValueError('You should create a database_url.txt file with the database url like sqlite:///test.db '
+                         'or set the FREEBASE_DATABASE_URL environment variable')
+
+
+def topic_uri(mid: Optional[str], textid: Optional[str]) -> str:
+    if textid is None:
+        return 'http://rdf.freebase.com/ns/{}'.format(mid.replace('/m/', 'm.').replace('/g/', 'g.'))
+    else:
+        return 'http://rdf.freebase.com/ns/{}'.format(textid[1:].replace('/', '.'))
+
+
+class CompactMid(TypeDecorator):
+    """
+    MID stored as the 64 bits integer of mid_to_int, only the MIDs it accepts can be stored
+    """
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return mid_to_int(value) if value is not None else None
+
+    def process_result_value(self, value, dialect):
+        return int_to_mid(value) if value is not None else None
+
+
+class CompactKey(TypeDecorator):
+    """
+    Key stored as the bytes of key_to_bytes: its namespace is a single byte
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'mysql':
+            return dialect.type_descriptor(VARBINARY(4 * MAX_VARCHAR_SIZE))  # UTF-8 characters are 4 bytes long
+        return dialect.type_descriptor(LargeBinary())
+
+    def process_bind_param(self, value, dialect):
+        return key_to_bytes(value) if value is not None else None
+
+    def process_result_value(self, value, dialect):
+        return bytes_to_key(value) if value is not None else None
+
+
+def mid_type():
+    return CompactMid() if COMPACT_IDS else String(13)
+
+
+def key_type():
+    return CompactKey() if COMPACT_IDS else String(MAX_VARCHAR_SIZE)
 
 
 Base = declarative_base()
@@ -23,7 +81,7 @@ class Topic(Base):
     __tablename__ = 'topics'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    mid = Column(String(13), unique=True, nullable=True)
+    mid = Column(mid_type(), unique=True, nullable=True)
     textid = Column(String(MAX_VARCHAR_SIZE), unique=True, nullable=True)
 
     @property
@@ -40,10 +98,7 @@ class Topic(Base):
 
     @property
     def uri(self):
-        if self.textid is None:
-            return 'http://rdf.freebase.com/ns/{}'.format(self.mid.replace('/m/', 'm.').replace('/g/', 'g.'))
-        else:
-            return 'http://rdf.freebase.com/ns/{}'.format(self.textid[1:].replace('/', '.'))
+        return topic_uri(self.mid, self.textid)
 
 
 class Label(Base):
@@ -88,7 +143,7 @@ class Key(Base):
 
     topic_id = Column(Integer, ForeignKey('topics.id'), nullable=False, primary_key=True)
     topic = relationship(Topic, backref=backref('keys', lazy=True))
-    key = Column(String(MAX_VARCHAR_SIZE), nullable=False, primary_key=True, unique=True)
+    key = Column(key_type(), nullable=False, primary_key=True, unique=True)
 
 
 class Property(Base):
@@ -113,10 +168,72 @@ class Property(Base):
 
 class Edge(Base):
     __tablename__ = 'edges'
+    # Reverse adjacency: incoming edges of a topic grouped by predicate, without reading the table
+    __table_args__ = (Index('edges_object_predicate_subject', 'object_id', 'predicate_id', 'subject_id'),)
 
     subject_id = Column(Integer, ForeignKey('topics.id'), nullable=False, primary_key=True)
     subject = relationship(Topic, foreign_keys=subject_id, backref=backref('outgoing_edges', lazy=True))
     predicate_id = Column(Integer, ForeignKey('topics.id'), nullable=False, primary_key=True)
     predicate = relationship(Topic, foreign_keys=predicate_id)
     object_id = Column(Integer, ForeignKey('topics.id'), nullable=False, primary_key=True)
-    object = relationship(Topic, foreign_keys=object_id)
+    object = relationship(Topic, foreign_keys=object_id, backref=backref('incoming_edges', lazy=True))
+
+
+class WikidataMapping(Base):
+    __tablename__ = 'wikidata_mappings'
+
+    mid = Column(mid_type(), primary_key=True)
+    topic = relationship(Topic, primaryjoin='Topic.mid == WikidataMapping.mid', foreign_keys=mid, viewonly=True,
+                         backref=backref('wikidata', uselist=False, lazy=True, viewonly=True))
+    item = Column(String(MAX_VARCHAR_SIZE), nullable=True)  # NULL if the MID has no item or several ones
+    label = Column(String(MAX_VARCHAR_SIZE), nullable=True)  # English label of the item
+
+
+class TopicSummary(Base):
+    """
+    Label and description of a topic in each of its languages, built by postprocess.py so that the web app
+    fetches the display values of many topics in a single query
+    """
+    __tablename__ = 'topic_summaries'
+
+    topic_id = Column(Integer, ForeignKey('topics.id'), nullable=False, primary_key=True)
+    language = Column(String(5), nullable=False, primary_key=True)
+    label = Column(String(MAX_VARCHAR_SIZE), nullable=True)
+    description = Column(Text, nullable=True)
+
+
+class IncomingEdgeCount(Base):
+    """
+    Number of edges pointing to each topic per predicate, computed at the end of the load so that the pages of
+    hub topics do not count their incoming edges
+    """
+    __tablename__ = 'incoming_edge_counts'
+
+    object_id = Column(Integer, ForeignKey('topics.id'), nullable=False, primary_key=True)
+    predicate_id = Column(Integer, ForeignKey('topics.id'), nullable=False, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+
+class SearchTerm(Base):
+    """
+    Normalized labels, aliases and key names of the topics, and their suffixes starting at a word,
+    with the popularity score of the topic. Built by build_search_index.py.
+    """
+    __tablename__ = 'search_terms'
+
+    term = Column(String(MAX_VARCHAR_SIZE), nullable=False, primary_key=True)
+    topic_id = Column(Integer, ForeignKey('topics.id'), nullable=False, primary_key=True)
+    score = Column(Integer, nullable=False)
+    value = Column(String(MAX_VARCHAR_SIZE), nullable=False)  # the label, alias or key name the term comes from
+
+
+class SearchPrefix(Base):
+    """
+    Best scored topics of the prefixes of search terms that match too many terms to be ranked at query time
+    """
+    __tablename__ = 'search_prefixes'
+
+    prefix = Column(String(MAX_VARCHAR_SIZE), nullable=False, primary_key=True)
+    rank = Column(Integer, nullable=False, primary_key=True)
+    topic_id = Column(Integer, ForeignKey('topics.id'), nullable=False)
+    value = Column(String(MAX_VARCHAR_SIZE), nullable=False)
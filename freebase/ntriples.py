@@ -0,0 +1,94 @@
+import re
+from typing import Callable, NamedTuple, Optional, Tuple, Union
+
+
+class Literal(NamedTuple):
+    value: str
+    language: Optional[str] = None
+    datatype: Optional[str] = None
+
+
+Term = Union[str, Literal]  # IRIs are plain strings
+
+# Same unescaping as rdflib 5 so that both parsers produce the same values
+_escapes = [
+    ('\\t', '\t'),
+    ('\\n', '\n'),
+    ('\\r', '\r'),
+    ('\\b', '\b'),
+    ('\\f', '\f'),
+    ('\\"', '"'),
+    ("\\'", "'"),
+    ('\\\\', '\\')
+]
+_unicode_escape_regex = re.compile(r'\\u([0-9A-Fa-f]{4})|\\U([0-9A-Fa-f]{8})')
+
+
+def unescape(s: str) -> str:
+    if '\\' not in s:
+        return s
+    for escaped, value in _escapes:
+        s = s.replace(escaped, value)
+    return _unicode_escape_regex.sub(lambda m: chr(int(m.group(1) or m.group(2), 16)), s)
+
+
+def _skip_spaces(line: bytes, i: int) -> int:
+    while i < len(line) and line[i] in b' \t':
+        i += 1
+    return i
+
+
+def _parse_iri(line: bytes, i: int) -> Tuple[str, int]:
+    if line[i] != 60:  # <
+        raise ValueError('IRI expected: {!r}'.format(line))
+    end = line.index(b'>', i)
+    return unescape(line[i + 1:end].decode()), end + 1
+
+
+def _parse_object(line: bytes, i: int) -> Term:
+    if line[i] == 60:  # <
+        return _parse_iri(line, i)[0]
+    if line[i] != 34:  # "
+        raise ValueError('Unsupported object: {!r}'.format(line))
+    end = i + 1
+    while True:
+        end = line.index(b'"', end)
+        backslashes = 0
+        while line[end - backslashes - 1] == 92:  # \
+            backslashes += 1
+        if backslashes % 2 == 0:
+            break
+        end += 1
+    value = unescape(line[i + 1:end].decode())
+    end += 1
+    if line[end] == 64:  # @
+        start = end + 1
+        while end < len(line) and line[end] not in b' \t.\r\n':
+            end += 1
+        return Literal(value, line[start:end].decode())
+    if line.startswith(b'^^', end):
+        return Literal(value, None, _parse_iri(line, end + 2)[0])
+    return Literal(value)
+
+
+def parse_line(line: bytes, keep_predicate: Callable[[str], bool] = lambda p: True) \
+        -> Optional[Tuple[str, str, Term]]:
+    """
+    Parses a line of the Freebase N-Triples dump.
+
+    The predicate is decoded first and the subject and object are only decoded if keep_predicate returns True.
+    Returns None for skipped triples, blank lines and comments. Blank nodes are not supported as the
+    Freebase dump does not contain any.
+    """
+    i = _skip_spaces(line, 0)
+    if i >= len(line) or line[i] in b'#\r\n':
+        return None
+    try:
+        subject_end = line.index(b'>', i)
+        predicate, o_start = _parse_iri(line, _skip_spaces(line, subject_end + 1))
+        if not keep_predicate(predicate):
+            return None
+        subject = _parse_iri(line, i)[0]
+        return subject, predicate, _parse_object(line, _skip_spaces(line, o_start))
+    except IndexError:
+        raise ValueError('Invalid N-Triples line: {!r}'.format(line))
@@ -0,0 +1,136 @@
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger()
+
+# Opt-in, configured with environment variables
+ENABLED = os.environ.get('FREEBASE_PROFILING', '') not in ('', '0')
+SLOW_REQUEST_SECONDS = float(os.environ.get('FREEBASE_SLOW_REQUEST_MS', 1000)) / 1000
+SLOW_REQUEST_SAMPLE = float(os.environ.get('FREEBASE_SLOW_REQUEST_SAMPLE', 1))  # fraction of slow requests logged
+PROFILE_DIR = os.environ.get('FREEBASE_PROFILE_DIR')
+PROFILE_TOKEN = os.environ.get('FREEBASE_PROFILE_TOKEN')  # value of the X-Profile header enabling cProfile
+PROFILE_HEADER = 'X-Profile'
+
+_unsafe_file_characters = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+class RequestProfile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timings = {}
+        self.notes = {}
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.profiler = None
+
+    def add(self, name: str, seconds: float):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def server_timing(self, total: float) -> str:
+        metrics = ['total;dur={:.1f}'.format(total * 1000)]
+        if self.queries:
+            metrics.append('db;dur={:.1f};desc="{} queries"'.format(self.query_seconds * 1000, self.queries))
+        metrics.extend('{};dur={:.1f}'.format(name, seconds * 1000) for name, seconds in self.timings.items())
+        metrics.extend('{};desc="{}"'.format(name, value) for name, value in self.notes.items())
+        return ', '.join(metrics)
+
+
+def current_profile() -> Optional[RequestProfile]:
+    if not ENABLED or not has_request_context():
+        return None
+    return g.get('profile')
+
+
+@contextmanager
+def timed(name: str):
+    """
+    Adds the time spent in the block to the name phase of the current request profile
+    """
+    profile = current_profile()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start)
+
+
+def note(name: str, value):
+    """
+    Attaches a value, like the id of the rendered topic, to the current request profile
+    """
+    profile = current_profile()
+    if profile is not None:
+        profile.notes[name] = value
+
+
+def init_app(app, engine=None):
+    """
+    Profiles the requests of app if FREEBASE_PROFILING is set: the SQL statements executed on engine are
+    counted and timed, the phases timed with timed() are reported in the Server-Timing header of the response
+    and requests slower than FREEBASE_SLOW_REQUEST_MS are logged. Requests with an X-Profile header equal to
+    FREEBASE_PROFILE_TOKEN are run under cProfile, the stats being written in FREEBASE_PROFILE_DIR.
+
+    Streamed responses are only profiled until their first byte.
+    Nothing is registered when profiling is disabled.
+    """
+    if not ENABLED:
+        return
+    if engine is not None:
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_start_profile)
+    app.after_request(_end_profile)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['profile_query_start'].pop()
+    profile = current_profile()
+    if profile is not None:
+        profile.queries += 1
+        profile.query_seconds += time.perf_counter() - start
+
+
+def _start_profile():
+    g.profile = RequestProfile()
+    if PROFILE_DIR is not None and PROFILE_TOKEN and request.headers.get(PROFILE_HEADER) == PROFILE_TOKEN:
+        g.profile.profiler = cProfile.Profile()
+        g.profile.profiler.enable()
+
+
+def _end_profile(response):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    total = time.perf_counter() - profile.start
+    if profile.profiler is not None:
+        profile.profiler.disable()
+        Path(PROFILE_DIR).mkdir(parents=True, exist_ok=True)
+        file_name = '{}-{:06d}-{}.prof'.format(time.strftime('%Y%m%dT%H%M%S'), int(time.time() % 1 * 1000000),
+                                               _unsafe_file_characters.sub('_', request.path.strip('/')) or 'index')
+        profile.profiler.dump_stats(str(Path(PROFILE_DIR) / file_name))
+        response.headers['X-Profile-File'] = file_name
+    response.headers['Server-Timing'] = profile.server_timing(total)
+    if total >= SLOW_REQUEST_SECONDS and random.random() < SLOW_REQUEST_SAMPLE:
+        logger.warning('Slow request {} {}: {:.0f} ms, {} queries in {:.0f} ms, {}{}'.format(
+            request.method, request.full_path if request.query_string else request.path, total * 1000,
+            profile.queries, profile.query_seconds * 1000,
+            ', '.join('{} {:.0f} ms'.format(name, seconds * 1000) for name, seconds in profile.timings.items()),
+            ''.join(', {} {}'.format(name, value) for name, value in profile.notes.items())))
+    return response
@@ -0,0 +1,209 @@
+import heapq
+import logging
+import re
+import unicodedata
+from typing import Iterator, List, Set, Tuple
+
+from sqlalchemy import Column, Integer, MetaData, Table, and_, func, inspect, or_, select
+
+from freebase.model import *
+from freebase.writer import insert_ignore_query
+
+logger = logging.getLogger()
+
+SEARCH_RESULTS = 10  # maximum number of results of a search
+# Prefixes matching more than PREFIX_MIN_TERMS terms are ranked in advance, as are all the prefixes up to
+# SHORT_PREFIX_LENGTH characters, so that a search scans at most PREFIX_MIN_TERMS terms
+PREFIX_MIN_TERMS = 1000
+SHORT_PREFIX_LENGTH = 3
+MAX_WORDS = 4  # terms are also indexed from their second to MAX_WORDS-th word
+
+_non_word = re.compile(r'[\W_]+')
+
+scores = Table('search_scores', MetaData(),
+               Column('topic_id', Integer, primary_key=True, autoincrement=False),
+               Column('score', Integer, nullable=False))
+
+
+def normalize(text: str) -> str:
+    """
+    Case folded text without diacritics nor punctuation, words being separated by single spaces
+    """
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return _non_word.sub(' ', text.casefold()).strip()[:MAX_VARCHAR_SIZE]
+
+
+def terms_of(value: str) -> Set[str]:
+    words = normalize(value).split(' ')
+    return {' '.join(words[i:]) for i in range(min(len(words), MAX_WORDS)) if words[i]}
+
+
+def key_name(key: str) -> str:
+    return key.rsplit('/', 1)[-1].replace('_', ' ')
+
+
+def successor(prefix: str) -> str:
+    """
+    Smallest string greater than all the strings starting with prefix
+    """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def build_search_index(engine, batch_size: int = 100000):
+    """
+    Fills search_terms from the labels, aliases and keys, batch_size topic ids at a time, then search_prefixes.
+
+    The score of a topic is its number of incoming edges plus its number of labels.
+    """
+    for table in (SearchPrefix.__table__, SearchTerm.__table__, scores):
+        table.drop(engine, checkfirst=True)
+    for table in (SearchTerm.__table__, SearchPrefix.__table__, scores):
+        table.create(engine)
+    with engine.begin() as connection:
+        if inspect(connection).has_table(IncomingEdgeCount.__tablename__) and \
+                connection.execute(select([IncomingEdgeCount.object_id]).limit(1)).first() is not None:
+            incoming = select([IncomingEdgeCount.object_id, func.sum(IncomingEdgeCount.count)]) \
+                .group_by(IncomingEdgeCount.object_id)
+        else:
+            incoming = select([Edge.object_id, func.count()]).group_by(Edge.object_id)
+        connection.execute(scores.insert().from_select(['topic_id', 'score'], incoming))
+    logger.info('Counted the incoming edges')
+
+    insert = insert_ignore_query(SearchTerm, engine.dialect.name)
+    max_id = engine.execute(select([func.max(Topic.id)])).scalar() or 0
+    for start in range(0, max_id + 1, batch_size):
+        end = start + batch_size
+        values = {}
+        for table, column in ((Label, Label.value), (Alias, Alias.value), (Key, Key.key)):
+            for topic_id, value in engine.execute(select([table.topic_id, column])
+                                                  .where(table.topic_id >= start).where(table.topic_id < end)):
+                values.setdefault(topic_id, []).append(key_name(value) if table is Key else value)
+        topic_scores = {topic_id: 0 for topic_id in values}
+        for topic_id, count in engine.execute(select([Label.topic_id, func.count()])
+                                              .where(Label.topic_id >= start).where(Label.topic_id < end)
+                                              .group_by(Label.topic_id)):
+            topic_scores[topic_id] += count
+        for topic_id, count in engine.execute(select([scores.c.topic_id, scores.c.score])
+                                              .where(scores.c.topic_id >= start).where(scores.c.topic_id < end)):
+            if topic_id in topic_scores:
+                topic_scores[topic_id] += count
+        rows = [{'term': term, 'topic_id': topic_id, 'score': topic_scores[topic_id], 'value': value}
+                for topic_id, topic_values in values.items() for value in topic_values for term in terms_of(value)]
+        if rows:
+            with engine.begin() as connection:
+                connection.execute(insert, rows)
+        logger.info('Indexed the terms of topics {} to {}'.format(start, min(end, max_id + 1) - 1))
+    scores.drop(engine)
+
+    build_prefixes(engine, batch_size)
+
+
+def _iter_terms(engine, batch_size: int) -> Iterator[Tuple[str, int, int, str]]:
+    # Keyset pagination so that no cursor stays open while the prefixes are written
+    after_term, after_topic = '', 0
+    while True:
+        page = engine.execute(
+            select([SearchTerm.term, SearchTerm.topic_id, SearchTerm.score, SearchTerm.value])
+                .where(or_(SearchTerm.term > after_term,
+                           and_(SearchTerm.term == after_term, SearchTerm.topic_id > after_topic)))
+                .order_by(SearchTerm.term, SearchTerm.topic_id).limit(batch_size)).fetchall()
+        yield from page
+        if len(page) < batch_size:
+            return
+        after_term, after_topic = page[-1].term, page[-1].topic_id
+
+
+class _PrefixRanking:
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.terms = 0
+        self.best = []  # heap of (score, -topic_id, value)
+        self.topic_ids = set()
+
+    def add(self, topic_id: int, score: int, value: str):
+        self.terms += 1
+        if topic_id in self.topic_ids:
+            return  # the score is the one of the topic, it does not change
+        if len(self.best) < SEARCH_RESULTS:
+            heapq.heappush(self.best, (score, -topic_id, value))
+            self.topic_ids.add(topic_id)
+        elif (score, -topic_id) > self.best[0][:2]:
+            _, removed, _ = heapq.heapreplace(self.best, (score, -topic_id, value))
+            self.topic_ids.discard(-removed)
+            self.topic_ids.add(topic_id)
+
+    def rows(self) -> List[dict]:
+        if len(self.prefix) > SHORT_PREFIX_LENGTH and self.terms <= PREFIX_MIN_TERMS:
+            return []
+        return [{'prefix': self.prefix, 'rank': rank, 'topic_id': -negative_id, 'value': value}
+                for rank, (_, negative_id, value) in enumerate(sorted(self.best, reverse=True))]
+
+
+def _shared_prefix_length(a: str, b: str) -> int:
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a.startswith(b[:middle]):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def build_prefixes(engine, batch_size: int = 100000):
+    """
+    Fills search_prefixes with a single pass over the search terms in order: the terms sharing a prefix are
+    contiguous so only the rankings of the prefixes of the previous term are kept in memory. Its prefixes longer
+    than SHORT_PREFIX_LENGTH that no other term shares yet are only ranked once a next term shares them.
+    """
+    insert = insert_ignore_query(SearchPrefix, engine.dialect.name)
+    rankings: List[_PrefixRanking] = []  # rankings of the shortest prefixes of the previous term, by length
+    previous = None
+    rows = []
+    for term, topic_id, score, value in _iter_terms(engine, batch_size):
+        shared = _shared_prefix_length(term, previous[0]) if previous is not None else 0
+        for ranking in rankings[shared:]:
+            rows.extend(ranking.rows())
+        del rankings[shared:]
+        for length in range(len(rankings) + 1, shared + 1):
+            rankings.append(_PrefixRanking(term[:length]))
+            rankings[-1].add(*previous[1:])  # the only term with this prefix so far
+        rankings.extend(_PrefixRanking(term[:length])
+                        for length in range(shared + 1, min(len(term), SHORT_PREFIX_LENGTH) + 1))
+        for ranking in rankings:
+            ranking.add(topic_id, score, value)
+        previous = term, topic_id, score, value
+        if len(rows) >= batch_size:
+            with engine.begin() as connection:
+                connection.execute(insert, rows)
+            rows = []
+    for ranking in rankings:
+        rows.extend(ranking.rows())
+    if rows:
+        with engine.begin() as connection:
+            connection.execute(insert, rows)
+    logger.info('Ranked the search prefixes')
+
+
+def search(db, query: str, limit: int = SEARCH_RESULTS) -> List[Tuple[int, str]]:
+    """
+    (topic id, matched label) of the best scored topics with a label, alias or key name starting with
+    the query or having a word starting with it, in at most two indexed queries
+    """
+    prefix = normalize(query)
+    if not prefix:
+        return []
+    results = db.execute(select([SearchPrefix.topic_id, SearchPrefix.value])
+                         .where(SearchPrefix.prefix == prefix)
+                         .order_by(SearchPrefix.rank).limit(limit)).fetchall()
+    if results or len(prefix) <= SHORT_PREFIX_LENGTH:
+        return [(row.topic_id, row.value) for row in results]
+    # Prefixes that are not ranked match at most PREFIX_MIN_TERMS terms, the limit keeps the scan bounded anyway
+    matching = select([SearchTerm.topic_id, SearchTerm.score, SearchTerm.value]) \
+        .where(SearchTerm.term >= prefix).where(SearchTerm.term < successor(prefix)) \
+        .order_by(SearchTerm.term).limit(PREFIX_MIN_TERMS).subquery()
+    score = func.max(matching.c.score).label('score')
+    return [(row.topic_id, row.value) for row in db.execute(
+        select([matching.c.topic_id, score, func.min(matching.c.value).label('value')])
+            .group_by(matching.c.topic_id)
+            .order_by(score.desc(), matching.c.topic_id).limit(limit))]
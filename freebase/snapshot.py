@@ -0,0 +1,481 @@
+import json
+import logging
+import mmap
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import cached_property
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import inspect, select
+
+from freebase.model import *
+
+logger = logging.getLogger()
+
+FORMAT_VERSION = 2
+_FLUSH_SIZE = 1024 * 1024
+_property_columns = ['schema_id', 'expected_type_id', 'master_id', 'reverse_id', 'unit_id', 'delegated_id']
+
+
+class _ArrayWriter:
+    def __init__(self, path: Path, typecode: str):
+        self.typecode = typecode
+        self.count = 0
+        self._file = path.open('wb')
+        self._buffer = array(typecode)
+
+    def append(self, value):
+        self._buffer.append(value)
+        self.count += 1
+        if len(self._buffer) >= _FLUSH_SIZE:
+            self._buffer.tofile(self._file)
+            self._buffer = array(self.typecode)
+
+    def close(self):
+        self._buffer.tofile(self._file)
+        self._file.close()
+
+
+class _StringsWriter:
+    """
+    Strings stored in a .heap file of UTF-8 bytes with their start offsets in a .offsets file
+    """
+
+    def __init__(self, directory: Path, name: str):
+        self._offsets = _ArrayWriter(directory / (name + '.offsets'), 'Q')
+        self._heap = (directory / (name + '.heap')).open('wb')
+        self._size = 0
+        self._offsets.append(0)
+
+    def append(self, value: Optional[str]):
+        data = value.encode() if value else b''
+        self._heap.write(data)
+        self._size += len(data)
+        self._offsets.append(self._size)
+
+    def close(self):
+        self._offsets.close()
+        self._heap.close()
+
+
+class SnapshotWriter:
+    def __init__(self, engine, directory: str):
+        self.engine = engine
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ids = array('I')
+
+    def _rows(self, query):
+        with self.engine.connect() as connection:
+            yield from connection.execution_options(stream_results=True).execute(query)
+
+    def _adjacency(self, name: str, rows, write_row):
+        """
+        Writes the offsets of the rows of each topic, rows being sorted by topic id (their first column)
+        """
+        offsets = _ArrayWriter(self.directory / (name + '.offsets'), 'Q')
+        offsets.append(0)
+        position = 0
+        count = 0
+        for row in rows:
+            while position < len(self.ids) and self.ids[position] < row[0]:
+                position += 1
+                offsets.append(count)
+            if position == len(self.ids) or self.ids[position] != row[0]:
+                continue  # the topic does not exist anymore
+            write_row(row)
+            count += 1
+        while position < len(self.ids):
+            position += 1
+            offsets.append(count)
+        offsets.close()
+        logger.info('Wrote {} {}'.format(count, name))
+
+    def _hash_index(self, name: str):
+        """
+        Open addressing hash table from the strings of a column to their index in it
+        """
+        strings = _Strings(self.directory, name)
+        size = 2
+        while size < 2 * len(strings):
+            size *= 2
+        table = array('I', [0]) * size
+        for i in range(len(strings)):
+            data = strings.bytes(i)
+            if not data:
+                continue
+            slot = zlib.crc32(data) & (size - 1)
+            while table[slot]:
+                slot = (slot + 1) & (size - 1)
+            table[slot] = i + 1
+        with (self.directory / (name + '.hash')).open('wb') as fp:
+            table.tofile(fp)
+        strings.close()
+
+    def write(self):
+        ids = _ArrayWriter(self.directory / 'topics.id', 'I')
+        mids = _StringsWriter(self.directory, 'topics.mid')
+        textids = _StringsWriter(self.directory, 'topics.textid')
+        for topic_id, mid, textid in self._rows(select([Topic.id, Topic.mid, Topic.textid]).order_by(Topic.id)):
+            self.ids.append(topic_id)
+            ids.append(topic_id)
+            mids.append(mid)
+            textids.append(textid)
+        for writer in (ids, mids, textids):
+            writer.close()
+        logger.info('Wrote {} topics'.format(len(self.ids)))
+
+        for table in (Label, Description, Alias):
+            values = _StringsWriter(self.directory, table.__tablename__ + '.value')
+            self._adjacency(table.__tablename__, self._rows(
+                select([table.topic_id, table.language, table.value]).order_by(table.topic_id, table.language)),
+                lambda row: values.append('{}\0{}'.format(row[1], row[2])))
+            values.close()
+
+        type_ids = _ArrayWriter(self.directory / 'types.type', 'I')
+        notables = _ArrayWriter(self.directory / 'types.notable', 'b')
+        self._adjacency('types', self._rows(
+            select([Type.topic_id, Type.type_id, Type.notable]).order_by(Type.topic_id, Type.type_id)),
+            lambda row: (type_ids.append(row[1]), notables.append(bool(row[2]))))
+        type_ids.close()
+        notables.close()
+
+        keys = _StringsWriter(self.directory, 'keys.key')
+        key_topics = _ArrayWriter(self.directory / 'keys.topic', 'I')
+        self._adjacency('keys', self._rows(select([Key.topic_id, Key.key]).order_by(Key.topic_id, Key.key)),
+                        lambda row: (keys.append(row[1]), key_topics.append(row[0])))
+        keys.close()
+        key_topics.close()
+
+        predicates = _ArrayWriter(self.directory / 'edges.predicate', 'I')
+        objects = _ArrayWriter(self.directory / 'edges.object', 'I')
+        self._adjacency('edges', self._rows(
+            select([Edge.subject_id, Edge.predicate_id, Edge.object_id])
+                .order_by(Edge.subject_id, Edge.predicate_id, Edge.object_id)),
+            lambda row: (predicates.append(row[1]), objects.append(row[2])))
+        predicates.close()
+        objects.close()
+
+        incoming_predicates = _ArrayWriter(self.directory / 'incoming.predicate', 'I')
+        subjects = _ArrayWriter(self.directory / 'incoming.subject', 'I')
+        self._adjacency('incoming', self._rows(
+            select([Edge.object_id, Edge.predicate_id, Edge.subject_id])
+                .order_by(Edge.object_id, Edge.predicate_id, Edge.subject_id)),
+            lambda row: (incoming_predicates.append(row[1]), subjects.append(row[2])))
+        incoming_predicates.close()
+        subjects.close()
+
+        schema_properties = _ArrayWriter(self.directory / 'schema_properties.topic', 'I')
+        self._adjacency('schema_properties', self._rows(
+            select([Property.schema_id, Property.topic_id]).where(Property.schema_id.isnot(None))
+                .order_by(Property.schema_id, Property.topic_id)),
+            lambda row: schema_properties.append(row[1]))
+        schema_properties.close()
+
+        property_columns = {column: _ArrayWriter(self.directory / 'properties.{}'.format(column), 'I')
+                            for column in ['topic_id'] + _property_columns}
+        uniques = _ArrayWriter(self.directory / 'properties.unique', 'b')
+        for row in self._rows(select([Property.__table__]).order_by(Property.topic_id)):
+            for column, writer in property_columns.items():
+                writer.append(row[column] or 0)
+            uniques.append(-1 if row['unique'] is None else int(row['unique']))
+        for writer in property_columns.values():
+            writer.close()
+        uniques.close()
+
+        wikidata_topics = _ArrayWriter(self.directory / 'wikidata.topic', 'I')
+        wikidata = _StringsWriter(self.directory, 'wikidata.value')
+        if inspect(self.engine).has_table(WikidataMapping.__tablename__):
+            for topic_id, item, label in self._rows(
+                    select([Topic.id, WikidataMapping.item, WikidataMapping.label])
+                        .select_from(WikidataMapping.__table__.join(Topic.__table__, Topic.mid == WikidataMapping.mid))
+                        .order_by(Topic.id)):
+                wikidata_topics.append(topic_id)
+                wikidata.append('{}\0{}'.format(item or '', label or ''))
+        wikidata_topics.close()
+        wikidata.close()
+
+        for name in ('topics.mid', 'topics.textid', 'keys.key'):
+            self._hash_index(name)
+        with (self.directory / 'snapshot.json').open('wt') as fp:
+            json.dump({'version': FORMAT_VERSION, 'topics': len(self.ids)}, fp)
+
+
+def write_snapshot(engine, directory: str):
+    """
+    Exports the database to a directory of flat files readable by Snapshot
+    """
+    SnapshotWriter(engine, directory).write()
+
+
+def _map(path: Path, typecode: str) -> memoryview:
+    with path.open('rb') as fp:
+        if fp.seek(0, 2) == 0:
+            return memoryview(b'').cast(typecode)
+        return memoryview(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)).cast(typecode)
+
+
+class _Strings:
+    def __init__(self, directory: Path, name: str):
+        self.offsets = _map(directory / (name + '.offsets'), 'Q')
+        self.heap = _map(directory / (name + '.heap'), 'B')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def bytes(self, i: int) -> bytes:
+        return self.heap[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def get(self, i: int) -> Optional[str]:
+        return self.bytes(i).decode() or None
+
+    def close(self):
+        self.offsets.release()
+        self.heap.release()
+
+
+class _HashIndex:
+    def __init__(self, directory: Path, strings: _Strings, name: str):
+        self.strings = strings
+        self.table = _map(directory / (name + '.hash'), 'I')
+
+    def find(self, value: str) -> Optional[int]:
+        data = value.encode()
+        mask = len(self.table) - 1
+        slot = zlib.crc32(data) & mask
+        while self.table[slot]:
+            i = self.table[slot] - 1
+            if self.strings.bytes(i) == data:
+                return i
+            slot = (slot + 1) & mask
+        return None
+
+
+class _Value(NamedTuple):
+    language: str
+    value: str
+
+
+class _Type(NamedTuple):
+    type: 'SnapshotTopic'
+    notable: bool
+
+
+class _Key(NamedTuple):
+    key: str
+
+
+class _Wikidata(NamedTuple):
+    item: Optional[str]
+    label: Optional[str]
+
+
+class _Property(NamedTuple):
+    topic: 'SnapshotTopic'
+    schema: Optional['SnapshotTopic']
+    expected_type: Optional['SnapshotTopic']
+    unique: Optional[bool]
+    master: Optional['SnapshotTopic']
+    reverse: Optional['SnapshotTopic']
+    unit: Optional['SnapshotTopic']
+    delegated: Optional['SnapshotTopic']
+
+
+class SnapshotTopic:
+    """
+    Read-only topic of a Snapshot, with the attributes of model.Topic used by the web app
+    """
+    jsonld = Topic.jsonld
+    uri = Topic.uri
+
+    def __init__(self, snapshot: 'Snapshot', position: int):
+        self.snapshot = snapshot
+        self.position = position
+        self.id = snapshot.ids[position]
+        self.mid = snapshot.mids.get(position)
+        self.textid = snapshot.textids.get(position)
+
+    def _values(self, name: str) -> List[_Value]:
+        offsets, strings = self.snapshot.values[name]
+        return [_Value(*strings.get(i).split('\0', 1))
+                for i in range(offsets[self.position], offsets[self.position + 1])]
+
+    @cached_property
+    def labels(self) -> List[_Value]:
+        return self._values(Label.__tablename__)
+
+    @cached_property
+    def descriptions(self) -> List[_Value]:
+        return self._values(Description.__tablename__)
+
+    @cached_property
+    def aliases(self) -> List[_Value]:
+        return self._values(Alias.__tablename__)
+
+    @cached_property
+    def types(self) -> List[_Type]:
+        s = self.snapshot
+        return [_Type(s.topic(s.type_ids[i]), bool(s.type_notables[i]))
+                for i in range(s.type_offsets[self.position], s.type_offsets[self.position + 1])]
+
+    @cached_property
+    def keys(self) -> List[_Key]:
+        s = self.snapshot
+        return [_Key(s.keys.get(i)) for i in range(s.key_offsets[self.position], s.key_offsets[self.position + 1])]
+
+    @cached_property
+    def as_properties(self) -> List[_Property]:
+        property = self.snapshot.property(self.id)
+        return [property] if property is not None else []
+
+    @cached_property
+    def properties(self) -> List[_Property]:
+        s = self.snapshot
+        return [s.property(s.schema_properties[i]) for i in
+                range(s.schema_property_offsets[self.position], s.schema_property_offsets[self.position + 1])]
+
+    @cached_property
+    def wikidata(self) -> Optional[_Wikidata]:
+        s = self.snapshot
+        i = bisect_left(s.wikidata_topics, self.id)
+        if i == len(s.wikidata_topics) or s.wikidata_topics[i] != self.id:
+            return None
+        item, label = s.wikidata.bytes(i).decode().split('\0', 1)
+        return _Wikidata(item or None, label or None)
+
+
+class Snapshot:
+    """
+    Read-only store written by write_snapshot, served from memory mapped files so that it opens instantly
+    and its pages are shared by all the processes reading it.
+
+    Topics are stored in id order: topics.id is the sorted array of their ids and the other per-topic files
+    are indexed by the position of the topic in it. Labels, types, keys, edges... are adjacency lists: the
+    values of the topic at position i are between offsets[i] and offsets[i + 1]. Edges are sorted by
+    (predicate id, object id), and stored a second time per object topic sorted by (predicate id, subject id)
+    for the incoming edges. MIDs, textids and keys are found with on-disk hash tables.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        with (self.directory / 'snapshot.json').open('rt') as fp:
+            metadata = json.load(fp)
+        if metadata['version'] != FORMAT_VERSION:
+            raise ValueError('Unsupported snapshot version {}'.format(metadata['version']))
+        d = self.directory
+        self.ids = _map(d / 'topics.id', 'I')
+        self.mids = _Strings(d, 'topics.mid')
+        self.textids = _Strings(d, 'topics.textid')
+        self.mid_index = _HashIndex(d, self.mids, 'topics.mid')
+        self.textid_index = _HashIndex(d, self.textids, 'topics.textid')
+        self.values = {table.__tablename__: (_map(d / (table.__tablename__ + '.offsets'), 'Q'),
+                                             _Strings(d, table.__tablename__ + '.value'))
+                       for table in (Label, Description, Alias)}
+        self.type_offsets = _map(d / 'types.offsets', 'Q')
+        self.type_ids = _map(d / 'types.type', 'I')
+        self.type_notables = _map(d / 'types.notable', 'b')
+        self.key_offsets = _map(d / 'keys.offsets', 'Q')
+        self.keys = _Strings(d, 'keys.key')
+        self.key_topics = _map(d / 'keys.topic', 'I')
+        self.key_index = _HashIndex(d, self.keys, 'keys.key')
+        self.edge_offsets = _map(d / 'edges.offsets', 'Q')
+        self.edge_predicates = _map(d / 'edges.predicate', 'I')
+        self.edge_objects = _map(d / 'edges.object', 'I')
+        self.incoming_offsets = _map(d / 'incoming.offsets', 'Q')
+        self.incoming_predicates = _map(d / 'incoming.predicate', 'I')
+        self.incoming_subjects = _map(d / 'incoming.subject', 'I')
+        self.schema_property_offsets = _map(d / 'schema_properties.offsets', 'Q')
+        self.schema_properties = _map(d / 'schema_properties.topic', 'I')
+        self.property_columns = {column: _map(d / 'properties.{}'.format(column), 'I')
+                                 for column in ['topic_id'] + _property_columns}
+        self.property_uniques = _map(d / 'properties.unique', 'b')
+        self.wikidata_topics = _map(d / 'wikidata.topic', 'I')
+        self.wikidata = _Strings(d, 'wikidata.value')
+
+    def position(self, topic_id: int) -> Optional[int]:
+        i = bisect_left(self.ids, topic_id)
+        return i if i < len(self.ids) and self.ids[i] == topic_id else None
+
+    def topic(self, topic_id: int) -> Optional[SnapshotTopic]:
+        position = self.position(topic_id)
+        return SnapshotTopic(self, position) if position is not None else None
+
+    def resolve(self, path: str) -> Optional[Tuple[int, Optional[str]]]:
+        """
+        (id, mid) of the topic with the given MID, textid or key
+        """
+        if path.startswith('/m/') or path.startswith('/g/'):
+            position = self.mid_index.find(path)
+            if position is not None:
+                return self.ids[position], path
+        position = self.textid_index.find(path)
+        if position is None:
+            i = self.key_index.find(path)
+            if i is None:
+                return None
+            position = self.position(self.key_topics[i])
+        return self.ids[position], self.mids.get(position)
+
+    def property(self, topic_id: int) -> Optional[_Property]:
+        topics = self.property_columns['topic_id']
+        i = bisect_left(topics, topic_id)
+        if i == len(topics) or topics[i] != topic_id:
+            return None
+        related = [self.topic(self.property_columns[column][i]) if self.property_columns[column][i] else None
+                   for column in _property_columns]
+        unique = self.property_uniques[i]
+        return _Property(self.topic(topic_id), related[0], related[1], None if unique < 0 else bool(unique),
+                         *related[2:])
+
+    def _adjacency(self, incoming: bool) -> Tuple[memoryview, memoryview, memoryview]:
+        if incoming:
+            return self.incoming_offsets, self.incoming_predicates, self.incoming_subjects
+        return self.edge_offsets, self.edge_predicates, self.edge_objects
+
+    def edge_groups(self, topic: SnapshotTopic, objects_per_predicate: int, incoming: bool = False) \
+            -> List[Tuple[SnapshotTopic, int, List[SnapshotTopic]]]:
+        """
+        (predicate, edge count, first objects) for each predicate of the outgoing edges of the topic,
+        or (predicate, edge count, first subjects) of its incoming edges
+        """
+        offsets, predicates, others = self._adjacency(incoming)
+        groups = []
+        start = offsets[topic.position]
+        end = offsets[topic.position + 1]
+        while start < end:
+            predicate = predicates[start]
+            group_end = bisect_right(predicates, predicate, start, end)
+            groups.append((self.topic(predicate), group_end - start,
+                           [self.topic(others[i])
+                            for i in range(start, min(group_end, start + objects_per_predicate))]))
+            start = group_end
+        return groups
+
+    def iter_edges(self, topic_id: int, predicate_id: Optional[int] = None, after: Tuple[int, int] = (0, 0),
+                   limit: Optional[int] = None, incoming: bool = False) \
+            -> Iterator[Tuple[SnapshotTopic, SnapshotTopic]]:
+        """
+        Same as web.iter_edges
+        """
+        position = self.position(topic_id)
+        if position is None:
+            return
+        offsets, predicates, others = self._adjacency(incoming)
+        start = offsets[position]
+        end = offsets[position + 1]
+        if predicate_id is not None:
+            start = bisect_left(predicates, predicate_id, start, end)
+            end = bisect_right(predicates, predicate_id, start, end)
+        after_start = bisect_left(predicates, after[0], start, end)
+        after_end = bisect_right(predicates, after[0], after_start, end)
+        start = max(start, bisect_right(others, after[1], after_start, after_end)
+                    if after_start < after_end else after_start)
+        if limit is not None:
+            end = min(end, start + limit)
+        predicate = None
+        for i in range(start, end):
+            if predicate is None or predicate.id != predicates[i]:
+                predicate = self.topic(predicates[i])
+            yield predicate, self.topic(others[i])
@@ -0,0 +1,56 @@
+import logging
+
+from sqlalchemy import and_, func, select, union
+
+from freebase.model import *
+
+logger = logging.getLogger()
+
+
+def build_topic_summaries(engine, batch_size: int = 1000000):
+    """
+    Fills the topic_summaries table from the labels and descriptions tables, batch_size topic ids
+    per INSERT ... SELECT. All the languages are kept: the JSON-LD of the topic pages is built from it.
+    """
+    table = TopicSummary.__table__
+    table.drop(engine, checkfirst=True)
+    table.create(engine)
+    max_id = engine.execute(select([func.max(Topic.id)])).scalar() or 0
+    for start in range(0, max_id + 1, batch_size):
+        end = start + batch_size
+        sources = []
+        for source in (Label, Description):
+            sources.append(select([source.topic_id, source.language])
+                           .where(source.topic_id >= start).where(source.topic_id < end))
+        ids = union(*sources).alias('ids')
+        labels = Label.__table__
+        descriptions = Description.__table__
+        query = select([ids.c.topic_id, ids.c.language, labels.c.value, descriptions.c.value]).select_from(
+            ids.outerjoin(labels, and_(labels.c.topic_id == ids.c.topic_id, labels.c.language == ids.c.language))
+                .outerjoin(descriptions, and_(descriptions.c.topic_id == ids.c.topic_id,
+                                              descriptions.c.language == ids.c.language)))
+        with engine.begin() as connection:
+            connection.execute(table.insert().from_select(['topic_id', 'language', 'label', 'description'], query))
+        logger.info('Built the summaries of topics {} to {}'.format(start, min(end, max_id + 1) - 1))
+
+
+def build_incoming_edge_counts(engine, batch_size: int = 1000000):
+    """
+    Creates the reverse index of the edges if it is missing and fills the incoming_edge_counts table,
+    batch_size object ids per INSERT ... SELECT reading that index.
+    """
+    for index in Edge.__table__.indexes:
+        index.create(engine, checkfirst=True)
+    table = IncomingEdgeCount.__table__
+    table.drop(engine, checkfirst=True)
+    table.create(engine)
+    max_id = engine.execute(select([func.max(Topic.id)])).scalar() or 0
+    for start in range(0, max_id + 1, batch_size):
+        end = start + batch_size
+        with engine.begin() as connection:
+            connection.execute(table.insert().from_select(
+                ['object_id', 'predicate_id', 'count'],
+                select([Edge.object_id, Edge.predicate_id, func.count()])
+                    .where(Edge.object_id >= start).where(Edge.object_id < end)
+                    .group_by(Edge.object_id, Edge.predicate_id)))
+        logger.info('Counted the incoming edges of topics {} to {}'.format(start, min(end, max_id + 1) - 1))
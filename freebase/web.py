@@ -1,18 +1,449 @@
 import json
+import os
+from collections import defaultdict
 from functools import lru_cache
-from urllib.parse import quote_plus
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote_plus, urlencode
 
-import requests
-from flask import Flask, render_template, request, abort, redirect
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
+from flask import Flask, g, render_template, request, abort, redirect, stream_with_context
+from sqlalchemy import and_, create_engine, event, func, inspect, literal, null, or_, select, type_coerce, union, \
+    union_all
+from sqlalchemy.orm import joinedload, selectinload, sessionmaker
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.pool import NullPool, QueuePool
 
+from freebase import profiling
+from freebase.cache import CachedResponse, ResponseCache, make_etag
+from freebase.ids import is_mid
 from freebase.model import *
+from freebase.profiling import note, timed
+from freebase.search import SEARCH_RESULTS, search
+from freebase.snapshot import Snapshot
+from freebase.wikidata import WikidataFallback
+
+
+def create_web_engine():
+    """
+    Engine of the web app, configured with environment variables:
+    FREEBASE_DB_POOL_SIZE (default 5, 0 to open a new connection per request), FREEBASE_DB_MAX_OVERFLOW
+    (default 10) and FREEBASE_DB_POOL_RECYCLE (seconds, default 3600, below the MySQL wait_timeout).
+    Pooled connections are pinged before being used.
+    """
+    url = get_db_url()
+    pool_size = int(os.environ.get('FREEBASE_DB_POOL_SIZE', 5))
+    if pool_size == 0:
+        return create_engine(url, poolclass=NullPool)
+    connect_args = {}
+    if url.startswith('sqlite'):
+        connect_args['check_same_thread'] = False  # connections are handed over between request threads
+    return create_engine(url, poolclass=QueuePool, pool_size=pool_size,
+                         max_overflow=int(os.environ.get('FREEBASE_DB_MAX_OVERFLOW', 10)),
+                         pool_recycle=int(os.environ.get('FREEBASE_DB_POOL_RECYCLE', 3600)),
+                         pool_pre_ping=True, connect_args=connect_args)
+
 
 app = Flask(__name__)
-engine = create_engine(get_db_url(), poolclass=NullPool)
+# A directory written by build_snapshot.py, served instead of the database
+snapshot = Snapshot(os.environ['FREEBASE_SNAPSHOT']) if os.environ.get('FREEBASE_SNAPSHOT') else None
+engine = create_web_engine() if snapshot is None else None
 Session = sessionmaker(bind=engine)
+wikidata_fallback = WikidataFallback(engine)
+response_cache = ResponseCache(int(os.environ.get('FREEBASE_CACHE_SIZE', 64 * 1024 * 1024)),
+                               os.environ.get('FREEBASE_CACHE_DIR'))
+profiling.init_app(app, engine)
+
+EDGES_PER_PREDICATE = 20  # objects shown for each predicate on topic pages
+INCOMING_EDGES_PER_PREDICATE = 10  # subjects shown for each predicate of the incoming edges on topic pages
+INCOMING_PREDICATES_PER_QUERY = 100  # predicates whose first subjects are read by a single UNION ALL query
+EDGE_PAGE_SIZE = 500
+API_BATCH_SIZE = 1000  # maximum number of ids of a /api/topics request
+API_CHUNK_SIZE = 100  # ids resolved and loaded together while streaming /api/topics
+CACHE_MAX_AGE = 24 * 3600  # seconds
+
+_property_relationships = [Property.schema, Property.expected_type, Property.master, Property.reverse, Property.unit,
+                           Property.delegated]
+
+
+class QueryCounter:
+    """
+    Counts the SQL statements executed on an engine:
+
+        with QueryCounter(engine) as counter:
+            ...
+        assert counter.count <= 10
+    """
+
+    def __init__(self, bind):
+        self.bind = bind
+        self.count = 0
+
+    def __enter__(self):
+        event.listen(self.bind, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        event.remove(self.bind, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+@lru_cache(maxsize=None)
+def summaries_available() -> bool:
+    return inspect(engine).has_table(TopicSummary.__tablename__) and \
+           engine.execute(select([TopicSummary.topic_id]).limit(1)).first() is not None
+
+
+def _load_labels(db, topics: dict, topic_ids):
+    """
+    Sets the labels and descriptions of the topics (indexed by id) with a single topic_summaries query
+    if postprocess.py has been run, one query on labels and one on descriptions otherwise.
+    topic_ids is a query returning a superset of their ids, to avoid huge IN lists.
+    """
+    if summaries_available():
+        labels = {topic_id: [] for topic_id in topics}
+        descriptions = {topic_id: [] for topic_id in topics}
+        for row in db.execute(select([TopicSummary.__table__]).where(TopicSummary.topic_id.in_(topic_ids))):
+            if row.topic_id in labels:
+                if row.label is not None:
+                    labels[row.topic_id].append(Label(topic_id=row.topic_id, language=row.language, value=row.label))
+                if row.description is not None:
+                    descriptions[row.topic_id].append(
+                        Description(topic_id=row.topic_id, language=row.language, value=row.description))
+        for topic_id, related in topics.items():
+            set_committed_value(related, 'labels', labels[topic_id])
+            set_committed_value(related, 'descriptions', descriptions[topic_id])
+        return
+
+    for table, key in ((Label, 'labels'), (Description, 'descriptions')):
+        values = {topic_id: [] for topic_id in topics}
+        for value in db.query(table).filter(table.topic_id.in_(topic_ids)):
+            if value.topic_id in values:
+                values[value.topic_id].append(value)
+        for topic_id, related in topics.items():
+            set_committed_value(related, key, values[topic_id])
+
+
+@lru_cache(maxsize=None)
+def incoming_counts_available() -> bool:
+    return inspect(engine).has_table(IncomingEdgeCount.__tablename__) and \
+           engine.execute(select([IncomingEdgeCount.object_id]).limit(1)).first() is not None
+
+
+@lru_cache(maxsize=None)
+def search_available() -> bool:
+    return inspect(engine).has_table(SearchPrefix.__tablename__) and \
+           engine.execute(select([SearchPrefix.topic_id]).limit(1)).first() is not None
+
+
+@app.before_first_request
+def check_tables():
+    # Before any request session holds a pooled connection: the checks use their own connection
+    if engine is not None:
+        summaries_available()
+        incoming_counts_available()
+        search_available()
+
+
+class ResolvedId(NamedTuple):
+    id: int
+    mid: Optional[str]
+
+
+def may_be_mid(path: str) -> bool:
+    """
+    False if no topic can have path as MID, compact ids only store the MIDs accepted by mid_to_int
+    """
+    if COMPACT_IDS:
+        return is_mid(path)
+    return path.startswith('/m/') or path.startswith('/g/')
+
+
+@lru_cache(maxsize=65536)
+def resolve_path(path: str) -> Optional[ResolvedId]:
+    """
+    Finds the topic with the given MID, textid or key in a single query, each branch of the UNION using
+    a unique index. The data is frozen so the results, including misses, are cached in the process.
+    """
+    if snapshot is not None:
+        found = snapshot.resolve(path)
+        return ResolvedId(*found) if found is not None else None
+    branches = [select([Topic.id, Topic.mid, literal(1).label('priority')]).where(Topic.textid == path),
+                select([Topic.id, Topic.mid, literal(2).label('priority')])
+                    .select_from(Key.__table__.join(Topic.__table__, Key.topic_id == Topic.id))
+                    .where(Key.key == path)]
+    if may_be_mid(path):
+        branches.insert(0, select([Topic.id, Topic.mid, literal(0).label('priority')]).where(Topic.mid == path))
+    query = union_all(*branches).order_by('priority').limit(1)
+    found = get_db().execute(query).first()
+    return ResolvedId(found.id, found.mid) if found is not None else None
+
+
+def resolve_paths(db, paths: Iterable[str]) -> Dict[str, ResolvedId]:
+    """
+    Resolves many MIDs, textids or keys with a single query, with the same priorities as resolve_path.
+    Paths not found are missing from the result.
+    """
+    paths = set(paths)
+    if snapshot is not None:
+        resolved = {path: resolve_path(path) for path in paths}
+        return {path: found for path, found in resolved.items() if found is not None}
+    mids = [path for path in paths if may_be_mid(path)]
+    # The path is taken from the column of the branch, they do not have the same type with compact ids
+    no_key = type_coerce(null(), Key.key.type).label('key')
+    branches = [select([Topic.id, Topic.mid, Topic.textid, no_key, literal(1).label('priority')])
+                    .where(Topic.textid.in_(paths)),
+                select([Topic.id, Topic.mid, Topic.textid, Key.key, literal(2).label('priority')])
+                    .select_from(Key.__table__.join(Topic.__table__, Key.topic_id == Topic.id))
+                    .where(Key.key.in_(paths))]
+    if mids:
+        branches.insert(0, select([Topic.id, Topic.mid, Topic.textid, no_key, literal(0).label('priority')])
+                        .where(Topic.mid.in_(mids)))
+    resolved = {}
+    for row in db.execute(union_all(*branches).order_by('priority')):
+        path = (row.mid, row.textid, row.key)[row.priority]
+        if path in paths and path not in resolved:
+            resolved[path] = ResolvedId(row.id, row.mid)
+    return resolved
+
+
+def load_topics(db, topic_ids: Iterable[int]) -> Dict[int, Topic]:
+    """
+    Loads the topics with what their JSON-LD needs, in 5 queries whatever their number
+    """
+    topic_ids = list(topic_ids)
+    if snapshot is not None:
+        return {topic_id: snapshot.topic(topic_id) for topic_id in topic_ids}
+    if not topic_ids:
+        return {}
+    topics = db.query(Topic).options(
+        selectinload(Topic.labels),
+        selectinload(Topic.descriptions),
+        selectinload(Topic.aliases),
+        selectinload(Topic.types).joinedload(Type.type)
+    ).filter(Topic.id.in_(topic_ids))
+    return {topic.id: topic for topic in topics}
+
+
+def load_topic(db, **filters) -> Optional[Topic]:
+    """
+    Loads a topic with everything its page needs but its edges, including its Wikidata mapping,
+    in a fixed number of queries (8, or 7 with topic summaries).
+
+    Neighbor topics (types, property fields) are joined in the relationship queries and their labels and
+    descriptions are fetched together by _load_labels.
+    """
+    topic = db.query(Topic).options(
+        selectinload(Topic.aliases),
+        selectinload(Topic.keys),
+        joinedload(Topic.wikidata),
+        selectinload(Topic.types).joinedload(Type.type),
+        selectinload(Topic.properties).joinedload(Property.topic),
+        *[selectinload(Topic.as_properties).joinedload(relationship) for relationship in _property_relationships]
+    ).filter_by(**filters).first()
+    if topic is None:
+        return None
+
+    topics = {topic.id: topic}
+    for type in topic.types:
+        topics[type.type.id] = type.type
+    for property in topic.properties:
+        topics[property.topic.id] = property.topic
+    for property in topic.as_properties:
+        for relationship in _property_relationships:
+            related = getattr(property, relationship.key)
+            if related is not None:
+                topics[related.id] = related
+
+    _load_labels(db, topics, union(
+        select([Topic.id]).where(Topic.id == topic.id),
+        select([Type.type_id]).where(Type.topic_id == topic.id),
+        select([Property.topic_id]).where(Property.schema_id == topic.id),
+        *[select([getattr(Property, relationship.key + '_id')]).where(Property.topic_id == topic.id)
+          for relationship in _property_relationships]
+    ))
+    return topic
+
+
+class EdgeGroup(NamedTuple):
+    predicate: Topic
+    count: int
+    objects: List[Topic]
+
+
+def load_edge_groups(db, topic: Topic, objects_per_predicate: Optional[int] = None) -> List[EdgeGroup]:
+    """
+    Groups the outgoing edges of a topic by predicate with the number of edges of each predicate,
+    only loading the first objects_per_predicate (default EDGES_PER_PREDICATE) objects of each group (4 queries).
+    """
+    if objects_per_predicate is None:
+        objects_per_predicate = EDGES_PER_PREDICATE
+    counts = db.query(Topic, func.count()) \
+        .join(Edge, Edge.predicate_id == Topic.id) \
+        .filter(Edge.subject_id == topic.id) \
+        .group_by(Topic.id, Topic.mid, Topic.textid) \
+        .order_by(Topic.id) \
+        .all()
+    if not counts:
+        return []
+
+    ranked = select([
+        Edge.predicate_id,
+        Edge.object_id,
+        func.row_number().over(partition_by=Edge.predicate_id, order_by=Edge.object_id).label('rank')
+    ]).where(Edge.subject_id == topic.id).alias('ranked')
+    objects = defaultdict(list)
+    topics = {predicate.id: predicate for predicate, _ in counts}
+    for predicate_id, object in db.query(ranked.c.predicate_id, Topic) \
+            .join(Topic, Topic.id == ranked.c.object_id) \
+            .filter(ranked.c.rank <= objects_per_predicate) \
+            .order_by(ranked.c.predicate_id, ranked.c.object_id):
+        objects[predicate_id].append(object)
+        topics[object.id] = object
+
+    _load_labels(db, topics, union(
+        select([Edge.predicate_id]).where(Edge.subject_id == topic.id),
+        select([ranked.c.object_id]).where(ranked.c.rank <= objects_per_predicate)
+    ))
+    return [EdgeGroup(predicate, count, objects[predicate.id]) for predicate, count in counts]
+
+
+def get_edge_groups(topic) -> List[EdgeGroup]:
+    if snapshot is not None:
+        return [EdgeGroup(*group) for group in snapshot.edge_groups(topic, EDGES_PER_PREDICATE)]
+    return load_edge_groups(get_db(), topic)
+
+
+class IncomingEdgeGroup(NamedTuple):
+    predicate: Topic
+    count: int
+    subjects: List[Topic]
+
+
+def load_incoming_edge_groups(db, topic: Topic, subjects_per_predicate: Optional[int] = None) \
+        -> List[IncomingEdgeGroup]:
+    """
+    Groups the incoming edges of a topic by predicate with the counts of incoming_edge_counts (computed on the
+    reverse index if the table has not been built), only loading the first subjects_per_predicate
+    (default INCOMING_EDGES_PER_PREDICATE) subjects of each group.
+
+    The subjects are read with a LIMIT query per predicate on the reverse index, unioned by
+    INCOMING_PREDICATES_PER_QUERY predicates, so hub topics with millions of incoming edges only read the rows
+    they show.
+    """
+    if subjects_per_predicate is None:
+        subjects_per_predicate = INCOMING_EDGES_PER_PREDICATE
+    if incoming_counts_available():
+        counts = db.query(Topic, IncomingEdgeCount.count) \
+            .join(IncomingEdgeCount, IncomingEdgeCount.predicate_id == Topic.id) \
+            .filter(IncomingEdgeCount.object_id == topic.id) \
+            .order_by(Topic.id) \
+            .all()
+    else:
+        counts = db.query(Topic, func.count()) \
+            .join(Edge, Edge.predicate_id == Topic.id) \
+            .filter(Edge.object_id == topic.id) \
+            .group_by(Topic.id, Topic.mid, Topic.textid) \
+            .order_by(Topic.id) \
+            .all()
+    if not counts:
+        return []
+
+    subject_ids = defaultdict(list)
+    predicate_ids = [predicate.id for predicate, _ in counts]
+    for start in range(0, len(predicate_ids), INCOMING_PREDICATES_PER_QUERY):
+        firsts = [select([Edge.predicate_id, Edge.subject_id])
+                      .where(Edge.object_id == topic.id).where(Edge.predicate_id == predicate_id)
+                      .order_by(Edge.subject_id).limit(subjects_per_predicate).alias()
+                  for predicate_id in predicate_ids[start:start + INCOMING_PREDICATES_PER_QUERY]]
+        for predicate_id, subject_id in db.execute(union_all(*[select([first.c.predicate_id, first.c.subject_id])
+                                                               for first in firsts])):
+            subject_ids[predicate_id].append(subject_id)
+    topics = {predicate.id: predicate for predicate, _ in counts}
+    all_subject_ids = {subject_id for ids in subject_ids.values() for subject_id in ids}
+    if all_subject_ids:
+        topics.update((subject.id, subject) for subject in db.query(Topic).filter(Topic.id.in_(all_subject_ids)))
+    _load_labels(db, topics, list(topics))
+    return [IncomingEdgeGroup(predicate, count, [topics[i] for i in sorted(subject_ids[predicate.id])])
+            for predicate, count in counts]
+
+
+def get_incoming_edge_groups(topic) -> List[IncomingEdgeGroup]:
+    if snapshot is not None:
+        return [IncomingEdgeGroup(*group)
+                for group in snapshot.edge_groups(topic, INCOMING_EDGES_PER_PREDICATE, incoming=True)]
+    return load_incoming_edge_groups(get_db(), topic)
+
+
+def iter_edges(db, topic_id: int, predicate_id: Optional[int] = None, after: Tuple[int, int] = (0, 0),
+               limit: Optional[int] = None, incoming: bool = False) -> Iterator[Tuple[Topic, Topic]]:
+    """
+    Yields the (predicate, object) pairs of the outgoing edges of a topic ordered by (predicate id, object id),
+    starting after the given (predicate id, object id) cursor. With incoming, yields the (predicate, subject)
+    pairs of the edges pointing to the topic in the same way.
+
+    Edges are read EDGE_PAGE_SIZE at a time with keyset pagination on the edges primary key (on the reverse
+    index for incoming edges) so that listing all the edges of a hub topic uses a bounded amount of memory.
+    """
+    own, other = (Edge.object_id, Edge.subject_id) if incoming else (Edge.subject_id, Edge.object_id)
+    predicates = {}
+    after_predicate, after_object = after
+    while limit is None or limit > 0:
+        page_size = EDGE_PAGE_SIZE if limit is None else min(limit, EDGE_PAGE_SIZE)
+        query = db.query(Edge.predicate_id, Topic) \
+            .join(Topic, Topic.id == other) \
+            .filter(own == topic_id) \
+            .filter(or_(Edge.predicate_id > after_predicate,
+                        and_(Edge.predicate_id == after_predicate, other > after_object)))
+        if predicate_id is not None:
+            query = query.filter(Edge.predicate_id == predicate_id)
+        page = query.order_by(Edge.predicate_id, other).limit(page_size).all()
+        if not page:
+            return
+
+        missing = {p for p, _ in page if p not in predicates}
+        if missing:
+            for predicate in db.query(Topic).filter(Topic.id.in_(missing)):
+                predicates[predicate.id] = predicate
+        topics = {object.id: object for _, object in page}
+        topics.update((p, predicates[p]) for p in missing)
+        _load_labels(db, topics, list(topics))
+
+        for p, object in page:
+            yield predicates[p], object
+        after_predicate, after_object = page[-1][0], page[-1][1].id
+        if len(page) < page_size:
+            return
+        if limit is not None:
+            limit -= len(page)
+
+
+def get_db():
+    """
+    Session of the current request, closed when the request ends
+    """
+    if 'db' not in g:
+        g.db = Session()
+    return g.db
+
+
+@app.teardown_appcontext
+def close_db(exception):
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
+
+
+@app.route('/_stats/pool')
+def pool_stats():
+    if engine is None:
+        abort(404)
+    pool = engine.pool
+    stats = {'status': pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(),
+                     overflow=pool.overflow())
+    return app.response_class(json.dumps(stats), mimetype='application/json')
 
 
 @app.route('/')
@@ -22,8 +453,17 @@ def main():
 
 @app.route('/google/<path:path>')
 def google(path):
-    path = '/' + path
-    url = google_url(Topic(mid=path))
+    """
+    Redirects to the Google search of the topic, with its label or the one of its Wikidata item.
+    A missing mapping is looked up online for at most the whole fallback timeout.
+    """
+    resolved = resolve_path('/' + path)
+    if resolved is None or resolved.mid is None:
+        abort(404)
+    topic = load_topics(get_db(), [resolved.id])[resolved.id]
+    if content_negotiation(topic.labels) is None:
+        wikidata_mapping(topic, wikidata_fallback.timeout)
+    url = google_url(topic)
     if url is None:
         abort(404)
     return redirect(url, code=303)
@@ -31,29 +471,323 @@ def google(path):
 
 @app.route('/<path:path>')
 def get_entity(path):
+    """
+    Topic page, served from response_cache when possible: the cache key only depends on the request
+    so conditional requests on cached pages are answered without touching the database.
+    """
     path = '/' + path
-    db = Session()
+    mimetype, key = entity_cache_key(path)
+    entry = response_cache.get(key)
+    note('cache', 'miss' if entry is None else 'hit')
+    if entry is None:
+        g.cacheable = True
+        entry = render_entity(path, mimetype)
+        if g.cacheable:
+            response_cache.put(key, entry)
+    return to_response(entry, g.get('cacheable', True))
+
+
+def entity_cache_key(path: str) -> Tuple[Optional[str], Tuple[str, str, str]]:
+    """
+    Negotiated mimetype of the topic page request and its response_cache key
+    """
+    mimetype = request.accept_mimetypes.best_match(['text/html', 'application/ld+json', 'application/json'])
+    return mimetype, (path, mimetype or 'text/html', language_preferences())
+
+
+def language_preferences() -> str:
+    """
+    Accept-Language reduced to what content_negotiation depends on, so that equivalent headers share the cached
+    pages: the quality of each normalized language, English being always a candidate the languages that can not
+    be preferred to it are dropped, or get a zero quality if they would otherwise match *
+    """
+    qualities = {}
+    for language, quality in request.accept_languages:  # sorted as best_match reads them, the first one wins
+        qualities.setdefault(language.lower().replace('_', '-'), quality)
+    wildcard = qualities.get('*', 0)
+    english = qualities.get('en', wildcard)
+    preferences = {}
+    for language, quality in qualities.items():
+        if quality > 0 and quality >= english:
+            preferences[language] = quality
+        elif wildcard > 0 and wildcard >= english:
+            preferences[language] = 0
+    return ','.join('{};q={:g}'.format(language, quality) for language, quality in sorted(preferences.items()))
+
+
+def render_entity(path: str, mimetype: Optional[str]) -> CachedResponse:
+    with timed('resolve'):
+        resolved = resolve_path(path)
+    if resolved is None:
+        abort(404)
+    note('topic_id', resolved.id)
+    if resolved.mid is not None and path != resolved.mid:
+        return redirect_to_mid(resolved)
+    with timed('load_topic'):
+        topic = snapshot.topic(resolved.id) if snapshot is not None else load_topic(get_db(), id=resolved.id)
+    if is_json(mimetype):
+        return render_topic(topic, mimetype)
+    with timed('edges'):
+        edge_groups = get_edge_groups(topic)
+    with timed('incoming'):
+        incoming_groups = get_incoming_edge_groups(topic)
+    return render_topic(topic, mimetype, edge_groups, incoming_groups)
+
+
+def is_json(mimetype: Optional[str]) -> bool:
+    return mimetype == 'application/json' or mimetype == 'application/ld+json'
+
+
+def redirect_to_mid(resolved: ResolvedId) -> CachedResponse:
+    response = redirect(resolved.mid, code=303)  # We prefer the MID
+    return CachedResponse(303, response.mimetype, response.get_data(), '', response.location)
+
+
+def render_topic(topic, mimetype: Optional[str], edge_groups: List[EdgeGroup] = (),
+                 incoming_groups: List[IncomingEdgeGroup] = ()) -> CachedResponse:
+    """
+    Topic page from the loaded topic, as JSON-LD if mimetype is a JSON one, as HTML with the edge groups otherwise
+    """
+    if is_json(mimetype):
+        with timed('jsonld'):
+            body = json.dumps(topic.jsonld).encode()
+    else:
+        mimetype = 'text/html'
+        with timed('full_dict'):
+            full_dict = to_full_dict(topic, edge_groups, incoming_groups)
+        with timed('render'):
+            body = render_template('topic_display.html', topic=full_dict).encode()
+    return CachedResponse(200, mimetype, body, make_etag(body))
+
+
+def to_response(entry: CachedResponse, cacheable: bool = True):
+    """
+    Response of a topic page, without ETag if the page will change (cacheable False)
+    """
+    response = app.response_class(entry.body, status=entry.status, mimetype=entry.mimetype)
+    if entry.location is not None:
+        response.headers['Location'] = entry.location
+    if entry.etag and cacheable:
+        response.set_etag(entry.etag)
+    set_cache_control(response, cacheable)
+    response.vary.update(('Accept', 'Accept-Language'))
+    return response.make_conditional(request)
+
+
+def set_cache_control(response, cacheable: bool = True):
+    """
+    Lets clients and proxies keep the response for CACHE_MAX_AGE seconds, or only reuse it after revalidation
+    if it will change
+    """
+    response.headers['Cache-Control'] = 'public, max-age={}'.format(CACHE_MAX_AGE) if cacheable else 'no-cache'
+
+
+@app.route('/api/topics', methods=['POST'])
+def get_topics():
+    """
+    JSON-LD of many topics in one request. The body is a JSON list of at most API_BATCH_SIZE MIDs, textids or
+    keys, or an object with such a list as "ids".
+
+    The response is streamed as a JSON array, or as newline delimited JSON with Accept: application/x-ndjson,
+    of {"id": <requested id>, "topic": <JSON-LD or null>} objects in the order of the request.
+    """
+    paths = request.get_json(force=True, silent=True)
+    if isinstance(paths, dict):
+        paths = paths.get('ids')
+    if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+        abort(400)
+    if len(paths) > API_BATCH_SIZE:
+        abort(413)
+    note('topics', len(paths))
+    items = (json.dumps({'id': path, 'topic': jsonld}) for path, jsonld in _iter_jsonld(paths))
+    if request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson':
+        body = (item + '\n' for item in items)
+        mimetype = 'application/x-ndjson'
+    else:
+        body = _stream_json_array(items)
+        mimetype = 'application/json'
+    return app.response_class(stream_with_context(body), mimetype=mimetype)
+
+
+def _iter_jsonld(paths: List[str]) -> Iterator[Tuple[str, Optional[dict]]]:
+    for start in range(0, len(paths), API_CHUNK_SIZE):
+        chunk = paths[start:start + API_CHUNK_SIZE]
+        db = get_db() if snapshot is None else None
+        resolved = resolve_paths(db, chunk)
+        topics = load_topics(db, {found.id for found in resolved.values()})
+        for path in chunk:
+            found = resolved.get(path)
+            topic = topics.get(found.id) if found is not None else None
+            yield path, topic.jsonld if topic is not None else None
+        if db is not None:
+            db.expunge_all()  # the loaded topics are not needed anymore
+
+
+def _stream_json_array(items: Iterator[str]):
+    yield '['
+    separator = ''
+    for item in items:
+        yield separator + item
+        separator = ', '
+    yield ']'
+
+
+@app.route('/api/search')
+def search_topics():
+    """
+    Autocompletion: the best topics with a label, alias or key name starting with ?q=, or having a word
+    starting with it, as {"query", "results": [{"id", "url", "label", "description", "match"}]}.
+    Only available once build_search_index.py has been run.
+    """
+    query = request.args.get('q', '')
     try:
-        if path.startswith('/m/') or path.startswith('/g/'):
-            topic = db.query(Topic).filter_by(mid=path).first()
-        else:
-            topic = db.query(Topic).filter_by(textid=path).first()
-            if topic is None:
-                key = db.query(Key).filter_by(key=path).first()
-                topic = key.topic if key is not None else None
-        if topic is None:
+        limit = min(int(request.args.get('limit', SEARCH_RESULTS)), SEARCH_RESULTS)
+    except ValueError:
+        abort(400)
+    if limit <= 0:
+        abort(400)
+    results = _search_results(query, limit)
+    response = app.response_class(json.dumps({'query': query, 'results': results}), mimetype='application/json')
+    set_cache_control(response, g.get('cacheable', True))
+    response.vary.add('Accept-Language')
+    return response
+
+
+@app.route('/search')
+def search_page():
+    """
+    HTML page of the results of the search form, the same as /api/search
+    """
+    query = request.args.get('q', '')
+    results = _search_results(query, SEARCH_RESULTS)
+    response = app.response_class(render_template('search.html', query=query, results=results))
+    set_cache_control(response, g.get('cacheable', True))
+    response.vary.add('Accept-Language')
+    return response
+
+
+def _search_results(query: str, limit: int) -> List[dict]:
+    if snapshot is not None or not search_available():
+        abort(404)
+    db = get_db()
+    with timed('search'):
+        found = search(db, query, limit)
+    topics = {topic.id: topic for topic in db.query(Topic).filter(Topic.id.in_([i for i, _ in found]))} \
+        if found else {}
+    _load_labels(db, topics, list(topics))
+    results = []
+    for topic_id, match in found:
+        result = to_json_dict(topics[topic_id])
+        result['match'] = match
+        results.append(result)
+    return results
+
+
+@app.route('/<path:path>/edges')
+def get_edges(path):
+    """
+    Lists the outgoing edges of a topic, of a single predicate with ?predicate=<textid or MID>.
+
+    With ?limit=<n> only n edges are returned, the response links to the next ones with ?after=<cursor>.
+    Without limit all the edges are listed. Both HTML and JSON responses are streamed.
+    """
+    return _edges_response('/' + path, incoming=False)
+
+
+@app.route('/<path:path>/incoming')
+def get_incoming_edges(path):
+    """
+    Lists the edges pointing to a topic ("what links here") read on the reverse index, with the same
+    parameters as the outgoing edges.
+    """
+    return _edges_response('/' + path, incoming=True)
+
+
+def _edges_response(path: str, incoming: bool):
+    suffix = '/incoming' if incoming else '/edges'
+    with timed('resolve'):
+        topic = resolve_path(path)
+    if topic is None:
+        return get_entity(path[1:] + suffix)  # a topic whose id ends with /edges or /incoming
+    note('topic_id', topic.id)
+    predicate = None
+    if 'predicate' in request.args:
+        predicate = resolve_path(request.args['predicate'])
+        if predicate is None:
             abort(404)
+    try:
+        after = tuple(int(i) for i in request.args['after'].split('.')) if 'after' in request.args else (0, 0)
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        abort(400)
+    if len(after) != 2 or (limit is not None and limit <= 0):
+        abort(400)
 
-        if topic.mid is not None and path != topic.mid:
-            return redirect(topic.mid, code=303)  # We prefer the MID
+    # The request context, and so the session, is kept until the end of the stream
+    predicate_id = predicate.id if predicate is not None else None
+    if snapshot is not None:
+        edges = snapshot.iter_edges(topic.id, predicate_id, after, None if limit is None else limit + 1, incoming)
+    else:
+        edges = iter_edges(get_db(), topic.id, predicate_id, after, None if limit is None else limit + 1, incoming)
+    listing = _EdgeListing(edges, limit, suffix)
+    mimetype = request.accept_mimetypes.best_match(['text/html', 'application/json'])
+    if mimetype == 'application/json':
+        body = _stream_edges_json(listing, path, incoming)
+    else:
+        body = _stream_edges_html(listing, path, incoming)
+    return app.response_class(stream_with_context(body), mimetype=mimetype)
 
-        mimetype = request.accept_mimetypes.best_match(['text/html', 'application/ld+json', 'application/json'])
-        if mimetype == 'application/json' or mimetype == 'application/ld+json':
-            return app.response_class(json.dumps(topic.jsonld), mimetype=mimetype)
-        else:
-            return render_template('topic_display.html', topic=to_full_dict(topic))
-    finally:
-        db.close()
+
+class _EdgeListing:
+    """
+    Iterates over at most limit (predicate, object or subject) pairs, the cursor of the next page is set once it is
+    done
+    """
+
+    def __init__(self, edges: Iterator[Tuple[Topic, Topic]], limit: Optional[int], suffix: str = '/edges'):
+        self.edges = edges
+        self.limit = limit
+        self.suffix = suffix
+        self.next_cursor = None
+
+    def __iter__(self):
+        count = 0
+        last = None
+        for predicate, object in self.edges:
+            if self.limit is not None and count == self.limit:
+                self.next_cursor = '{}.{}'.format(*last)
+                return
+            yield predicate, object
+            last = (predicate.id, object.id)
+            count += 1
+
+    def next_url(self, path: str) -> Optional[str]:
+        if self.next_cursor is None:
+            return None
+        args = request.args.to_dict()
+        args['after'] = self.next_cursor
+        return '{}{}?{}'.format(path, self.suffix, urlencode(args))
+
+
+def _stream_edges_html(listing: _EdgeListing, path: str, incoming: bool = False):
+    context = {
+        'path': path,
+        'incoming': incoming,
+        'edges': ((to_simple_dict(p), to_simple_dict(o)) for p, o in listing),
+        'next_url': lambda: listing.next_url(path)
+    }
+    app.update_template_context(context)
+    yield from app.jinja_env.get_template('edges.html').generate(context)
+
+
+def _stream_edges_json(listing: _EdgeListing, path: str, incoming: bool = False):
+    other = 'subject' if incoming else 'object'
+    yield '{"edges": ['
+    separator = ''
+    for predicate, topic in listing:
+        yield separator + json.dumps({'predicate': to_json_dict(predicate), other: to_json_dict(topic)})
+        separator = ', '
+    yield '], "next": {}}}'.format(json.dumps(listing.next_url(path)))
 
 
 def to_simple_dict(topic):
@@ -65,16 +799,25 @@ def to_simple_dict(topic):
     }
 
 
-def to_full_dict(topic):
+def to_json_dict(topic):
+    desc = to_simple_dict(topic)
+    for key in ('label', 'description'):
+        if desc[key] is not None:
+            desc[key] = {'@value': desc[key].value, '@language': desc[key].language}
+    return desc
+
+
+def to_full_dict(topic, edge_groups: List[EdgeGroup], incoming_groups: List[IncomingEdgeGroup] = ()):
     desc = to_simple_dict(topic)
     desc['canonical'] = 'http://www.freebase.com{}'.format(topic.textid if topic.textid else topic.mid)
     desc['notable_types'] = [to_simple_dict(type.type) for type in topic.types if type.notable]
     desc['other_types'] = [to_simple_dict(type.type) for type in topic.types if not type.notable]
-    desc['fkeys'] = [key.key for key in topic.keys]
+    desc['fkeys'] = sorted(key.key for key in topic.keys)  # compact keys are not stored in this order
     desc['jsonld'] = json.dumps(topic.jsonld)
     desc['google_url'] = google_url(topic)
     desc['wikidata_uri'] = wikidata_uri(topic)
-    desc['edges'] = [(to_simple_dict(edge.predicate), to_simple_dict(edge.object)) for edge in topic.outgoing_edges]
+    desc['edge_groups'] = [to_edge_group_dict(topic, group) for group in edge_groups]
+    desc['incoming_groups'] = [to_incoming_group_dict(topic, group) for group in incoming_groups]
     for property in topic.as_properties:
         if property.schema is not None:
             desc['schema'] = to_simple_dict(property.schema)
@@ -94,20 +837,36 @@ def to_full_dict(topic):
     return desc
 
 
-def get_topic(**filters):
-    db = Session()
-    try:
-        topic = db.query(Topic).filter_by(**filters).first()
-        if topic is None:
-            abort(404)
+def to_edge_group_dict(topic, group: EdgeGroup):
+    desc = {
+        'predicate': to_simple_dict(group.predicate),
+        'count': group.count,
+        'objects': [to_simple_dict(object) for object in group.objects],
+        'more_url': None
+    }
+    if group.count > len(group.objects):
+        desc['more_url'] = '{}/edges?{}'.format(topic.mid if topic.mid else topic.textid, urlencode({
+            'predicate': desc['predicate']['id'],
+            'after': '{}.{}'.format(group.predicate.id, group.objects[-1].id),
+            'limit': EDGE_PAGE_SIZE
+        }))
+    return desc
 
-        mimetype = request.accept_mimetypes.best_match(['text/html', 'application/ld+json', 'application/json'])
-        if mimetype == 'application/json' or mimetype == 'application/ld+json':
-            return app.response_class(json.dumps(topic.jsonld), mimetype=mimetype)
-        else:
-            return render_template('topic_display.html', topic=to_full_dict(topic))
-    finally:
-        db.close()
+
+def to_incoming_group_dict(topic, group: IncomingEdgeGroup):
+    desc = {
+        'predicate': to_simple_dict(group.predicate),
+        'count': group.count,
+        'subjects': [to_simple_dict(subject) for subject in group.subjects],
+        'more_url': None
+    }
+    if group.count > len(group.subjects):
+        desc['more_url'] = '{}/incoming?{}'.format(topic.mid if topic.mid else topic.textid, urlencode({
+            'predicate': desc['predicate']['id'],
+            'after': '{}.{}'.format(group.predicate.id, group.subjects[-1].id),
+            'limit': EDGE_PAGE_SIZE
+        }))
+    return desc
 
 
 def content_negotiation(labels):
@@ -127,35 +886,34 @@ def google_url(topic: Topic):
     return 'https://www.google.com/search?kgmid={}&q={}'.format(topic.mid, quote_plus(label.value))
 
 
-@lru_cache(maxsize=4096)
-def wikidata_uri(topic: Topic):
+def wikidata_mapping(topic: Topic, timeout: Optional[float] = None):
+    """
+    The wikidata_mappings row of the topic, loaded with it, or fetched online without waiting more than
+    timeout seconds, the fallback deadline by default, if it is missing
+    """
     if topic.mid is None:
         return None
-    query = 'SELECT DISTINCT ?item WHERE { ?item wdt:P646|wdt:P2671 "%s" }' % topic.mid
-    results = requests.post('https://query.wikidata.org/sparql', data=query, headers={
-        'content-type': 'application/sparql-query',
-        'accept': 'application/json',
-        'user-agent': 'FreebaseBrowser/0.0 (https://freebase.toolforge.org)'
-    }).json()
-    items = []
-    for result in results['results']['bindings']:
-        items.append(result['item']['value'])
-    if len(items) == 1:
-        return items[0]
-    else:
-        return None
+    if topic.wikidata is not None:
+        return topic.wikidata
+    if snapshot is not None:
+        return None  # nowhere to store the result
+    lookups = g.setdefault('wikidata_lookups', {})  # only wait once per request
+    if topic.mid not in lookups:
+        with timed('wikidata'):
+            lookups[topic.mid] = wikidata_fallback.lookup(topic.mid, timeout)
+    mapping = lookups[topic.mid]
+    if mapping is None:
+        g.cacheable = False  # the page will change once the lookup is done
+    return WikidataMapping(**mapping) if mapping is not None else None
+
+
+def wikidata_uri(topic: Topic):
+    mapping = wikidata_mapping(topic)
+    return mapping.item if mapping is not None else None
 
 
-@lru_cache(maxsize=4096)
 def wikidata_label(topic: Topic):
-    if topic.mid is None:
+    mapping = wikidata_mapping(topic)
+    if mapping is None or mapping.label is None:
         return None
-    query = 'SELECT ?itemLabel WHERE { ?item wdt:P646|wdt:P2671 "%s" . SERVICE wikibase:label { bd:serviceParam wikibase:language "en". } }' % topic.mid
-    results = requests.post('https://query.wikidata.org/sparql', data=query, headers={
-        'content-type': 'application/sparql-query',
-        'accept': 'application/json',
-        'user-agent': 'FreebaseBrowser/0.0 (https://freebase.toolforge.org)'
-    }).json()
-    for result in results['results']['bindings']:
-        return Label(value=result['itemLabel']['value'], language=result['itemLabel']['value'])
-    return None
+    return Label(value=mapping.label, language='en')
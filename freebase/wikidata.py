@@ -0,0 +1,156 @@
+import gzip
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import Dict, Iterator, Optional, Tuple
+
+import requests
+
+from freebase.ids import is_mid
+from freebase.model import *
+from freebase.writer import insert_ignore_query
+
+logger = logging.getLogger()
+
+SPARQL_ENDPOINT = 'https://query.wikidata.org/sparql'
+USER_AGENT = 'FreebaseBrowser/0.0 (https://freebase.toolforge.org)'
+ENTITY_PREFIX = 'http://www.wikidata.org/entity/'
+
+
+def _clean(field: str) -> str:
+    field = field.strip()
+    if len(field) >= 2 and (field[0], field[-1]) in (('<', '>'), ('"', '"')):
+        field = field[1:-1]
+    return field
+
+
+def read_pairs(path: str) -> Iterator[Tuple[str, str, Optional[str]]]:
+    """
+    Reads a tab separated file of (item, MID[, English label]) rows, possibly gzipped, like the TSV result of
+    SELECT ?item ?mid ?label WHERE { ?item wdt:P646|wdt:P2671 ?mid OPTIONAL { ?item rdfs:label ?label FILTER(LANG(?label) = "en") } }
+
+    Items may be full entity IRIs or Q-ids, values may be quoted. Header lines starting with ? are skipped.
+    """
+    with (gzip.open(path, 'rt') if path.endswith('.gz') else open(path, 'rt')) as fp:
+        for line in fp:
+            fields = [_clean(field) for field in line.rstrip('\n').split('\t')]
+            if len(fields) < 2 or fields[0].startswith('?') or not fields[1]:
+                continue
+            item = fields[0] if fields[0].startswith('http') else ENTITY_PREFIX + fields[0]
+            label = fields[2] if len(fields) > 2 and fields[2] else None
+            if label is not None and label.endswith('"@en'):
+                label = label[1:-4]
+            yield item, fields[1], label
+
+
+def import_mappings(engine, path: str, batch_size: int = 10000) -> int:
+    """
+    Replaces the content of the wikidata_mappings table with the pairs of the given file.
+    MIDs mapped to several items get a NULL item, as the online lookup does.
+    """
+    mappings: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+    for item, mid, label in read_pairs(path):
+        if COMPACT_IDS and not is_mid(mid):
+            continue
+        if mid in mappings and mappings[mid][0] != item:
+            mappings[mid] = (None, mappings[mid][1] or label)
+        else:
+            mappings[mid] = (item, label)
+    logger.info('Read {} MIDs from {}'.format(len(mappings), path))
+
+    WikidataMapping.__table__.create(engine, checkfirst=True)
+    with engine.begin() as connection:
+        connection.execute(WikidataMapping.__table__.delete())
+        batch = []
+        for mid, (item, label) in mappings.items():
+            batch.append({'mid': mid, 'item': item, 'label': label})
+            if len(batch) >= batch_size:
+                connection.execute(WikidataMapping.__table__.insert(), batch)
+                batch = []
+        if batch:
+            connection.execute(WikidataMapping.__table__.insert(), batch)
+    return len(mappings)
+
+
+def fetch_mapping(mid: str, timeout: float) -> dict:
+    """
+    Looks up the item and English label of a MID with the Wikidata Query Service
+    """
+    query = 'SELECT DISTINCT ?item ?itemLabel WHERE { ?item wdt:P646|wdt:P2671 "%s" . ' \
+            'SERVICE wikibase:label { bd:serviceParam wikibase:language "en". } }' % mid
+    response = requests.post(SPARQL_ENDPOINT, data=query, timeout=timeout, headers={
+        'content-type': 'application/sparql-query',
+        'accept': 'application/json',
+        'user-agent': USER_AGENT
+    })
+    response.raise_for_status()
+    items = set()
+    label = None
+    for result in response.json()['results']['bindings']:
+        items.add(result['item']['value'])
+        if 'itemLabel' in result and label is None:
+            label = result['itemLabel']['value']
+    return {'mid': mid, 'item': items.pop() if len(items) == 1 else None, 'label': label}
+
+
+class WikidataFallback:
+    """
+    Fetches the mappings missing from the wikidata_mappings table in background threads and stores them.
+
+    lookup waits at most deadline seconds: if the answer is not there yet the page is rendered without it,
+    and the mapping will be in the table for the next requests. At most max_pending lookups are queued, the other
+    MIDs are looked up by later requests. Errors are logged and never raised.
+    """
+
+    def __init__(self, engine, workers: int = 2, deadline: float = 0.2, timeout: float = 5, max_pending: int = 1000):
+        self.engine = engine
+        self.deadline = deadline
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='wikidata')
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, mid: str) -> Optional[Future]:
+        """
+        Starts the lookup of mid if it is not already running, without waiting for it.
+        Returns None if max_pending lookups are already queued.
+        """
+        with self._lock:
+            future = self._pending.get(mid)
+            if future is not None:
+                return future
+            if len(self._pending) >= self.max_pending:
+                return None
+            future = self._executor.submit(self._fetch_and_store, mid)
+            self._pending[mid] = future
+        # Out of the lock: the callback is called right away if the lookup is already done
+        future.add_done_callback(lambda _: self._forget(mid))
+        return future
+
+    def lookup(self, mid: str, timeout: Optional[float] = None) -> Optional[dict]:
+        """
+        The mapping of mid, waited for at most timeout seconds, the deadline by default
+        """
+        future = self.submit(mid)
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=self.deadline if timeout is None else timeout)
+        except TimeoutError:
+            return None
+        except Exception:
+            return None  # already logged by _fetch_and_store
+
+    def _forget(self, mid: str):
+        with self._lock:
+            self._pending.pop(mid, None)
+
+    def _fetch_and_store(self, mid: str) -> dict:
+        try:
+            mapping = fetch_mapping(mid, self.timeout)
+            self.engine.execute(insert_ignore_query(WikidataMapping, self.engine.dialect.name), mapping)
+            return mapping
+        except Exception:
+            logger.exception('Wikidata lookup failed for {}'.format(mid))
+            raise
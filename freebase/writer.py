@@ -0,0 +1,112 @@
+import time
+from collections import Counter, defaultdict
+
+from sqlalchemy import bindparam
+from sqlalchemy.dialects import postgresql
+
+from freebase.model import *
+
+# Tables are flushed in this order so that referenced rows always come first
+FLUSH_ORDER = [Topic, Label, Description, Alias, Type, Key, Property, Edge]
+
+
+def insert_ignore_query(table, dialect_name: str):
+    if dialect_name == 'postgresql':
+        return postgresql.insert(table.__table__).on_conflict_do_nothing()
+    query = table.__table__.insert()
+    if dialect_name == 'mysql':
+        return query.prefix_with('IGNORE')
+    if dialect_name == 'sqlite':
+        return query.prefix_with('OR IGNORE')
+    return query
+
+
+class BatchWriter:
+    """
+    Buffers rows per table and writes them with executemany over a single long-lived connection.
+
+    Duplicates are ignored by the database (INSERT IGNORE / OR IGNORE / ON CONFLICT DO NOTHING).
+    Notable types and property fields are applied with batched UPDATEs after the inserts.
+    """
+
+    def __init__(self, engine, batch_size: int = 10000):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.connection = engine.connect()
+        self.transaction = self.connection.begin()
+        self._rows = defaultdict(list)
+        self._notable_types = []
+        self._property_fields = defaultdict(list)
+        self._size = 0
+        self._insert_queries = {}
+        self.batches = 0  # number of committed batches
+        self.flush_seconds = 0.0  # time spent writing the batches
+        self.rows = Counter()  # rows written per table
+        # Duplicate rows ignored by the database per table, None when the driver does not report them
+        self.ignored = Counter() if self.connection.dialect.supports_sane_multi_rowcount else None
+
+    def add(self, table, **row):
+        self._rows[table].append(row)
+        self._size += 1
+
+    def add_type(self, topic_id: int, type_id: int, notable: bool):
+        self.add(Type, topic_id=topic_id, type_id=type_id, notable=notable)
+        if notable:
+            self._notable_types.append({'b_topic_id': topic_id, 'b_type_id': type_id})
+
+    def add_property_field(self, topic_id: int, field_name: str, value):
+        self.add(Property, topic_id=topic_id)
+        self._property_fields[field_name].append({'b_topic_id': topic_id, 'b_value': value})
+
+    @property
+    def should_flush(self) -> bool:
+        return self._size >= self.batch_size
+
+    def maybe_flush(self) -> bool:
+        if self.should_flush:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        start = time.perf_counter()
+        for table in FLUSH_ORDER:
+            rows = self._rows.pop(table, None)
+            if rows:
+                result = self.connection.execute(self._insert_query(table), rows)
+                self.rows[table] += len(rows)
+                if self.ignored is not None and result.rowcount >= 0:
+                    self.ignored[table] += len(rows) - result.rowcount
+                else:
+                    self.ignored = None
+        if self._notable_types:
+            self.connection.execute(
+                Type.__table__.update()
+                    .where(Type.topic_id == bindparam('b_topic_id'))
+                    .where(Type.type_id == bindparam('b_type_id'))
+                    .values(notable=True),
+                self._notable_types)
+        for field_name, values in self._property_fields.items():
+            self.connection.execute(
+                Property.__table__.update()
+                    .where(Property.topic_id == bindparam('b_topic_id'))
+                    .values(**{field_name: bindparam('b_value')}),
+                values)
+        self.transaction.commit()
+        self.batches += 1
+        self.transaction = self.connection.begin()
+        self._rows.clear()
+        self._notable_types = []
+        self._property_fields.clear()
+        self._size = 0
+        self.flush_seconds += time.perf_counter() - start
+
+    def close(self):
+        self.flush()
+        self.transaction.commit()
+        self.connection.close()
+
+    def _insert_query(self, table):
+        if table not in self._insert_queries:
+            self._insert_queries[table] = insert_ignore_query(table, self.engine.dialect.name)
+        return self._insert_queries[table]
@@ -0,0 +1,15 @@
+import argparse
+
+from sqlalchemy import create_engine
+
+from freebase.model import get_db_url
+from freebase.wikidata import import_mappings
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Imports the Wikidata items of the MIDs (P646 and P2671 statements) used by the topic pages')
+    parser.add_argument('pairs_file', help='tab separated (item, MID[, English label]) file, possibly gzipped')
+    parser.add_argument('--batch-size', type=int, default=10000, help='number of rows inserted per query')
+    args = parser.parse_args()
+    count = import_mappings(create_engine(get_db_url()), args.pairs_file, args.batch_size)
+    print('Imported {} mappings'.format(count))
@@ -1,30 +1,42 @@
+import argparse
 import gzip
 import logging
 import re
 import sys
-from functools import lru_cache
-from rdflib import URIRef
-from rdflib.plugins.parsers.ntriples import NTriplesParser
-from sqlalchemy import create_engine
-from sqlalchemy.exc import IntegrityError, OperationalError
-from typing import Optional
-
+import time
+from collections import deque
+from functools import lru_cache, partial
+from itertools import chain
+from multiprocessing import Pool
+from rdflib import Literal as RdfLiteral
+from rdflib.plugins.parsers.ntriples import NTriplesParser, ParseError
+from sqlalchemy import create_engine, select
+from typing import Callable, Iterable, Optional, Tuple
+
+from freebase.bulk import StagingWriter, import_staging, staged_topic_rows
+from freebase.checkpoint import DumpReader, read_checkpoint, save_checkpoint
+from freebase.ids import TopicIdMap, is_mid
+from freebase.metrics import LoadMetrics
 from freebase.model import *
-
-type_object_id = URIRef('http://rdf.freebase.com/ns/type.object.id')
-type_object_key = URIRef('http://rdf.freebase.com/ns/type.object.key')
-type_object_name = URIRef('http://rdf.freebase.com/ns/type.object.name')
-type_object_type = URIRef('http://rdf.freebase.com/ns/type.object.type')
-common_topic_alias = URIRef('http://rdf.freebase.com/ns/common.topic.alias')
-common_topic_description = URIRef('http://rdf.freebase.com/ns/common.topic.description')
-common_topic_notable_types = URIRef('http://rdf.freebase.com/ns/common.topic.notable_types')
-type_property_unique = URIRef('http://rdf.freebase.com/ns/type.property.unique')
-type_property_expected_type = URIRef('http://rdf.freebase.com/ns/type.property.expected_type')
-type_property_master_property = URIRef('http://rdf.freebase.com/ns/type.property.master_property')
-type_property_reverse_property = URIRef('http://rdf.freebase.com/ns/type.property.reverse_property')
-type_property_schema = URIRef('http://rdf.freebase.com/ns/type.property.schema')
-type_property_unit = URIRef('http://rdf.freebase.com/ns/type.property.unit')
-type_property_delegated = URIRef('http://rdf.freebase.com/ns/type.property.delegated')
+from freebase.ntriples import Literal, Term, parse_line
+from freebase.summaries import build_incoming_edge_counts
+from freebase.writer import BatchWriter
+
+type_object_id = 'http://rdf.freebase.com/ns/type.object.id'
+type_object_key = 'http://rdf.freebase.com/ns/type.object.key'
+type_object_name = 'http://rdf.freebase.com/ns/type.object.name'
+type_object_type = 'http://rdf.freebase.com/ns/type.object.type'
+common_topic_alias = 'http://rdf.freebase.com/ns/common.topic.alias'
+common_topic_description = 'http://rdf.freebase.com/ns/common.topic.description'
+common_topic_notable_types = 'http://rdf.freebase.com/ns/common.topic.notable_types'
+type_property_unique = 'http://rdf.freebase.com/ns/type.property.unique'
+type_property_expected_type = 'http://rdf.freebase.com/ns/type.property.expected_type'
+type_property_master_property = 'http://rdf.freebase.com/ns/type.property.master_property'
+type_property_reverse_property = 'http://rdf.freebase.com/ns/type.property.reverse_property'
+type_property_schema = 'http://rdf.freebase.com/ns/type.property.schema'
+type_property_unit = 'http://rdf.freebase.com/ns/type.property.unit'
+type_property_delegated = 'http://rdf.freebase.com/ns/type.property.delegated'
+MAX_PENDING_CHUNKS_PER_WORKER = 2  # chunks read ahead of the writer by the workers mode
 edge_blacklist = [
     '/base',
     '/common.',
@@ -39,6 +51,14 @@ edge_blacklist = [
 logger = logging.getLogger()
 
 
+def load_topic_ids(engine, staging_directory: Optional[str] = None) -> TopicIdMap:
+    with engine.connect().execution_options(stream_results=True) as db:
+        rows = db.execute(select([Topic.id, Topic.mid, Topic.textid]))
+        if staging_directory is not None:
+            rows = chain(rows, staged_topic_rows(staging_directory))
+        return TopicIdMap.from_rows(rows)
+
+
 def is_interesting_key(key: str):
     if key.startswith('/authority/musicbrainz/'):
         return len(key) > 59  # We do not keep base musicbrainz keys
@@ -58,243 +78,451 @@ def decode_key(key: str):
     return _decode_key_regex.sub(lambda k: chr(int(k.group(1), 16)), key)
 
 
-@lru_cache(maxsize=128)
-def insert_query(table):
-    return table.__table__.insert()
+def to_bool(s):
+    s = str(s)
+    if s == 'true':
+        return True
+    elif s == 'false':
+        return False
+    else:
+        raise ValueError("Unexpected value: '{}'".format(s))
+
+
+_property_topic_id_fields = {
+    type_property_schema: 'schema_id',
+    type_property_expected_type: 'expected_type_id',
+    type_property_master_property: 'master_id',
+    type_property_reverse_property: 'reverse_id',
+    type_property_unit: 'unit_id',
+    type_property_delegated: 'delegated_id'
+}
+
+
+_special_predicates = {
+    type_object_name,
+    common_topic_description,
+    common_topic_alias,
+    type_object_type,
+    common_topic_notable_types,
+    type_object_key,
+    type_property_unique,
+    *_property_topic_id_fields
+}
+
+
+@lru_cache(maxsize=65536)
+def is_interesting_predicate(p: str, edges_only: bool = False) -> bool:
+    if not edges_only and p in _special_predicates:
+        return True
+    return p.startswith('http://rdf.freebase.com/ns/') and not any(b in p for b in edge_blacklist)
+
+
+def to_language_row(table, s: str, label: Term, max_size: int):
+    if not isinstance(label, Literal):
+        return None
+    if len(label.value) >= max_size:
+        logger.error('Not able to add too long label: {}'.format(label.value))
+        return None
+    return table, s, label.language, label.value
+
+
+def triple_to_row(s: str, p: str, o: Term, edges_only: bool = False) -> Optional[tuple]:
+    """
+    Converts a parsed triple into the row to write, with topics still identified by their URLs.
+
+    The first element of the row is the model class of the target table.
+    This does not touch the database so it can run in worker processes.
+    """
+    try:
+        if not edges_only:
+            if p == type_object_name:
+                return to_language_row(Label, s, o, MAX_VARCHAR_SIZE)
+            elif p == common_topic_description:
+                return to_language_row(Description, s, o, sys.maxsize)
+            elif p == common_topic_alias:
+                return to_language_row(Alias, s, o, MAX_VARCHAR_SIZE)
+            elif p == type_object_type or p == common_topic_notable_types:
+                if not isinstance(o, str):
+                    return None
+                return Type, s, o, p == common_topic_notable_types
+            elif p == type_object_key:
+                key = o.value
+                if not is_interesting_key(key):
+                    return None
+                key = decode_key(key)
+                if len(key) >= MAX_VARCHAR_SIZE:
+                    logger.error('Not able to add too long key: {}'.format(key))
+                    return None
+                return Key, s, key
+            elif p == type_property_unique:
+                return Property, s, 'unique', to_bool(o.value)
+            elif p in _property_topic_id_fields:
+                if not isinstance(o, str):
+                    return None
+                return Property, s, _property_topic_id_fields[p], o
+        if isinstance(o, str) and o.startswith('http://rdf.freebase.com/') and is_interesting_predicate(p, True):
+            return Edge, s, p, o
+    except (ValueError, AttributeError):
+        pass
+    return None
+
+
+def from_rdflib(s, p, o) -> Tuple[str, str, Term]:
+    if isinstance(o, RdfLiteral):
+        o = Literal(str(o), o.language, None if o.datatype is None else str(o.datatype))
+    else:
+        o = str(o)
+    return str(s), str(p), o
+
+
+class _LastTripleSink:
+    def __init__(self):
+        self.last = None
+
+    def triple(self, s, p, o):
+        self.last = from_rdflib(s, p, o)
+
+
+def parse_lines(lines: Iterable[bytes], keep_predicate: Callable[[str], bool]):
+    for line in lines:
+        try:
+            yield parse_line(line, keep_predicate)
+        except ValueError as e:
+            logger.warning(e)
+            yield None
+
+
+def parse_lines_strict(lines: Iterable[bytes]):
+    sink = _LastTripleSink()
+    parser = NTriplesParser(sink=sink)
+    for line in lines:
+        sink.last = None
+        parser.line = line.decode('utf-8').rstrip('\r\n')
+        try:
+            parser.parseline()
+        except ParseError:
+            raise ParseError('Invalid line: {!r}'.format(line))
+        yield sink.last
+
+
+def parse(lines: Iterable[bytes], sink, strict: bool = False,
+          keep_predicate: Callable[[str], bool] = lambda p: True):
+    """
+    Calls sink.line once per line with the parsed triple, or with None if the line contains no triple
+    or has been skipped by the fast parser.
+    If strict is set, rdflib is used instead of the fast parser.
+    """
+    for triple in parse_lines_strict(lines) if strict else parse_lines(lines, keep_predicate):
+        sink.line(triple)
+
+
+class RowSink:
+    def __init__(self, edges_only: bool = False):
+        self.edges_only = edges_only
+        self.rows = []
+
+    def line(self, triple):
+        if triple is not None:
+            row = triple_to_row(*triple, self.edges_only)
+            if row is not None:
+                self.rows.append(row)
+
+
+def parse_chunk(chunk: bytes, edges_only: bool = False, strict: bool = False) -> Tuple[int, list]:
+    """
+    Parses a block of complete N-Triples lines, used by the worker processes.
+    Returns the number of lines of the block and the rows built from them.
+    """
+    lines = chunk.splitlines(True)
+    sink = RowSink(edges_only)
+    parse(lines, sink, strict, partial(is_interesting_predicate, edges_only=edges_only))
+    return len(lines), sink.rows
+
+
+def read_chunks(fp, chunk_size: int):
+    while True:
+        lines = fp.readlines(chunk_size)  # always stops at a line boundary
+        if not lines:
+            return
+        yield b''.join(lines)
 
 
-@lru_cache(maxsize=128)
-def update_query(table):
-    return table.__table__.update()
+def check_parser(dump_file: str, sample_size: int) -> int:
+    """
+    Compares the rows built with the fast parser and with rdflib on the first lines of the dump.
+    Returns the number of differences.
+    """
+    with gzip.open(dump_file) as fp:
+        lines = fp.readlines(sample_size * 256)[:sample_size]
+
+    class ListSink:
+        def __init__(self):
+            self.rows = []
+
+        def line(self, triple):
+            self.rows.append(None if triple is None else triple_to_row(*triple))
+
+    expected = ListSink()
+    parse(lines, expected, strict=True)
+    actual = ListSink()
+    parse(lines, actual, keep_predicate=is_interesting_predicate)
+    differences = 0
+    for line_number, (e, a) in enumerate(zip(expected.rows, actual.rows)):
+        if e != a:
+            differences += 1
+            logger.error('Line {}: rdflib gives {} but the fast parser {}'.format(line_number, e, a))
+    if len(expected.rows) != len(actual.rows):
+        differences += 1
+        logger.error('rdflib parsed {} triples but the fast parser {}'.format(len(expected.rows), len(actual.rows)))
+    logger.info('{} differences on {} lines'.format(differences, len(lines)))
+    return differences
 
 
 def load(
         dump_file: 'url of the Freebase RDF dump',
-        mid_textid_file: 'url of the part of the Freebase RDF dump containing type.object.id relations'
-):
+        mid_textid_file: 'url of the part of the Freebase RDF dump containing type.object.id relations',
+        batch_size: 'number of rows written per committed batch' = 10000,
+        workers: 'number of parsing worker processes, 0 to parse in the main process' = 0,
+        chunk_size: 'approximate size in bytes of the blocks of lines sent to the workers' = 4 * 1024 * 1024,
+        edges_only: 'only load the edges between topics' = False,
+        strict: 'parse the dump with rdflib instead of the fast parser' = False,
+        checkpoint_file: 'file where the loading progress is saved and resumed from' = 'progress.json',
+        bulk: 'directory where to write staging files that are imported with the database bulk loader' = None,
+        metrics_file: 'file where the load metrics are appended as JSON lines' = None,
+        prometheus_file: 'Prometheus textfile where the load metrics are written' = None,
+        metrics_interval: 'number of seconds between two reports of the load metrics' = 60
+) -> dict:
+    """
+    Returns the number of dump lines read in this run, the seconds spent in each phase and
+    in each stage of the processing of the dump lines
+    """
+    timings = {}
+    metrics = LoadMetrics(metrics_file, prometheus_file, metrics_interval)
+    start = time.perf_counter()
     engine = create_engine(get_db_url(), pool_recycle=3600)
     Base.metadata.create_all(engine)
 
-    def execute_select(statement, **args):
-        db = engine.connect()
-        try:
-            for row in db.execute(statement, **args):
-                yield row
-        except OperationalError:
-            db.close()
-            db = engine.connect()
-            for row in db.execute(statement, **args):
-                yield row
-        finally:
-            db.close()
-
-    def execute_edit(statement, **args):
-        db = engine.connect()
-        try:
-            return db.execute(statement, **args)
-        except OperationalError:
-            db.close()
-            db = engine.connect()
-            return db.execute(statement, **args)
-        finally:
-            db.close()
+    writer = BatchWriter(engine, batch_size) if bulk is None else StagingWriter(bulk, batch_size)
+    topic_ids = load_topic_ids(engine, bulk)
+    logger.info('Loaded existing topic ids, next id is {}'.format(topic_ids.next_id))
+    timings['topic_ids'] = time.perf_counter() - start
 
     @lru_cache(maxsize=4096)
     def get_topic_id_from_url(url: str) -> Optional[int]:
         input_id = url.replace('http://rdf.freebase.com/ns', '').replace('.', '/')
         if input_id.startswith('/m/') or input_id.startswith('/g/'):
-            for topic in execute_select(Topic.__table__.select(Topic.mid == input_id)):
-                return topic[0]
-            return execute_edit(insert_query(Topic), mid=input_id).inserted_primary_key[0]
+            if COMPACT_IDS and not is_mid(input_id):
+                return None  # not storable as an integer
+            topic_id = topic_ids.get_mid(input_id)
+            if topic_id is None:
+                topic_id = topic_ids.add(mid=input_id)
+                writer.add(Topic, id=topic_id, mid=input_id, textid=None)
+            return topic_id
         else:
             if len(input_id) > MAX_VARCHAR_SIZE:
                 return None
-            for topic in execute_select(Topic.__table__.select(Topic.textid == input_id)):
-                return topic[0]
-            try:
-                return execute_edit(insert_query(Topic), textid=input_id).inserted_primary_key[0]
-            except IntegrityError as e:
-                logger.error(e)
+            topic_id = topic_ids.get_textid(input_id)
+            if topic_id is None:
+                topic_id = topic_ids.add(textid=input_id)
+                writer.add(Topic, id=topic_id, mid=None, textid=input_id)
+            return topic_id
+
+    def resolve(*urls):
+        ids = []
+        for url in urls:
+            topic_id = get_topic_id_from_url(url)
+            if topic_id is None:
+                logger.warning('Not able to get mid for {}'.format(url))
                 return None
-
-    def add_to_language_column(table, s, label, max_size):
-        s_topic_id = get_topic_id_from_url(s)
-        if s_topic_id is None:
-            logger.warning('Not able to get mid for label subject {}'.format(s))
-            return
-        if len(label) >= max_size:
-            logger.error('Not able to add too long label: {}'.format(label))
-            return
-        try:
-            execute_edit(insert_query(table), topic_id=s_topic_id, language=label.language, value=label.value)
-        except IntegrityError:
-            pass  # We do not care about duplicates
-
-    def add_type(s, o, notable):
-        s_topic_id = get_topic_id_from_url(s)
-        if s_topic_id is None:
-            logger.warning('Not able to get mid for type subject {}'.format(s))
-            return
-        o_topic_id = get_topic_id_from_url(o)
-        if o_topic_id is None:
-            logger.warning('Not able to get mid for type object {}'.format(o))
-            return
-        try:
-            execute_edit(insert_query(Type), topic_id=s_topic_id, type_id=o_topic_id, notable=notable)
-        except IntegrityError:
-            if notable:
-                # We add notability
-                execute_edit(Type.__table__.update()
-                             .where(Type.topic_id == s_topic_id)
-                             .where(Type.type_id == o_topic_id)
-                             .values(notable=notable))
-
-    def add_key(s, key):
-        if not is_interesting_key(key):
-            return False
-        s_topic_id = get_topic_id_from_url(s)
-        if s_topic_id is None:
-            logger.warning('Not able to get mid for key {}'.format(s))
-            return
-        key = decode_key(key)
-        if len(key) >= MAX_VARCHAR_SIZE:
-            logger.error('Not able to add too long key: {}'.format(key))
-            return
-        try:
-            execute_edit(insert_query(Key), topic_id=s_topic_id, key=decode_key(key))
-        except IntegrityError:
-            pass
-
-    def add_property_topic_id_field(field_name, s, o):
-        s_topic_id = get_topic_id_from_url(s)
-        if s_topic_id is None:
-            logger.warning('Not able to get mid for key {}'.format(s))
-            return
-        o_topic_id = get_topic_id_from_url(o)
-        if o_topic_id is None:
-            logger.warning('Not able to get mid for key {}'.format(s))
-            return
-        try:
-            execute_edit(insert_query(Property), topic_id=s_topic_id, **{field_name: o_topic_id})
-        except IntegrityError:
-            execute_edit(
-                update_query(Property).values(**{field_name: o_topic_id}).where(Property.topic_id == s_topic_id))
-
-    def add_unique(s, o):
-        s_topic_id = get_topic_id_from_url(s)
-        if s_topic_id is None:
-            logger.warning('Not able to get mid for key {}'.format(s))
-            return
-        try:
-            execute_edit(insert_query(Property), unique=to_bool(o), topic_id=s_topic_id)
-        except IntegrityError:
-            execute_edit(update_query(Property).values(unique=to_bool(o)).where(Property.topic_id == s_topic_id))
-
-    def add_edge(s, p, o):
-        s_topic_id = get_topic_id_from_url(s)
-        if s_topic_id is None:
-            logger.warning('Not able to get mid for key {}'.format(s))
-            return
-        p_topic_id = get_topic_id_from_url(p)
-        if p_topic_id is None:
-            logger.warning('Not able to get mid for key {}'.format(p))
-            return
-        o_topic_id = get_topic_id_from_url(o)
-        if o_topic_id is None:
-            logger.warning('Not able to get mid for key {}'.format(o))
-            return
-        try:
-            execute_edit(insert_query(Edge), subject_id=s_topic_id, predicate_id=p_topic_id, object_id=o_topic_id)
-        except IntegrityError:
-            pass
-
-    def to_bool(s):
-        s = str(s)
-        if s == 'true':
-            return True
-        elif s == 'false':
-            return False
+            ids.append(topic_id)
+        return ids
+
+    def write_row(row):
+        table = row[0]
+        if table is Edge:
+            ids = resolve(row[1], row[2], row[3])
+            if ids is not None:
+                writer.add(Edge, subject_id=ids[0], predicate_id=ids[1], object_id=ids[2])
+        elif table is Type:
+            ids = resolve(row[1], row[2])
+            if ids is not None:
+                writer.add_type(ids[0], ids[1], row[3])  # notable types upgrade existing rows
+        elif table is Property:
+            if row[2] == 'unique':
+                ids = resolve(row[1])
+                value = row[3]
+            else:
+                ids = resolve(row[1], row[3])
+                value = ids[1] if ids is not None else None
+            if ids is not None:
+                writer.add_property_field(ids[0], row[2], value)
+        elif table is Key:
+            ids = resolve(row[1])
+            if ids is not None:
+                writer.add(Key, topic_id=ids[0], key=row[2])
         else:
-            raise ValueError("Unexpected value: '{}'".format(s))
+            ids = resolve(row[1])
+            if ids is not None:
+                writer.add(table, topic_id=ids[0], language=row[2], value=row[3])
+
+    progress = Path(checkpoint_file)
+
+    def save_progress(reader, cursor, uncompressed_offset=None):
+        # Only called just after a commit: a checkpoint never goes past rows that are not durable
+        save_checkpoint(progress, reader.checkpoint(cursor, writer.batches, uncompressed_offset))
+
+    def lap(stage, start):
+        now = time.perf_counter()
+        metrics.stages[stage] += now - start
+        return now
+
+    def report_metrics(reader, cursor, uncompressed_offset=None):
+        # The workers mode reads ahead, the progress is the one of the last written chunk
+        compressed_offset = reader.compressed_offset if uncompressed_offset is None \
+            else reader.compressed_offset_at(uncompressed_offset)
+        metrics.report(cursor, writer, get_topic_id_from_url.cache_info(), compressed_offset, reader.compressed_size)
 
     class TextIdSink:
-        def triple(self, s, p, o):
+        def line(self, triple):
+            if triple is None:
+                return
+            s, p, o = triple
             if p == type_object_id:
                 s = s.replace('http://rdf.freebase.com/ns', '').replace('.', '/')
                 o = o.replace('http://rdf.freebase.com/ns', '').replace('.', '/')
-                try:
-                    execute_edit(insert_query(Topic), mid=s, textid=o)
-                except IntegrityError:
-                    pass
+                if COMPACT_IDS and not is_mid(s):
+                    logger.warning('Not able to store the MID {}'.format(s))
+                elif topic_ids.get_mid(s) is None and topic_ids.get_textid(o) is None:
+                    writer.add(Topic, id=topic_ids.add(mid=s, textid=o), mid=s, textid=o)
+                    writer.maybe_flush()
             else:
                 logger.info('Unexpected triple: {} {} {}'.format(s, p, o))
 
     class TripleSink:
-        def __init__(self, start_cursor=0):
+        def __init__(self, reader, start_cursor=0):
+            self.reader = reader
             self.cursor = start_cursor
-
-        def triple(self, s, p, o):
+            self.parsed = time.perf_counter()
+
+        def line(self, triple):
+            now = lap('parse', self.parsed)
+            if triple is not None:
+                row = triple_to_row(*triple, edges_only)
+                now = lap('filter', now)
+                if row is not None:
+                    write_row(row)
+                    now = lap('resolve', now)
             self.cursor += 1
             if self.cursor % 1000000 == 0:
                 print(self.cursor)
-                with open('progress.txt', 'wt') as pfp:
-                    pfp.write(str(self.cursor))
-
-            try:
-                """
-                if p == type_object_name:
-                    add_to_language_column(Label, s, o, MAX_VARCHAR_SIZE)
-                elif p == common_topic_description:
-                    add_to_language_column(Description, s, o, sys.maxsize)
-                elif p == common_topic_alias:
-                    add_to_language_column(Alias, s, o, MAX_VARCHAR_SIZE)
-                elif p == type_object_type:
-                    add_type(s, o, False)
-                elif p == common_topic_notable_types:
-                    add_type(s, o, True)
-                elif p == type_object_key:
-                    add_key(s, o.value)
-                if p == type_property_schema:
-                    add_property_topic_id_field('schema_id', s, o)
-                elif p == type_property_expected_type:
-                    add_property_topic_id_field('expected_type_id', s, o)
-                elif p == type_property_unique:
-                    add_unique(s, o)
-                elif p == type_property_master_property:
-                    add_property_topic_id_field('master_id', s, o)
-                elif p == type_property_reverse_property:
-                    add_property_topic_id_field('reverse_id', s, o)
-                elif p == type_property_unit:
-                    add_property_topic_id_field('unit_id', s, o)
-                elif p == type_property_delegated:
-                    add_property_topic_id_field('delegated_id', s, o)
-                """
-                if isinstance(o, URIRef) and o.startswith('http://rdf.freebase.com/') and p.startswith('http://rdf.freebase.com/ns/') and not any(
-                        b in p for b in edge_blacklist):
-                    add_edge(s, p, o)
-            except ValueError:
-                pass
+            if writer.maybe_flush():
+                save_progress(self.reader, self.cursor)
+                now = lap('write', now)
+            if metrics.due():
+                report_metrics(self.reader, self.cursor)
+                now = time.perf_counter()
+            self.parsed = now
 
-    with gzip.open(mid_textid_file) as fp:
-        NTriplesParser(sink=TextIdSink()).parse(fp)
+    keep_predicate = partial(is_interesting_predicate, edges_only=edges_only)
 
-    with gzip.open(dump_file) as fp:
-        cursor = 0
-        progress = Path('progress.txt')
-        if progress.is_file():
-            with progress.open('rt') as fpc:
-                cursor = int(fpc.read().strip())
-            logger.info('Skipping the first {} lines'.format(cursor))
-        for _ in range(cursor):
-            fp.readline()
-        NTriplesParser(sink=TripleSink(cursor)).parse(fp)
+    start = time.perf_counter()
+    with gzip.open(mid_textid_file) as fp:
+        parse(fp, TextIdSink(), strict)
+    writer.flush()
+    timings['textids'] = time.perf_counter() - start
+    timings['textids_write'] = writer.flush_seconds
+
+    checkpoint = read_checkpoint(progress)
+    if checkpoint is not None:
+        logger.info('Resuming after line {} from compressed offset {}'.format(
+            checkpoint.line, checkpoint.access_point_compressed_offset))
+    start = time.perf_counter()
+    with DumpReader(dump_file, checkpoint) as reader:
+        cursor = first_line = 0 if checkpoint is None else checkpoint.line
+        metrics.start_phase('triples', first_line, reader.compressed_offset)
+        if workers > 0:
+            # Workers parse and filter line-aligned chunks, this process assigns ids and writes in input order.
+            # At most MAX_PENDING_CHUNKS_PER_WORKER chunks per worker are read ahead, so memory does not grow
+            # when writing is slower than parsing.
+            chunks = read_chunks(reader.file, chunk_size)
+            parse_function = partial(parse_chunk, edges_only=edges_only, strict=strict)
+            pending = deque()  # (parse result, dump position after the chunk)
+
+            with Pool(workers) as pool:
+                def read_ahead():
+                    while len(pending) < MAX_PENDING_CHUNKS_PER_WORKER * workers:
+                        chunk = next(chunks, None)
+                        if chunk is None:
+                            return
+                        pending.append((pool.apply_async(parse_function, (chunk,)), reader.tell()))
+
+                read_ahead()
+                waited = time.perf_counter()
+                while pending:
+                    result, chunk_end = pending.popleft()
+                    line_count, rows = result.get()
+                    read_ahead()
+                    # Parsing and filtering happen in the workers: only the time spent waiting for them is known
+                    now = lap('parse', waited)
+                    for row in rows:
+                        write_row(row)
+                    now = lap('resolve', now)
+                    if (cursor + line_count) // 1000000 > cursor // 1000000:
+                        print(cursor + line_count)
+                    cursor += line_count
+                    if writer.maybe_flush():
+                        save_progress(reader, cursor, chunk_end)
+                        lap('write', now)
+                    if metrics.due():
+                        report_metrics(reader, cursor, chunk_end)
+                    waited = time.perf_counter()
+        else:
+            sink = TripleSink(reader, cursor)
+            parse(reader.file, sink, strict, keep_predicate)
+            cursor = sink.cursor
+        now = time.perf_counter()
+        writer.close()
+        save_progress(reader, cursor)
+        lap('write', now)
+        if metrics.enabled:
+            report_metrics(reader, cursor)
+    timings['triples'] = time.perf_counter() - start
+    timings['triples_write'] = writer.flush_seconds - timings['textids_write']
+    start = time.perf_counter()
+    if bulk is not None:
+        import_staging(engine, bulk, batch_size)
+    if engine.dialect.name == 'postgresql':
+        # Ids have been assigned by the loader so the sequence has to be moved forward
+        engine.execute("SELECT setval(pg_get_serial_sequence('topics', 'id'), (SELECT MAX(id) FROM topics))")
+    timings['finish'] = time.perf_counter() - start
+    start = time.perf_counter()
+    build_incoming_edge_counts(engine)
+    timings['incoming_edge_counts'] = time.perf_counter() - start
+    logger.info('Loaded {} lines, seconds per phase: {}'.format(
+        cursor - first_line, ', '.join('{} {:.1f}'.format(phase, seconds) for phase, seconds in timings.items())))
+    return {'lines': cursor - first_line, 'seconds': timings, 'stages': dict(metrics.stages)}
 
 
 if __name__ == '__main__':
-    n = len(sys.argv[1:])
-    if n < 2:
-        sys.exit('usage: python %s dump_file type.object.key_file' % sys.argv[0])
-    elif n == 2:
-        load(sys.argv[1], sys.argv[2])
-    else:
-        sys.exit('Unrecognized arguments: %s' % ' '.join(sys.argv[3:]))
+    parser = argparse.ArgumentParser(description='Loads the Freebase RDF dump into the database')
+    parser.add_argument('dump_file', help=load.__annotations__['dump_file'])
+    parser.add_argument('mid_textid_file', help=load.__annotations__['mid_textid_file'])
+    parser.add_argument('--batch-size', type=int, default=10000, help=load.__annotations__['batch_size'])
+    parser.add_argument('--workers', type=int, default=0, help=load.__annotations__['workers'])
+    parser.add_argument('--chunk-size', type=int, default=4 * 1024 * 1024, help=load.__annotations__['chunk_size'])
+    parser.add_argument('--edges-only', action='store_true', help=load.__annotations__['edges_only'])
+    parser.add_argument('--strict', action='store_true', help=load.__annotations__['strict'])
+    parser.add_argument('--checkpoint-file', default='progress.json', help=load.__annotations__['checkpoint_file'])
+    parser.add_argument('--bulk', metavar='DIRECTORY', help=load.__annotations__['bulk'])
+    parser.add_argument('--metrics-file', help=load.__annotations__['metrics_file'])
+    parser.add_argument('--prometheus-file', help=load.__annotations__['prometheus_file'])
+    parser.add_argument('--metrics-interval', type=float, default=60, help=load.__annotations__['metrics_interval'])
+    parser.add_argument('--check-parser', type=int, metavar='LINES',
+                        help='only compare the fast parser with rdflib on the first LINES lines of the dump')
+    args = parser.parse_args()
+    if args.check_parser is not None:
+        sys.exit(1 if check_parser(args.dump_file, args.check_parser) else 0)
+    load(args.dump_file, args.mid_textid_file, batch_size=args.batch_size, workers=args.workers,
+         chunk_size=args.chunk_size, edges_only=args.edges_only, strict=args.strict,
+         checkpoint_file=args.checkpoint_file, bulk=args.bulk, metrics_file=args.metrics_file,
+         prometheus_file=args.prometheus_file, metrics_interval=args.metrics_interval)
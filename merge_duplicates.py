@@ -1,27 +1,144 @@
-from sqlalchemy import create_engine
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.sql import text
+import argparse
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, and_, create_engine, func, inspect, select
 
 from freebase.model import *
+from freebase.summaries import build_incoming_edge_counts
+from freebase.writer import insert_ignore_query
+
+# Columns referencing topics. Rows are copied then deleted for the ones in primary keys, that may collide
+# with an existing row of the merged topic, and updated in place for the others.
+_key_columns = [(Label, 'topic_id'), (Description, 'topic_id'), (Alias, 'topic_id'), (Type, 'topic_id'),
+                (Type, 'type_id'), (Key, 'topic_id'), (Property, 'topic_id'), (Edge, 'subject_id'),
+                (Edge, 'predicate_id'), (Edge, 'object_id'), (TopicSummary, 'topic_id'),
+                (IncomingEdgeCount, 'object_id'), (IncomingEdgeCount, 'predicate_id'), (SearchTerm, 'topic_id')]
+_nullable_columns = [(Property, 'schema_id'), (Property, 'expected_type_id'), (Property, 'master_id'),
+                     (Property, 'reverse_id'), (Property, 'unit_id'), (Property, 'delegated_id'),
+                     (SearchPrefix, 'topic_id')]
+
+merges = Table('topic_merges', MetaData(),
+               Column('old_id', Integer, primary_key=True, autoincrement=False),
+               Column('new_id', Integer, nullable=False),
+               Column('textid', String(MAX_VARCHAR_SIZE), nullable=False))
+
+
+def _insert_compact_duplicates(connection, batch_size: int = 1000):
+    # Compact keys can not be compared to textids in SQL, the textids are looked up as keys batch_size at a time
+    after = 0
+    while True:
+        page = connection.execute(select([Topic.id, Topic.textid]).where(Topic.textid.isnot(None))
+                                  .where(Topic.id > after).order_by(Topic.id).limit(batch_size)).fetchall()
+        if not page:
+            return
+        topic_ids = {row.textid: row.id for row in page}
+        rows = [{'old_id': topic_ids[key], 'new_id': topic_id, 'textid': key}
+                for topic_id, key in connection.execute(select([Key.topic_id, Key.key]).where(Key.key.in_(topic_ids)))
+                if topic_id != topic_ids[key]]
+        if rows:
+            connection.execute(merges.insert(), rows)
+        after = page[-1].id
+
+
+def find_duplicates(engine):
+    """
+    Fills topic_merges with the topics whose textid is a key of another topic, the one they are merged into
+    """
+    with engine.begin() as connection:
+        merges.create(connection)
+        if COMPACT_IDS:
+            _insert_compact_duplicates(connection)
+        else:
+            connection.execute(merges.insert().from_select(
+                ['old_id', 'new_id', 'textid'],
+                select([Topic.id, Key.topic_id, Topic.textid])
+                    .select_from(Topic.__table__.join(Key.__table__, Key.key == Topic.textid))
+                    .where(Key.topic_id != Topic.id)))
+
+        # A topic merged into a topic that is itself merged goes directly to the last one
+        new_ids = {row.old_id: row.new_id for row in connection.execute(
+            select([merges.c.old_id, merges.c.new_id]).where(merges.c.new_id.in_(select([merges.c.old_id]))))}
+        if new_ids:
+            all_ids = {row.old_id: row.new_id
+                       for row in connection.execute(select([merges.c.old_id, merges.c.new_id]))}
+            for old_id, new_id in new_ids.items():
+                seen = {old_id}
+                while new_id in all_ids and new_id not in seen:
+                    seen.add(new_id)
+                    new_id = all_ids[new_id]
+                if new_id in seen:
+                    print('Not merging {}: its merges form a cycle'.format(old_id))
+                    connection.execute(merges.delete().where(merges.c.old_id == old_id))
+                else:
+                    connection.execute(merges.update().where(merges.c.old_id == old_id).values(new_id=new_id))
+
+
+def merge_batch(connection, low: int, high: int):
+    """
+    Merges the topics of topic_merges with an old_id between low and high
+    """
+    batch = and_(merges.c.old_id >= low, merges.c.old_id <= high)
+    old_ids = select([merges.c.old_id]).where(batch)
+    existing = set(inspect(connection).get_table_names())
+    for model, column in _key_columns:
+        table = model.__table__
+        if table.name not in existing:
+            continue
+        connection.execute(insert_ignore_query(model, connection.dialect.name).from_select(
+            [c.name for c in table.columns],
+            select([merges.c.new_id if c.name == column else c for c in table.columns])
+                .select_from(table.join(merges, table.c[column] == merges.c.old_id))
+                .where(batch)))
+        connection.execute(table.delete().where(table.c[column].in_(old_ids)))
+    for model, column in _nullable_columns:
+        table = model.__table__
+        if table.name not in existing:
+            continue
+        connection.execute(table.update()
+                           .where(table.c[column].in_(old_ids))
+                           .values(**{column: select([merges.c.new_id])
+                                   .where(merges.c.old_id == table.c[column]).scalar_subquery()}))
+
+    topics = Topic.__table__
+    connection.execute(topics.delete().where(topics.c.id.in_(old_ids)))
+    connection.execute(topics.update()
+                       .where(topics.c.id.in_(select([merges.c.new_id]).where(batch)))
+                       .values(textid=select([func.min(merges.c.textid)])
+                               .where(merges.c.new_id == topics.c.id).where(batch).scalar_subquery()))
+    connection.execute(merges.delete().where(batch))
+
+
+def merge_duplicates(engine, batch_size: int = 1000):
+    """
+    Merges the topics whose textid is a key of another topic into that topic.
+
+    The merges are saved in the topic_merges table and applied batch_size topics per transaction,
+    so an interrupted run continues where it stopped when started again.
+    """
+    if inspect(engine).has_table(merges.name):
+        print('Resuming the previous run')
+    else:
+        find_duplicates(engine)
+    total = engine.execute(select([func.count()]).select_from(merges)).scalar()
+    print('Merging {} topics'.format(total))
+    done = 0
+    while True:
+        old_ids = [row.old_id for row in engine.execute(
+            select([merges.c.old_id]).order_by(merges.c.old_id).limit(batch_size))]
+        if not old_ids:
+            break
+        with engine.begin() as connection:
+            merge_batch(connection, old_ids[0], old_ids[-1])
+        done += len(old_ids)
+        print('Merged {}/{} topics'.format(done, total))
+    merges.drop(engine)
+    if inspect(engine).has_table(IncomingEdgeCount.__tablename__):
+        # The counts of the merged topics have been moved, not added
+        build_incoming_edge_counts(engine)
+
 
-engine = create_engine(get_db_url())
-db = engine.connect()
-
-rows = list(db.execute(text('SELECT id,topic_id,textid FROM topics,`keys` WHERE `key` = textid AND topic_id != id')))
-print('Updating {} topics'.format(len(rows)))
-for (from_id, to_id, text_id) in rows:
-    print('{}: {} -> {}'.format(text_id, from_id, to_id))
-
-    db.execute(text(
-        'UPDATE types AS t1 LEFT JOIN types AS t2 ON t1.topic_id = t2.topic_id AND t2.type_id = {} SET t1.type_id = {} WHERE t1.type_id = {} AND t2.topic_id IS NULL'.format(
-            to_id, to_id, from_id)))
-    db.execute('DELETE FROM types WHERE type_id = {}'.format(from_id))  # we drop duplicates
-    for table in ['labels', 'descriptions', 'aliases', 'types', 'keys']:
-        db.execute(text('UPDATE IGNORE `{}` SET topic_id = {} WHERE topic_id = {}'.format(table, to_id, from_id)))
-        db.execute(text('DELETE FROM `{}` WHERE topic_id = {}'.format(table, from_id)))
-    db.execute(text('DELETE FROM topics WHERE id = {}'.format(from_id)))
-    try:
-        db.execute(text('UPDATE topics SET textid = "{}" WHERE id = {}'.format(text_id, to_id)))
-    except IntegrityError:
-        pass
-db.close()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Merges the topics whose textid is the key of another topic into this other topic')
+    parser.add_argument('--batch-size', type=int, default=1000, help='number of topics merged per transaction')
+    args = parser.parse_args()
+    merge_duplicates(create_engine(get_db_url()), args.batch_size)
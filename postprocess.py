@@ -0,0 +1,20 @@
+import argparse
+
+from sqlalchemy import create_engine
+
+from freebase.model import get_db_url
+from freebase.summaries import build_incoming_edge_counts, build_topic_summaries
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Builds the topic_summaries table used by the web app once the dump is loaded')
+    parser.add_argument('--batch-size', type=int, default=1000000, help='number of topic ids per query')
+    parser.add_argument('--incoming-edge-counts', action='store_true',
+                        help='only build the reverse index of the edges and the incoming_edge_counts table, '
+                             'as done at the end of load.py, for databases loaded before')
+    args = parser.parse_args()
+    engine = create_engine(get_db_url(), pool_recycle=3600)
+    if args.incoming_edge_counts:
+        build_incoming_edge_counts(engine, args.batch_size)
+    else:
+        build_topic_summaries(engine, args.batch_size)
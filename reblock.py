@@ -0,0 +1,13 @@
+import argparse
+
+from freebase.checkpoint import reblock
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Rewrites a gzipped dump as small gzip members so that load.py can resume loading quickly')
+    parser.add_argument('input_file', help='gzipped N-Triples dump')
+    parser.add_argument('output_file', help='where to write the new gzipped dump')
+    parser.add_argument('--block-size', type=int, default=16 * 1024 * 1024,
+                        help='approximate uncompressed size of each gzip member')
+    args = parser.parse_args()
+    reblock(args.input_file, args.output_file, args.block_size)
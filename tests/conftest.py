@@ -0,0 +1,42 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from benchmarks.synthetic import SyntheticDump, generate_dump  # noqa: E402
+
+TOPICS = 300
+
+
+@pytest.fixture(scope='session')
+def dump(tmp_path_factory) -> SyntheticDump:
+    return generate_dump(str(tmp_path_factory.mktemp('dump')), TOPICS)
+
+
+@pytest.fixture(scope='session')
+def database(dump, tmp_path_factory) -> str:
+    """
+    Path of a SQLite database loaded with the synthetic dump, used by freebase.web.
+    Every MID has a Wikidata mapping row so that no page calls the online fallback.
+    """
+    from benchmarks.run import prepare_web_database
+    from load import load
+
+    directory = tmp_path_factory.mktemp('database')
+    path = directory / 'freebase.db'
+    os.environ['FREEBASE_DATABASE_URL'] = 'sqlite:///{}'.format(path)
+    for name in ('FREEBASE_SNAPSHOT', 'FREEBASE_CACHE_DIR', 'FREEBASE_COMPACT_IDS'):
+        os.environ.pop(name, None)
+    load(dump.dump_file, dump.mid_textid_file, batch_size=1000, checkpoint_file=str(directory / 'progress.json'))
+    prepare_web_database(dump, summaries=False)
+    return str(path)
+
+
+@pytest.fixture(scope='session')
+def web(database):
+    # The web app creates its engine when imported
+    from freebase import web
+    return web
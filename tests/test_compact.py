@@ -0,0 +1,44 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+from sqlalchemy import create_engine, select
+
+from freebase.model import Key, Topic, WikidataMapping
+
+_ROOT = Path(__file__).parent.parent
+# Run in another process as the column types are chosen when freebase.model is imported
+_CONVERT = '''
+import json, sys
+from sqlalchemy import create_engine, select
+from freebase.compact import compact_ids
+from freebase.model import Key, Topic, WikidataMapping
+engine = create_engine(sys.argv[1])
+compact_ids(engine, batch_size=100)
+compact_ids(engine, batch_size=100)  # converted tables are skipped
+print(json.dumps([sorted(map(list, engine.execute(select([table.__table__]))))
+                  for table in (Topic, WikidataMapping, Key)]))
+'''
+
+
+def test_compact_ids(database, tmp_path):
+    path = tmp_path / 'compact.db'
+    shutil.copy(database, str(path))
+    engine = create_engine('sqlite:///{}'.format(database))
+    expected = [sorted(map(list, engine.execute(select([table.__table__]))))
+                for table in (Topic, WikidataMapping, Key)]
+    engine.dispose()
+
+    output = subprocess.run([sys.executable, '-c', _CONVERT, 'sqlite:///{}'.format(path)], cwd=str(_ROOT),
+                            env=dict(os.environ, FREEBASE_COMPACT_IDS='1'), check=True, stdout=subprocess.PIPE)
+    assert json.loads(output.stdout) == expected
+
+    engine = create_engine('sqlite:///{}'.format(path))
+    raw_mid, raw_key = engine.execute('SELECT (SELECT mid FROM topics WHERE mid IS NOT NULL LIMIT 1), '
+                                      '(SELECT key FROM keys LIMIT 1)').first()
+    engine.dispose()
+    assert isinstance(raw_mid, int)
+    assert isinstance(raw_key, bytes)
@@ -0,0 +1,53 @@
+from sqlalchemy import create_engine, select
+
+from freebase.export import encode_key, export
+from freebase.model import Topic
+from freebase.writer import FLUSH_ORDER
+from load import decode_key, load
+
+
+def test_key_escapes():
+    assert decode_key(encode_key('/wikipedia/fr/Élan_(film)')) == '/wikipedia/fr/Élan_(film)'
+
+
+def _load(dump_file: str, mid_textid_file: str, directory, monkeypatch) -> str:
+    url = 'sqlite:///{}'.format(directory / 'freebase.db')
+    monkeypatch.setenv('FREEBASE_DATABASE_URL', url)
+    load(dump_file, mid_textid_file, batch_size=1000, checkpoint_file=str(directory / 'progress.json'))
+    return url
+
+
+def _rows(url: str) -> dict:
+    """
+    Rows of the loaded tables with the topic ids replaced by the MID and textid of the topics, that do not depend
+    on the order in which the loader found them
+    """
+    engine = create_engine(url)
+    try:
+        topics = {row.id: (row.mid, row.textid)
+                  for row in engine.execute(select([Topic.id, Topic.mid, Topic.textid]))}
+        rows = {}
+        for table in FLUSH_ORDER[1:]:
+            columns = list(table.__table__.columns)
+            rows[table.__tablename__] = sorted(
+                [tuple(topics.get(value) if column.foreign_keys else value for column, value in zip(columns, row))
+                 for row in engine.execute(select([table.__table__]))], key=repr)
+        rows['topics'] = sorted(topics.values(), key=repr)
+        return rows
+    finally:
+        engine.dispose()
+
+
+def test_export_round_trip(dump, tmp_path, monkeypatch):
+    (tmp_path / 'original').mkdir()
+    (tmp_path / 'exported').mkdir()
+    url = _load(dump.dump_file, dump.mid_textid_file, tmp_path / 'original', monkeypatch)
+    engine = create_engine(url)
+    output = str(tmp_path / 'export.nt.gz')
+    try:
+        assert export(engine, output, batch_size=100) == len(_rows(url)['topics'])
+    finally:
+        engine.dispose()
+    # The export contains the type.object.id triples, it is also its own type.object.id file
+    exported_url = _load(output, output, tmp_path / 'exported', monkeypatch)
+    assert _rows(exported_url) == _rows(url)
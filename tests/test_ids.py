@@ -0,0 +1,52 @@
+import pytest
+
+from freebase.ids import KEY_NAMESPACES, TopicIdMap, bytes_to_key, int_to_mid, is_mid, key_to_bytes, mid_to_int
+
+
+def test_mid_round_trip(dump):
+    for mid in dump.mids + ['/m/0', '/m/0000', '/g/11b6_x9zq1', '/g/1']:
+        assert int_to_mid(mid_to_int(mid)) == mid
+
+
+def test_mid_packing_is_injective():
+    mids = ['/m/0', '/m/00', '/g/0', '/m/0bc', '/g/0bc']
+    assert len({mid_to_int(mid) for mid in mids}) == len(mids)
+    assert all(mid_to_int(mid) < 2 ** 55 for mid in mids)
+
+
+def test_topic_id_map(dump):
+    ids = TopicIdMap(bucket_bits=2)
+    assigned = {mid: ids.add(mid=mid) for mid in dump.mids}  # enough MIDs per bucket to merge them
+    assigned['/m/not_packable'] = ids.add(mid='/m/not_packable')
+    textid_id = ids.add(textid='/en/foo')
+    assert all(ids.get_mid(mid) == topic_id for mid, topic_id in assigned.items())
+    assert ids.get_textid('/en/foo') == textid_id
+    assert ids.get_mid('/m/0bcdfg') is None
+    assert ids.get_textid('/en/bar') is None
+
+    reloaded = TopicIdMap.from_rows([(topic_id, mid, None) for mid, topic_id in assigned.items()] +
+                                    [(textid_id, None, '/en/foo')], bucket_bits=2)
+    assert all(reloaded.get_mid(mid) == topic_id for mid, topic_id in assigned.items())
+    assert reloaded.get_textid('/en/foo') == textid_id
+    assert reloaded.next_id == ids.next_id
+
+
+@pytest.mark.parametrize('value', ['/en/foo', '/m/', '/m/0abc', '/m/0123456789b', '/x/0bc', '/m/0bé'])
+def test_invalid_mids(value):
+    assert not is_mid(value)
+    with pytest.raises(ValueError):
+        mid_to_int(value)
+
+
+@pytest.mark.parametrize('key', ['/wikipedia/en/Foo_(film)', '/wikipedia/en_id/123', '/authority/imdb/name/nm1',
+                                 '/authority/other/x', '/unknown/ns/x', '/wikipedia/fr/Élan_$', ''])
+def test_key_round_trip(key):
+    data = key_to_bytes(key)
+    assert bytes_to_key(data) == key
+    assert bytes_to_key(memoryview(data)) == key
+
+
+def test_key_uses_longest_namespace():
+    data = key_to_bytes('/authority/imdb/name/nm1')
+    assert KEY_NAMESPACES[data[0]] == '/authority/imdb/name/'
+    assert data[1:] == b'nm1'
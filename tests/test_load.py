@@ -0,0 +1,100 @@
+import gzip
+
+import pytest
+
+from load import check_parser, parse_chunk, read_chunks
+
+
+def test_fast_parser_matches_rdflib(dump):
+    assert check_parser(dump.dump_file, dump.lines) == 0
+
+
+def test_chunks_give_the_rows_of_the_whole_dump(dump):
+    with gzip.open(dump.dump_file) as fp:
+        whole = parse_chunk(fp.read())
+    with gzip.open(dump.dump_file) as fp:
+        chunks = [parse_chunk(chunk) for chunk in read_chunks(fp, 4096)]
+    assert sum(count for count, _ in chunks) == whole[0] == dump.lines
+    assert [row for _, rows in chunks for row in rows] == whole[1]
+
+
+def test_metrics_ignored_rows(tmp_path):
+    from sqlalchemy import create_engine
+
+    from freebase.bulk import StagingWriter
+    from freebase.metrics import LoadMetrics, to_prometheus
+    from freebase.model import Base, Topic
+    from freebase.writer import BatchWriter
+
+    engine = create_engine('sqlite:///{}'.format(tmp_path / 'metrics.db'))
+    Base.metadata.create_all(engine)
+    for writer, ignored in [(BatchWriter(engine), 1), (StagingWriter(str(tmp_path / 'staging')), None)]:
+        if not engine.dialect.supports_sane_multi_rowcount and isinstance(writer, BatchWriter):
+            ignored = None
+        writer.add(Topic, id=1, mid='/m/01')
+        writer.add(Topic, id=1, mid='/m/01')
+        writer.flush()
+        values = LoadMetrics().collect(2, writer)
+        assert values['tables']['topics']['rows'] == 2
+        assert values['tables']['topics']['ignored'] == ignored
+        assert ('freebase_load_ignored_rows_total{table="topics"}' in to_prometheus(values)) == (ignored is not None)
+
+
+def _load_rows(dump_file, mid_textid_file, directory, monkeypatch, **options):
+    from sqlalchemy import create_engine, select
+
+    from freebase.writer import FLUSH_ORDER
+    from load import load
+
+    path = directory / 'freebase.db'
+    monkeypatch.setenv('FREEBASE_DATABASE_URL', 'sqlite:///{}'.format(path))
+    load(dump_file, mid_textid_file, batch_size=500, checkpoint_file=str(directory / 'progress.json'), **options)
+    engine = create_engine('sqlite:///{}'.format(path))
+    try:
+        return {table.__tablename__: sorted(map(tuple, engine.execute(select([table.__table__]))))
+                for table in FLUSH_ORDER}
+    finally:
+        engine.dispose()
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_resume_after_crash(dump, tmp_path, monkeypatch, workers):
+    import load as load_module
+
+    # Several gzip members so that resuming restarts from one in the middle of the file
+    dump_file = str(tmp_path / 'members.nt.gz')
+    with gzip.open(dump.dump_file) as fp:
+        lines = fp.readlines()
+    with open(dump_file, 'wb') as fp:
+        for start in range(0, len(lines), 1000):
+            fp.write(gzip.compress(b''.join(lines[start:start + 1000])))
+
+    (tmp_path / 'expected').mkdir()
+    expected = _load_rows(dump_file, dump.mid_textid_file, tmp_path / 'expected', monkeypatch,
+                          workers=workers, chunk_size=4096)
+
+    class CrashingWriter(load_module.BatchWriter):
+        def flush(self):
+            if self.batches == 5:
+                raise RuntimeError('crash')  # before writing anything, as a killed process
+            super().flush()
+
+    (tmp_path / 'resumed').mkdir()
+    monkeypatch.setattr(load_module, 'BatchWriter', CrashingWriter)
+    with pytest.raises(RuntimeError):
+        _load_rows(dump_file, dump.mid_textid_file, tmp_path / 'resumed', monkeypatch,
+                   workers=workers, chunk_size=4096)
+    checkpoint = load_module.read_checkpoint(tmp_path / 'resumed' / 'progress.json')
+    assert 0 < checkpoint.line < len(lines)
+    assert checkpoint.access_point_compressed_offset > 0
+    monkeypatch.undo()
+    assert _load_rows(dump_file, dump.mid_textid_file, tmp_path / 'resumed', monkeypatch,
+                      workers=workers, chunk_size=4096) == expected
+
+
+def test_bulk_load_gives_the_rows_of_a_normal_load(dump, tmp_path, monkeypatch):
+    (tmp_path / 'normal').mkdir()
+    (tmp_path / 'bulk').mkdir()
+    expected = _load_rows(dump.dump_file, dump.mid_textid_file, tmp_path / 'normal', monkeypatch)
+    assert _load_rows(dump.dump_file, dump.mid_textid_file, tmp_path / 'bulk', monkeypatch,
+                      bulk=str(tmp_path / 'bulk' / 'staging')) == expected
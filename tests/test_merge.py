@@ -0,0 +1,56 @@
+import shutil
+
+from sqlalchemy import Boolean, Integer, create_engine, func, select
+
+from freebase.model import Base, Key, Topic
+from merge_duplicates import merge_duplicates
+
+_FIRST_ID = 10 ** 6
+
+
+def _topic_columns():
+    return [(table, column) for table in Base.metadata.sorted_tables for column in table.columns
+            if any(key.column is Topic.__table__.c.id for key in column.foreign_keys)]
+
+
+def _row(table, column, duplicate_id: int, other_ids) -> dict:
+    # column references the duplicate, the other columns referencing topics get unused topics
+    row = {}
+    for c in table.columns:
+        if c is column:
+            row[c.name] = duplicate_id
+        elif c.foreign_keys:
+            row[c.name] = next(other_ids)
+        elif isinstance(c.type, Boolean):
+            row[c.name] = False
+        elif isinstance(c.type, Integer):
+            row[c.name] = 1
+        else:
+            row[c.name] = '{}/{}'.format(table.name, column.name)
+    return row
+
+
+def test_merge_duplicates_rewrites_every_topic_reference(database, tmp_path):
+    path = tmp_path / 'merge.db'
+    shutil.copy(database, str(path))
+    engine = create_engine('sqlite:///{}'.format(path))
+    Base.metadata.create_all(engine)
+    columns = _topic_columns()
+    duplicate_id, target_id = _FIRST_ID, _FIRST_ID + 1
+    other_ids = iter(range(_FIRST_ID + 2, _FIRST_ID + 2 + 10 * len(columns)))
+    rows = [(table, _row(table, column, duplicate_id, other_ids)) for table, column in columns]
+    engine.execute(Topic.__table__.insert(), [{'id': topic_id, 'textid': '/test/topic_{}'.format(topic_id)}
+                                              for topic_id in range(_FIRST_ID + 1, next(other_ids))])
+    engine.execute(Topic.__table__.insert(), {'id': duplicate_id, 'textid': '/test/duplicate'})
+    engine.execute(Key.__table__.insert(), {'topic_id': target_id, 'key': '/test/duplicate'})
+    for table, row in rows:
+        engine.execute(table.insert(), row)
+
+    merge_duplicates(engine)
+
+    for table, column in columns:
+        count = select([func.count()]).select_from(table)
+        assert engine.execute(count.where(column == duplicate_id)).scalar() == 0, column
+        assert engine.execute(count.where(column == target_id)).scalar() > 0, column
+    assert engine.execute(select([Topic.id]).where(Topic.textid == '/test/duplicate')).fetchall() == [(target_id,)]
+    engine.dispose()
@@ -0,0 +1,47 @@
+import random
+
+from sqlalchemy import create_engine, func, select
+
+from freebase import search as search_module
+from freebase.model import SearchPrefix, SearchTerm
+from freebase.search import SEARCH_RESULTS, build_search_index, search, successor
+
+PREFIX_MIN_TERMS = 20
+
+
+def _expected(connection, prefix: str):
+    score = func.max(SearchTerm.score).label('score')
+    return [row.topic_id for row in connection.execute(
+        select([SearchTerm.topic_id, score])
+            .where(SearchTerm.term >= prefix).where(SearchTerm.term < successor(prefix))
+            .group_by(SearchTerm.topic_id).order_by(score.desc(), SearchTerm.topic_id).limit(SEARCH_RESULTS))]
+
+
+def test_search(web, database, monkeypatch):
+    monkeypatch.setattr(search_module, 'PREFIX_MIN_TERMS', PREFIX_MIN_TERMS)
+    engine = create_engine('sqlite:///{}'.format(database))
+    build_search_index(engine)
+    with engine.connect() as connection:
+        terms = [term for term, in connection.execute(select([SearchTerm.term]).distinct())]
+        ranked = {prefix for prefix, in connection.execute(select([SearchPrefix.prefix]).distinct())}
+        assert any(len(prefix) > 8 for prefix in ranked)
+        prefixes = sorted({term[:length] for term in terms for length in range(1, len(term) + 1)})
+        # Normalized queries have no surrounding spaces
+        prefixes = [prefix for prefix in prefixes if prefix == prefix.strip()]
+        for prefix in random.Random(0).sample(prefixes, 300) + [p for p in sorted(ranked) if p == p.strip()]:
+            matching = connection.execute(select([func.count()]).select_from(SearchTerm)
+                                          .where(SearchTerm.term >= prefix)
+                                          .where(SearchTerm.term < successor(prefix))).scalar()
+            # The prefixes that are not ranked in advance are ranked from a bounded scan
+            assert prefix in ranked or matching <= PREFIX_MIN_TERMS
+            assert [topic_id for topic_id, _ in search(connection, prefix)] == _expected(connection, prefix)
+    engine.dispose()
+
+    web.search_available.cache_clear()
+    client = web.app.test_client()
+    query = terms[0]
+    api = client.get('/api/search', query_string={'q': query}).get_json()
+    assert api['results']
+    page = client.get('/search', query_string={'q': query})
+    assert page.status_code == 200 and page.mimetype == 'text/html'
+    assert all(result['url'] in page.get_data(as_text=True) for result in api['results'])
@@ -0,0 +1,29 @@
+import random
+
+from sqlalchemy import create_engine
+
+from freebase.model import Topic
+from freebase.snapshot import Snapshot, write_snapshot
+
+
+def _pages(web, paths):
+    pages = {}
+    for path in paths:
+        with web.app.test_request_context(path):
+            pages[path] = web.render_entity(path, 'text/html').body
+            pages[path + '/incoming'] = web.app.test_client().get(path + '/incoming?limit=3').get_data()
+    return pages
+
+
+def test_snapshot_pages(web, database, tmp_path, monkeypatch):
+    engine = create_engine('sqlite:///{}'.format(database))
+    write_snapshot(engine, str(tmp_path))
+    mids = sorted(mid for mid, in engine.execute(Topic.__table__.select().with_only_columns([Topic.mid]))
+                  if mid is not None)
+    engine.dispose()
+    paths = random.Random(0).sample(mids, 50)
+
+    expected = _pages(web, paths)
+    assert any(b'/incoming' in page for page in expected.values())
+    monkeypatch.setattr(web, 'snapshot', Snapshot(str(tmp_path)))
+    assert _pages(web, paths) == expected
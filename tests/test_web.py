@@ -0,0 +1,224 @@
+import random
+
+import pytest
+from sqlalchemy import create_engine, func
+
+from freebase.model import Edge, Key, Label, Topic, WikidataMapping
+from freebase.summaries import build_topic_summaries
+
+
+def _sample_topics(web, count: int = 30):
+    db = web.Session()
+    try:
+        topic_ids = [topic_id for topic_id, in db.query(Topic.id).order_by(Topic.id)]
+    finally:
+        db.close()
+    return random.Random(0).sample(topic_ids, count)
+
+
+def _max_queries(web, topic_ids) -> int:
+    maximum = 0
+    for topic_id in topic_ids:
+        db = web.Session()
+        try:
+            with web.app.test_request_context('/'), web.QueryCounter(web.engine) as counter:
+                topic = web.load_topic(db, id=topic_id)
+                web.to_full_dict(topic, [])  # the page does not read other relationships
+            maximum = max(maximum, counter.count)
+        finally:
+            db.close()
+    return maximum
+
+
+def _jsonld(web, topic_ids) -> list:
+    db = web.Session()
+    try:
+        documents = [web.load_topic(db, id=topic_id).jsonld for topic_id in topic_ids]
+    finally:
+        db.close()
+    for document in documents:
+        for key in ('name', 'description'):
+            document[key].sort(key=lambda value: value['@language'])
+    return documents
+
+
+def test_load_topic_query_count(web, database):
+    topic_ids = _sample_topics(web)
+    web.summaries_available.cache_clear()
+    assert not web.summaries_available()
+    assert _max_queries(web, topic_ids) <= 8
+    expected = _jsonld(web, topic_ids)
+
+    engine = create_engine('sqlite:///{}'.format(database))
+    build_topic_summaries(engine)
+    engine.dispose()
+    web.summaries_available.cache_clear()
+    try:
+        assert web.summaries_available()
+        assert _max_queries(web, topic_ids) <= 7
+        assert _jsonld(web, topic_ids) == expected
+    finally:
+        web.summaries_available.cache_clear()
+
+
+def test_language_preferences(web):
+    def preferences(header):
+        with web.app.test_request_context('/', headers={'Accept-Language': header}):
+            return web.language_preferences()
+
+    assert preferences('fr-FR,fr;q=0.9,en;q=0.8,de;q=0.7') == preferences('fr-fr, fr;q=0.9, en;q=0.8, it;q=0.1')
+    assert preferences('fr, en;q=0.5') != preferences('de, en;q=0.5')
+    assert preferences('fr;q=0.5, de;q=0.5, en;q=0.5') != preferences('fr;q=0.5, en;q=0.5')
+    assert preferences('de;q=0, *') != preferences('*')
+
+
+def _follow_pages(client, url):
+    edges = []
+    while url is not None:
+        response = client.get(url, headers={'Accept': 'application/json'})
+        assert response.status_code == 200
+        page = response.get_json()
+        edges.extend(page['edges'])
+        url = page['next']
+    return edges
+
+
+def test_edges_pagination(web, monkeypatch):
+    monkeypatch.setattr(web, 'EDGE_PAGE_SIZE', 4)  # the pages of the database are smaller than the listing ones
+    db = web.Session()
+    try:
+        topic_id, count = db.query(Edge.subject_id, func.count()).group_by(Edge.subject_id) \
+            .order_by(func.count().desc()).first()
+        topic = db.query(Topic).get(topic_id)
+        path = topic.mid or topic.textid
+    finally:
+        db.close()
+    assert count > 10
+    client = web.app.test_client()
+    everything = _follow_pages(client, path + '/edges')
+    assert len(everything) == count
+    for limit in (1, 3, count - 1, count, count + 1):
+        assert _follow_pages(client, '{}/edges?limit={}'.format(path, limit)) == everything
+    pairs = [(edge['predicate']['url'], edge['object']['url']) for edge in everything]
+    assert len(set(pairs)) == count
+
+    predicate = everything[-1]['predicate']['url']
+    expected = [edge for edge in everything if edge['predicate']['url'] == predicate]
+    assert _follow_pages(client, '{}/edges?limit=2&predicate={}'.format(path, predicate)) == expected
+
+
+def test_google_redirect(web, monkeypatch):
+    lookups = []
+
+    class Fallback:
+        timeout = 5
+
+        @staticmethod
+        def lookup(mid, timeout=None):
+            lookups.append((mid, timeout))
+            return {'mid': mid, 'item': None, 'label': 'Online label'}
+
+    monkeypatch.setattr(web, 'wikidata_fallback', Fallback)
+    mid = '/m/0test_google'
+    db = web.Session()
+    try:
+        labelled = db.query(Topic).join(Topic.labels).filter(Topic.mid.isnot(None), Label.language == 'en').first().mid
+        db.add(Topic(id=10 ** 6 + 1, mid=mid))
+        db.add(WikidataMapping(mid=mid, item=None, label='Stored label'))
+        db.commit()
+    finally:
+        db.close()
+    client = web.app.test_client()
+    try:
+        assert client.get('/google' + labelled, headers={'Accept-Language': 'en'}).status_code == 303
+        response = client.get('/google' + mid)
+        assert response.status_code == 303
+        assert response.headers['Location'].endswith('&q=Stored+label')
+        assert not lookups
+
+        web.engine.execute(WikidataMapping.__table__.delete().where(WikidataMapping.mid == mid))
+        response = client.get('/google' + mid)
+        assert response.headers['Location'].endswith('&q=Online+label')
+        assert lookups == [(mid, 5)]  # the redirect waits for the whole lookup
+        assert client.get('/google/m/0missing').status_code == 404
+    finally:
+        web.engine.execute(WikidataMapping.__table__.delete().where(WikidataMapping.mid == mid))
+        web.engine.execute(Topic.__table__.delete().where(Topic.mid == mid))
+        web.resolve_path.cache_clear()
+
+
+def test_pages_waiting_for_wikidata_are_not_cached(web, monkeypatch):
+    class Fallback:
+        @staticmethod
+        def lookup(mid, timeout=None):
+            return None  # still running
+
+    monkeypatch.setattr(web, 'wikidata_fallback', Fallback)
+    monkeypatch.setattr(web, 'response_cache', web.ResponseCache(1024 * 1024))
+    db = web.Session()
+    try:
+        mapped, unmapped = [topic.mid for topic in db.query(Topic).filter(Topic.mid.isnot(None)).limit(2)]
+    finally:
+        db.close()
+    web.engine.execute(WikidataMapping.__table__.delete().where(WikidataMapping.mid == unmapped))
+    client = web.app.test_client()
+
+    response = client.get(mapped)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'public, max-age={}'.format(web.CACHE_MAX_AGE)
+    assert client.get(mapped, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    for _ in range(2):
+        response = client.get(unmapped)
+        assert response.status_code == 200
+        assert response.headers['Cache-Control'] == 'no-cache'
+        assert 'ETag' not in response.headers
+    with web.app.test_request_context(unmapped):
+        assert web.response_cache.get(web.entity_cache_key(unmapped)[1]) is None
+
+
+def test_resolve_priority(web):
+    # The MID of a topic, then the textid of a topic, then a key
+    db = web.Session()
+    try:
+        (mid_id, mid), (key_id, _) = db.query(Topic.id, Topic.mid).filter(Topic.mid.isnot(None)).limit(2)
+        textid_id, textid = 10 ** 6, '/test/resolve_priority'
+        keys = [mid, textid, '/test/only_key']
+        db.add(Topic(id=textid_id, textid=textid))
+        db.add_all([Key(topic_id=key_id, key=key) for key in keys])
+        db.commit()
+    finally:
+        db.close()
+    expected = {mid: mid_id, textid: textid_id, '/test/only_key': key_id}
+    web.resolve_path.cache_clear()
+    db = web.Session()
+    try:
+        with web.app.app_context():
+            for path, topic_id in expected.items():
+                assert web.resolve_path(path).id == topic_id
+            assert web.resolve_path('/test/missing') is None
+        resolved = web.resolve_paths(db, list(expected) + ['/test/missing', '/m/0abc'])
+        assert {path: found.id for path, found in resolved.items()} == expected
+    finally:
+        db.query(Key).filter(Key.key.in_(keys)).delete(synchronize_session=False)
+        db.query(Topic).filter(Topic.id == textid_id).delete(synchronize_session=False)
+        db.commit()
+        db.close()
+        web.resolve_path.cache_clear()
+
+
+@pytest.mark.parametrize('body', [b'not json', b'"/m/0abc"', b'[1, 2]', b'{"other": []}', b'{"ids": [null]}'])
+def test_topics_api_bad_request(web, body):
+    response = web.app.test_client().post('/api/topics', data=body, content_type='application/json')
+    assert response.status_code == 400
+
+
+def test_topics_api_too_many_ids(web):
+    client = web.app.test_client()
+    ids = ['/m/0abc'] * (web.API_BATCH_SIZE + 1)
+    assert client.post('/api/topics', json=ids).status_code == 413
+    assert client.post('/api/topics', json={'ids': ids}).status_code == 413
+    response = client.post('/api/topics', json=['/m/0abc', '/m/0000000'])
+    assert response.status_code == 200
+    assert [(item['id'], item['topic'] is None) for item in response.get_json()] == \
+        [('/m/0abc', True), ('/m/0000000', False)]
@@ -0,0 +1,35 @@
+import threading
+
+from freebase.wikidata import WikidataFallback
+
+
+class _Fallback(WikidataFallback):
+    def __init__(self, **options):
+        super().__init__(None, **options)
+        self.release = threading.Event()
+        self.release.set()
+
+    def _fetch_and_store(self, mid: str) -> dict:
+        self.release.wait()
+        return {'mid': mid, 'item': None, 'label': None}
+
+
+def test_lookup_of_a_finished_future():
+    fallback = _Fallback()
+    future = fallback.submit('/m/0abc')
+    future.result()
+    for _ in range(100):  # the done callback may be called when it is registered
+        assert fallback.lookup('/m/0abc', timeout=1) == {'mid': '/m/0abc', 'item': None, 'label': None}
+
+
+def test_pending_lookups_are_bounded():
+    fallback = _Fallback(workers=1, max_pending=2)
+    fallback.release.clear()
+    first = fallback.submit('/m/01')
+    assert fallback.submit('/m/01') is first
+    assert fallback.submit('/m/02') is not None
+    assert fallback.submit('/m/03') is None
+    assert fallback.lookup('/m/03') is None
+    fallback.release.set()
+    first.result()
+    assert fallback.lookup('/m/03', timeout=1) is not None